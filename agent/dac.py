@@ -5,6 +5,7 @@ from torch import nn
 from torch.nn import functional as F
 
 from helpers.dac_helper import pre_process, layer_init
+from helpers.common_helper import linear_input
 
 class DAC_SingleOptionNet(nn.Module):
     """option policy and termination network for a single option"""
@@ -74,9 +75,9 @@ class DAC_Network(nn.Module):
         self.train(mode=True)
 
     def forward(self, state):
-        """state: raw state as tensor.shape[batch_size, state_dim]"""
+        """state: raw state as tensor.shape[batch_size, state_dim] or state indices tensor.shape[batch_size]"""
         x = state
-        x = self.phi_fc1(x) #get shared state representation
+        x = linear_input(self.phi_fc1, x) #get shared state representation
 
         #pass through each option network and stack outputs
         pi_w = []
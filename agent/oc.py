@@ -8,6 +8,7 @@ import sys
 from math import exp
 import numpy as np
 from helpers.oc_helper import pre_process
+from helpers.common_helper import linear_input
 
 class OC_SingleOptionNet(nn.Module):
     """Class for a single option policy"""
@@ -65,7 +66,7 @@ class OC_Network(nn.Module):
         if obs.ndim < 4:
             obs = obs.unsqueeze(0)
         obs = obs.to(self.device)
-        state = self.features(obs)
+        state = linear_input(self.features, obs)
         return state
 
     def get_Q(self, state):
@@ -117,28 +118,60 @@ class OC_Network(nn.Module):
 
         return action.item(), logp, entropy
 
+    def step_cache(self, obs):
+        """single forward pass for one observation, shared by action selection, termination sampling and
+            the actor loss. state and betas keep their graph (actor loss), Q is computed without grad.
+            Option logits are filled in lazily, only for the options that are actually queried"""
+        state = self.get_state(pre_process(obs))
+        with th.no_grad():
+            Q = self.get_Q(state)
+        return {'state': state,         #features: tensor.shape[1, feature_dim]
+                'Q': Q,                 #option values: tensor.shape[1, num_options]
+                'betas': self.get_betas(state),     #option terminations: tensor.shape[1, num_options]
+                'logits': {}}           #option -> sub-policy logits
+
+    def option_logits(self, cache, option):
+        if option not in cache['logits']:
+            cache['logits'][option] = self.options[option](cache['state'])
+        return cache['logits'][option]
+
+    def sample_action(self, cache, option, temperature):
+        """get_action on a step cache"""
+        logits = self.option_logits(cache, option)
+        action_dist = Categorical((logits / temperature).softmax(dim=-1))
+        action = action_dist.sample()
+        return action.item(), action_dist.log_prob(action), action_dist.entropy()
+
+    def sample_beta(self, cache, current_option):
+        """get_beta on a step cache"""
+        beta = bool(Bernoulli(cache['betas'][:, current_option]).sample().item())
+        greedy_next_option = cache['Q'].argmax(dim=1).item()
+        return beta, greedy_next_option
+
     def greedy_option(self, state):
         """chose greedy option for current state"""
         Q = self.get_Q(state)
         greedy_option = Q.argmax(dim=-1).item()
         return greedy_option
 
-    def critic_loss(self, agent_prime, batch, params):
+    def critic_loss(self, agent_prime, batch, params, weights=None):
         """Computes squared TD error between Q and the update target for a
             minibatch of samples,
                 Inputs:
                     agent: nn.Module type OptionCritic to be trained
                     agent_prime: target model
-                    batch: tuple(obs, option, reward, next_obs, done)
+                    batch: tuple of tensors (obs, option, reward, next_obs, done) from ReplayBuffer.sample
+                    weights: optional importance-sampling weights per sample (prioritized replay)
                 Returns:
                     critic_loss: squared TD error
+                    td_errors: TD error per sample (detached), used to update replay priorities
                """
         #unpack and format batch, create terminal mask
         obs, options, rewards, next_obs, dones = batch
         batch_idx = th.arange(len(options)).long()  # Tensor of batch indices [0, 1, ..., batch_size-1]
-        options = th.LongTensor(options).to(params.device)  # Convert to a tensor of integers
-        rewards = th.FloatTensor(rewards).to(params.device)  # Convert to a floating-point tensor
-        masks = 1 - th.FloatTensor(dones).to(params.device)  # Create mask for terminal states (0=Done)
+        options = options.long().to(params.device)  # Convert to a tensor of integers
+        rewards = rewards.float().to(params.device)  # Convert to a floating-point tensor
+        masks = 1 - dones.float().to(params.device)  # Create mask for terminal states (0=Done)
 
         # compute current Q-values, ie Q(s,w1), Q(s,w2)...
         states = self.get_state(pre_process(obs)).squeeze(0)
@@ -159,26 +192,28 @@ class OC_Network(nn.Module):
               next_Q_prime.max(dim=-1)[0])
 
         # compute loss as TD error
-        td_err = (Q[batch_idx, options] - gt.detach()).pow(2).mul(0.5).mean()
-        return td_err
-
-    def actor_loss(self, agent_prime, obs, option, logp, entropy, reward, done, next_obs, params):
-        """ compute actor loss used to train option-policy and beta networks every time-step
+        td_errors = Q[batch_idx, options] - gt.detach()
+        if weights is None:
+            td_err = td_errors.pow(2).mul(0.5).mean()
+        else:
+            td_err = (weights.to(params.device) * td_errors.pow(2).mul(0.5)).mean()
+        return td_err, td_errors.detach()
+
+    def actor_loss(self, agent_prime, cache, option, logp, entropy, reward, done, next_obs, params):
+        """ compute actor loss used to train option-policy and beta networks every time-step.
+            cache is the step_cache of the current obs (computed with the current parameters), next_obs
+            goes through the online features/beta net and the target network once, without grad
             """
-        #pass obs and next_obs through networks to get states
-        state = self.get_state(pre_process(obs))
-        next_state = self.get_state(pre_process(next_obs))  # get next state from next obs
-        next_state_prime = agent_prime.get_state(pre_process(next_obs))  # get target next state
-
         # get termination prob for current_state + current_option
-        beta = self.get_betas(state)[:, option]
+        beta = cache['betas'][:, option]
 
-        # get termination prob for next_state + current_option
-        next_beta = self.get_betas(next_state)[:, option].detach()
+        # get termination prob for next_state + current_option, and Q'(s') from the target network
+        with th.no_grad():
+            next_beta = self.get_betas(self.get_state(pre_process(next_obs)))[:, option]
+            next_Q_prime = agent_prime.get_Q(agent_prime.get_state(pre_process(next_obs))).squeeze()
 
-        # compute Q(s,o) and Q'(s',o)
-        Q = self.get_Q(state).detach().squeeze()
-        next_Q_prime = agent_prime.get_Q(next_state_prime).detach().squeeze()
+        # compute Q(s,o)
+        Q = cache['Q'].squeeze()
 
         # "One-step off-policy update target"
         gt = reward + (1 - done) * params.gamma * \
@@ -4,6 +4,8 @@ from torch import nn
 from torch.nn import functional as F
 from torch.distributions import Categorical
 
+from helpers.common_helper import linear_input
+
 
 class PPO_Actor(nn.Module):
     def __init__(self, state_dim, hidden_dim, action_dim):
@@ -26,8 +28,9 @@ class PPO_Actor(nn.Module):
         nn.init.constant_(self.fc3.bias, 0)
 
     def forward(self, state):
+        """state: one-hot float tensor [..., state_dim] or integer state index tensor [...]"""
         x = state
-        x = F.tanh(self.fc1(x))
+        x = F.tanh(linear_input(self.fc1, x))
         x = F.tanh(self.fc2(x))
         logits = self.fc3(x)
         return logits
@@ -69,13 +72,16 @@ class PPO_Critic(nn.Module):
         nn.init.constant_(self.fc3.bias, 0)
 
     def forward(self, state):
+        """state: one-hot float tensor [..., state_dim] or integer state index tensor [...]"""
         x = state
-        x = F.tanh(self.fc1(x))
+        x = F.tanh(linear_input(self.fc1, x))
         x = F.tanh(self.fc2(x))
         value = self.fc3(x)
         return value
 
     def critic_loss(self, new_values, old_values, returns, eps_clip):
+        #values come as [B,1,1] / [B,1], align them with returns [B] so the loss is elementwise (not broadcast to B^3)
+        new_values, old_values = new_values.reshape(returns.shape), old_values.reshape(returns.shape)
         # value_clip = old_values + th.clamp(values - old_values, -eps_clip, eps_clip)
         value_clip = th.clamp(new_values, old_values - eps_clip, old_values + eps_clip)
         loss_unclipped = (new_values - returns).pow(2)
@@ -0,0 +1,351 @@
+import logging
+import textwrap
+from functools import cached_property
+import gymnasium as gym
+from gymnasium import spaces
+from gymnasium.utils import seeding
+import numpy as np
+
+from util.rng import BlockRNG, stream_generator
+
+try:
+    import pygame
+except ImportError:     # headless boxes can still use render_mode='rgb_array'
+    pygame = None
+
+logger = logging.getLogger(__name__)
+
+#up, down, left, right
+DIRECTIONS = np.array([(-1, 0), (1, 0), (0, -1), (0, 1)])
+
+
+class GridTables:
+    """Layout compiled once into flat arrays. States are the empty cells numbered in row-major order.
+        next_state[s, a]: state reached by the intended move (s itself if blocked by a wall)
+        slip_neighbours[s, :num_slip[s]]: empty neighbours of s in action order"""
+    def __init__(self, layout):
+        lines = textwrap.dedent(layout).strip('\n').splitlines()
+        if len(set(map(len, lines))) != 1:
+            raise ValueError("layout rows must all have the same length")
+        chars = np.frombuffer(''.join(lines).encode(), dtype=np.uint8).reshape(len(lines), -1)
+        self.occupancy = (chars == ord('w')).astype(np.int64)
+        self.num_states = int(np.sum(self.occupancy == 0))
+
+        #state <-> cell lookup arrays, walls map to -1
+        self.state_to_cell = np.argwhere(self.occupancy == 0)
+        self.cell_to_state = np.full(self.occupancy.shape, -1, dtype=np.int64)
+        self.cell_to_state[self.state_to_cell[:, 0], self.state_to_cell[:, 1]] = np.arange(self.num_states)
+        self.coords = (self.state_to_cell / np.maximum(np.array(self.occupancy.shape) - 1, 1)).astype(np.float32)
+        self.coords.flags.writeable = False     #shared by every env of the layout (compile_layout cache)
+
+        #neighbour of every state in every direction, out of bounds counts as wall
+        neighbours = self.state_to_cell[:, None, :] + DIRECTIONS[None, :, :]
+        inside = ((neighbours >= 0) & (neighbours < self.occupancy.shape)).all(-1)
+        neighbours = np.where(inside[..., None], neighbours, 0)
+        neighbour_states = np.where(inside, self.cell_to_state[neighbours[..., 0], neighbours[..., 1]], -1)
+        free = neighbour_states >= 0
+
+        states = np.arange(self.num_states)[:, None]
+        self.next_state = np.where(free, neighbour_states, states)
+        order = np.argsort(~free, axis=1, kind='stable')     #free neighbours first, action order kept
+        self.slip_neighbours = np.take_along_axis(self.next_state, order, axis=1)
+        self.num_slip = free.sum(axis=1)
+
+
+_tables_cache = {}
+_background_cache = {}
+
+def compile_layout(layout):
+    """returns cached GridTables for a layout string"""
+    if layout not in _tables_cache:
+        _tables_cache[layout] = GridTables(layout)
+    return _tables_cache[layout]
+
+
+OBS_MODES = ('onehot', 'index', 'coord')
+
+def observation_space(obs_mode, num_states):
+    """single-env observation space for an observation mode"""
+    if obs_mode == 'onehot':
+        return spaces.Box(low=0., high=1., shape=(num_states,))
+    if obs_mode == 'index':
+        return spaces.Discrete(num_states)
+    if obs_mode == 'coord':
+        return spaces.Box(low=0., high=1., shape=(2,))
+    raise ValueError(f"obs_mode must be one of {OBS_MODES}, got {obs_mode!r}")
+
+
+class GridWorld(gym.Env):
+    """Stochastic grid world core shared by the FourRooms layouts. Subclasses define `layout`
+        and `default_goal`."""
+    metadata = {
+        'render.modes': ['human', 'rgb_array'],
+        'render_fps' : 50
+    }
+    layout = None
+    default_goal = 0
+
+    def __init__(self, render_mode=None, obs_mode='onehot', async_render=False, t_max=1000):
+        """obs_mode: 'onehot' returns a float one-hot vector per step, 'index' returns the integer state index,
+            'coord' returns the (row, col) position scaled to [0, 1] (compact input for large layouts)
+            async_render: with render_mode='human', draw the pygame window in a separate process
+            t_max: episodes are truncated after t_max steps (params.t_max, as in GridWorldVec and ExactEvaluator)"""
+        self.render_mode = render_mode
+        self.obs_mode = obs_mode
+        self.async_render = async_render
+        self.t_max = t_max
+        #pygame info
+        self.cell_size = 40  # Size of each cell in pixels
+        self.rgb_cell_size = 8  # Size of each cell in rgb_array frames (kept small for recording)
+        self.viewer = None
+
+        tables = compile_layout(self.layout)
+        self.occupancy = tables.occupancy
+        self.state_to_cell = tables.state_to_cell
+        self.next_state = tables.next_state
+        self.slip_neighbours = tables.slip_neighbours
+        self.num_slip = tables.num_slip
+        self.num_states = tables.num_states
+        self.coords = tables.coords
+
+        # From any state the agent can perform one of four actions, up, down, left or right
+        self.action_space = spaces.Discrete(4)
+        self.observation_space = observation_space(obs_mode, self.num_states)
+
+        self.directions = list(DIRECTIONS)
+        self.rng = BlockRNG(1234)
+
+
+        self.goal = self.default_goal
+        self.init_states = list(range(self.num_states))
+        self.init_states.remove(self.goal)
+        self.state = self.init_states[0]
+        self.ep_steps = 0
+
+        # Pygame setup (if rendering is enabled)
+        if self.render_mode == "human":
+            if pygame is None:
+                raise ImportError("render_mode='human' requires pygame, use render_mode='rgb_array' instead")
+            from env.viewer import PygameViewer, AsyncViewer
+            viewer = AsyncViewer if async_render else PygameViewer
+            self.viewer = viewer(self.occupancy, self.cell_size, self.metadata["render_fps"])
+
+    @cached_property
+    def tocell(self):
+        return {s: tuple(cell) for s, cell in enumerate(self.state_to_cell.tolist())}
+
+    @cached_property
+    def tostate(self):
+        return {v:k for k,v in self.tocell.items()}
+
+    @property
+    def currentcell(self):
+        return tuple(self.state_to_cell[self.state].tolist())
+
+    @currentcell.setter
+    def currentcell(self, cell):
+        self.state = self.tostate[tuple(cell)]
+
+    def choose_goal(self, goal):
+        self.goal = goal
+        self.init_states = list(range(self.num_states))
+        self.init_states.remove(self.goal)
+
+    def seed(self, seed=None):
+        return self._seed(seed)
+
+    def _seed(self, seed=None):
+        self.np_random, seed = seeding.np_random(seed)
+        self.rng.seed(seed)
+        return [seed]
+
+    def reset(self, *, seed=None, options=None):
+        if seed is not None:
+            self.rng.seed(seed)
+        self.state = self.rng.choice(self.init_states)
+        self.ep_steps = 0
+        return self.get_state(self.state), {}
+
+    def switch_goal(self, goal=None):
+        prev_goal = self.goal
+        if goal is None:
+            self.goal = self.rng.choice(self.init_states)
+        else:
+            self.goal = goal
+        self.goal = 25  #located in north corridor
+        self.init_states.append(prev_goal)
+        self.init_states.remove(self.goal)
+        assert prev_goal in self.init_states
+        assert self.goal not in self.init_states
+
+    def get_state(self, state):
+        if self.obs_mode == 'index':
+            return int(state)
+        if self.obs_mode == 'coord':
+            return self.coords[state].copy()
+        s = np.zeros(self.num_states)
+        s[state] = 1
+        return s
+
+    def get_all_states(self):
+        """observations of every state stacked in one array, row s equals get_state(s)"""
+        if self.obs_mode == 'index':
+            return np.arange(self.num_states)
+        if self.obs_mode == 'coord':
+            return self.coords.copy()
+        return np.eye(self.num_states)
+
+    def close(self):
+        if self.viewer is not None:
+            self.viewer.close()
+            self.viewer = None
+
+    def render_rgb(self):
+        """rasterizes the current frame as an rgb uint8 array [rows * rgb_cell_size, cols * rgb_cell_size, 3].
+            The static layout is drawn once per (layout, cell size), only the goal and agent cells are stamped"""
+        cs = self.rgb_cell_size
+        key = (self.layout, cs)
+        if key not in _background_cache:
+            colors = np.where(self.occupancy[..., None] == 1, np.uint8(0), np.array([200, 200, 200], dtype=np.uint8))
+            _background_cache[key] = colors.repeat(cs, axis=0).repeat(cs, axis=1)
+
+        frame = _background_cache[key].copy()
+        for cell, color in ((self.state_to_cell[self.goal], (0, 255, 0)), (self.state_to_cell[self.state], (255, 0, 0))):
+            i, j = cell * cs
+            frame[i:i + cs, j:j + cs] = color
+        return frame
+
+    def render(self, ep=None, text_top=None, text_bot=None):
+        """'human': draws the pygame window with the test ep number and optional text (only the changed
+            regions are redrawn, see env/viewer.py),
+            'rgb_array': returns the frame as an array (text is not drawn)"""
+        if self.render_mode == "rgb_array":
+            return self.render_rgb()
+        if self.render_mode == "human":
+            if self.viewer is None:
+                raise ValueError("Environment is not set up for rendering. Use render_mode='human'.")
+            self.viewer.draw(self.currentcell, tuple(self.state_to_cell[self.goal].tolist()),
+                             f"Test ep {ep}, t = {self.ep_steps}", text_top, text_bot)
+
+    def step(self, action):
+        """
+        The agent can perform one of four actions,
+        up, down, left or right, which have a stochastic effect. With probability 2/3, the actions
+        cause the agent to move one cell in the corresponding direction, and with probability 1/3,
+        the agent moves instead in one of the other three directions, each with 1/9 probability. In
+        either case, if the movement would take the agent into a wall then the agent remains in the
+        same cell.
+        We consider a case in which rewards are zero on all state transitions.
+        """
+        self.ep_steps += 1
+
+        state = self.state
+        nextstate = self.next_state[state, action]
+        if nextstate != state:
+            if self.rng.uniform() < 1/3.:
+                state = self.slip_neighbours[state, self.rng.randint(self.num_slip[state])]
+            else:
+                state = nextstate
+        self.state = state = int(state)
+
+        done = state == self.goal
+        reward = float(done)
+        truncated = False
+
+        if not done and self.ep_steps >= self.t_max:
+            truncated = True ; reward = 0.0
+
+        return self.get_state(state), reward, done, truncated, None
+
+
+class GridWorldVec:
+    """N independent GridWorld agents advanced together with array operations.
+        Positions are held as state indices and a step is a handful of table lookups, so one
+        call produces num_envs transitions. Dynamics match GridWorld.step exactly: a move into
+        a wall leaves the agent in place, otherwise with probability 1/3 the agent moves to a
+        uniformly chosen empty neighbour. Finished envs (goal or t_max steps) auto-reset; their
+        last observation is returned in info['final_observation']."""
+    layout = None
+    default_goal = 0
+
+    def __init__(self, num_envs, t_max=1000, seed=1234, obs_mode='onehot'):
+        tables = compile_layout(self.layout)
+        self.num_envs = num_envs
+        self.obs_mode = obs_mode
+        self.t_max = t_max
+        self.occupancy = tables.occupancy
+        self.state_to_cell = tables.state_to_cell
+        self.next_state = tables.next_state
+        self.slip_neighbours = tables.slip_neighbours
+        self.num_slip = tables.num_slip
+        self.num_states = tables.num_states
+        self.coords = tables.coords
+
+        self.single_action_space = spaces.Discrete(4)
+        self.single_observation_space = observation_space(obs_mode, self.num_states)
+        self.action_space = spaces.MultiDiscrete([self.single_action_space.n] * num_envs)
+        if obs_mode == 'index':
+            self.observation_space = spaces.MultiDiscrete([self.num_states] * num_envs)
+        else:
+            self.observation_space = spaces.Box(low=0., high=1., shape=(num_envs,) + self.single_observation_space.shape)
+
+        self.rng = stream_generator(seed)
+        self.choose_goal(self.default_goal)
+
+        self.eye = np.eye(self.num_states, dtype=np.float32) if obs_mode == 'onehot' else None
+        self.states = np.zeros(num_envs, dtype=np.int64)
+        self.ep_steps = np.zeros(num_envs, dtype=np.int64)
+
+    def choose_goal(self, goal):
+        self.goal = goal
+        self.init_states = np.delete(np.arange(self.num_states), goal)
+
+    def switch_goal(self, goal=None):
+        prev_goal = self.goal
+        self.goal = self.rng.choice(self.init_states) if goal is None else goal
+        self.init_states = np.append(self.init_states[self.init_states != self.goal], prev_goal)
+
+    def get_state(self, states):
+        if self.obs_mode == 'index':
+            return states.copy()
+        if self.obs_mode == 'coord':
+            return self.coords[states]
+        return self.eye[states]
+
+    def reset(self, *, seed=None, options=None):
+        if seed is not None:
+            self.rng = stream_generator(seed)
+        self.states = self.rng.choice(self.init_states, size=self.num_envs)
+        self.ep_steps[:] = 0
+        return self.get_state(self.states), {}
+
+    def step(self, actions):
+        """actions: int array shape [num_envs]. Returns batched (obs, reward, terminated, truncated, info)"""
+        self.ep_steps += 1
+        states = self.states
+
+        intended = self.next_state[states, actions]
+        slip = (intended != states) & (self.rng.random(self.num_envs) < 1/3.)
+        slip_choice = (self.rng.random(self.num_envs) * self.num_slip[states]).astype(np.int64)
+        states = np.where(slip, self.slip_neighbours[states, slip_choice], intended)
+
+        terminated = states == self.goal
+        reward = terminated.astype(np.float64)
+        truncated = ~terminated & (self.ep_steps >= self.t_max)
+        self.states = states
+
+        obs = self.get_state(states)
+        info = {}
+        done = terminated | truncated
+        if done.any():
+            #auto-reset finished envs, keep their last observation
+            info['final_observation'] = obs.copy()
+            info['_final_observation'] = done
+            self.states[done] = self.rng.choice(self.init_states, size=int(done.sum()))
+            self.ep_steps[done] = 0
+            obs[done] = self.get_state(self.states[done])
+
+        return obs, reward, terminated, truncated, info
+
+    def close(self):
+        pass
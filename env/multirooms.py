@@ -0,0 +1,88 @@
+import numpy as np
+
+from env.gridworld import GridWorld, GridWorldVec
+from env.torch_gridworld import GridWorldTorch
+
+
+def generate_layout(rooms_per_side, room_size, doorways=None, seed=0):
+    """builds a square grid of rooms_per_side x rooms_per_side rooms, each room_size x room_size empty
+        cells, separated by one-cell walls. Rooms are first linked by a random spanning tree (so every
+        cell is reachable), then extra doorways are opened between random unlinked neighbours until
+        `doorways` walls have a doorway (default: every pair of adjacent rooms, as in FourRooms).
+        Returns a layout string usable as GridWorld.layout."""
+    n = rooms_per_side
+    num_walls = 2 * n * (n - 1)     #shared walls between adjacent rooms
+    doorways = num_walls if doorways is None else doorways
+    if not n * n - 1 <= doorways <= num_walls:
+        raise ValueError(f"doorways must be between {n * n - 1} and {num_walls} for {n}x{n} rooms")
+    rng = np.random.default_rng(seed)
+
+    #all walls between adjacent rooms as (room a, room b, horizontal neighbour)
+    rooms = np.arange(n * n).reshape(n, n)
+    walls = np.concatenate([
+        np.stack([rooms[:, :-1].ravel(), rooms[:, 1:].ravel(), np.ones((n - 1) * n, dtype=np.int64)], axis=1),
+        np.stack([rooms[:-1, :].ravel(), rooms[1:, :].ravel(), np.zeros((n - 1) * n, dtype=np.int64)], axis=1),
+    ])
+
+    #randomized Kruskal spanning tree over rooms, then extra walls from the rest
+    parent = list(range(n * n))
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+    order = rng.permutation(len(walls))
+    tree, rest = [], []
+    for w in order:
+        ra, rb = find(walls[w, 0]), find(walls[w, 1])
+        if ra != rb:
+            parent[ra] = rb
+            tree.append(w)
+        else:
+            rest.append(w)
+    opened = walls[np.array(tree + rest[:doorways - len(tree)], dtype=np.int64)]
+
+    #carve rooms: every cell not on a wall row/column is empty
+    size = n * (room_size + 1) + 1
+    on_wall = np.arange(size) % (room_size + 1) == 0
+    occupancy = on_wall[:, None] | on_wall[None, :]
+
+    #carve one doorway per opened wall at a random offset along it
+    row, col = np.divmod(opened[:, 0], n)
+    offset = 1 + rng.integers(room_size, size=len(opened))
+    top, left = row * (room_size + 1), col * (room_size + 1)
+    horizontal = opened[:, 2] == 1
+    door_r = np.where(horizontal, top + offset, top + room_size + 1)
+    door_c = np.where(horizontal, left + room_size + 1, left + offset)
+    occupancy[door_r, door_c] = False
+
+    #render as layout string, one row per line
+    chars = np.where(occupancy, ord('w'), ord(' ')).astype(np.uint8)
+    chars = np.concatenate([chars, np.full((size, 1), ord('\n'), dtype=np.uint8)], axis=1)
+    return chars.tobytes().decode()
+
+
+class MultiRooms(GridWorld):
+    """procedurally generated multi-room grid world for scaling tests. The goal defaults to the
+        bottom-right cell. Use obs_mode='index' or 'coord' for large layouts."""
+    def __init__(self, rooms_per_side=4, room_size=5, doorways=None, seed=0, render_mode=None, obs_mode='onehot',
+                 async_render=False, t_max=1000):
+        self.layout = generate_layout(rooms_per_side, room_size, doorways, seed)
+        self.default_goal = self.layout.count(' ') - 1
+        super(MultiRooms, self).__init__(render_mode=render_mode, obs_mode=obs_mode, async_render=async_render,
+                                         t_max=t_max)
+
+
+class MultiRoomsVec(GridWorldVec):
+    def __init__(self, num_envs, rooms_per_side=4, room_size=5, doorways=None, seed=0, t_max=1000, obs_mode='onehot'):
+        self.layout = generate_layout(rooms_per_side, room_size, doorways, seed)
+        self.default_goal = self.layout.count(' ') - 1
+        super(MultiRoomsVec, self).__init__(num_envs, t_max=t_max, seed=seed, obs_mode=obs_mode)
+
+
+class MultiRoomsTorch(GridWorldTorch):
+    def __init__(self, num_envs, rooms_per_side=4, room_size=5, doorways=None, seed=0, t_max=1000, obs_mode='onehot',
+                 device='cpu'):
+        self.layout = generate_layout(rooms_per_side, room_size, doorways, seed)
+        self.default_goal = self.layout.count(' ') - 1
+        super(MultiRoomsTorch, self).__init__(num_envs, t_max=t_max, seed=seed, obs_mode=obs_mode, device=device)
@@ -0,0 +1,21 @@
+import os
+import numpy as np
+
+
+class EpisodeRecorder:
+    """collects rgb_array frames of a batch of test episodes and writes them to one compressed .npz file,
+        one array of shape [steps, height, width, 3] per episode (keys episode_0, episode_1, ...)"""
+    def __init__(self, path):
+        self.path = path
+        self.episodes = {}
+
+    def add_frame(self, episode, frame):
+        if frame is not None:
+            self.episodes.setdefault(f"episode_{episode}", []).append(frame)
+
+    def save(self):
+        if not self.episodes:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        np.savez_compressed(self.path, **{k: np.stack(frames) for k, frames in self.episodes.items()})
+        self.episodes = {}
@@ -0,0 +1,108 @@
+import torch as th
+from gymnasium import spaces
+
+from env.gridworld import compile_layout, observation_space
+
+
+class GridWorldTorch:
+    """GridWorldVec with every table, position, goal and RNG state held as torch tensors on `device`.
+        step() takes an action tensor and returns observations already laid out as a network input batch
+        (float32 [num_envs, obs_dim], or int64 [num_envs] state indices for obs_mode='index'), so rollouts
+        and inference need no NumPy <-> torch conversion. Dynamics match GridWorld.step.
+        Finished envs are reset in the same call without a host sync: info['final_observation'] always
+        holds the pre-reset observations and info['_final_observation'] marks the envs that finished."""
+    layout = None
+    default_goal = 0
+
+    def __init__(self, num_envs, t_max=1000, seed=1234, obs_mode='onehot', device='cpu'):
+        tables = compile_layout(self.layout)
+        self.num_envs = num_envs
+        self.obs_mode = obs_mode
+        self.t_max = t_max
+        self.device = th.device(device)
+        self.occupancy = tables.occupancy
+        self.num_states = tables.num_states
+        self.state_to_cell = th.as_tensor(tables.state_to_cell, device=self.device)
+        self.next_state = th.as_tensor(tables.next_state, device=self.device)
+        self.slip_neighbours = th.as_tensor(tables.slip_neighbours, device=self.device)
+        self.num_slip = th.as_tensor(tables.num_slip, device=self.device)
+        self.coords = th.tensor(tables.coords, device=self.device)
+
+        self.single_action_space = spaces.Discrete(4)
+        self.single_observation_space = observation_space(obs_mode, self.num_states)
+        self.action_space = spaces.MultiDiscrete([self.single_action_space.n] * num_envs)
+        if obs_mode == 'index':
+            self.observation_space = spaces.MultiDiscrete([self.num_states] * num_envs)
+        else:
+            self.observation_space = spaces.Box(low=0., high=1., shape=(num_envs,) + self.single_observation_space.shape)
+
+        self.generator = th.Generator(device=self.device)
+        self.generator.manual_seed(seed)
+        self.choose_goal(self.default_goal)
+
+        self.eye = th.eye(self.num_states, device=self.device) if obs_mode == 'onehot' else None
+        self.states = th.zeros(num_envs, dtype=th.long, device=self.device)
+        self.ep_steps = th.zeros(num_envs, dtype=th.long, device=self.device)
+
+    def choose_goal(self, goal):
+        self.goal = int(goal)
+        init_states = th.arange(self.num_states, device=self.device)
+        self.init_states = init_states[init_states != self.goal]
+
+    def switch_goal(self, goal=None):
+        prev_goal = self.goal
+        if goal is None:
+            goal = self.init_states[self.sample_index(len(self.init_states), 1)].item()
+        self.goal = int(goal)
+        self.init_states = th.cat([self.init_states[self.init_states != self.goal],
+                                   th.tensor([prev_goal], device=self.device)])
+
+    def sample_index(self, n, size):
+        return th.randint(n, (size,), generator=self.generator, device=self.device)
+
+    def sample_init_states(self):
+        return self.init_states[self.sample_index(len(self.init_states), self.num_envs)]
+
+    def get_state(self, states):
+        if self.obs_mode == 'index':
+            return states.clone()
+        if self.obs_mode == 'coord':
+            return self.coords[states]
+        return self.eye[states]
+
+    def reset(self, *, seed=None, options=None):
+        if seed is not None:
+            self.generator.manual_seed(seed)
+        self.states = self.sample_init_states()
+        self.ep_steps.zero_()
+        return self.get_state(self.states), {}
+
+    def step(self, actions):
+        """actions: int tensor shape [num_envs] (anything th.as_tensor accepts works).
+            Returns batched (obs, reward, terminated, truncated, info) tensors"""
+        actions = th.as_tensor(actions, device=self.device).long()
+        self.ep_steps += 1
+        states = self.states
+
+        intended = self.next_state[states, actions]
+        u = th.rand((2, self.num_envs), generator=self.generator, device=self.device)
+        slip = (intended != states) & (u[0] < 1/3.)
+        slip_choice = (u[1] * self.num_slip[states]).long()
+        states = th.where(slip, self.slip_neighbours[states, slip_choice], intended)
+
+        terminated = states == self.goal
+        reward = terminated.float()
+        truncated = ~terminated & (self.ep_steps >= self.t_max)
+        done = terminated | truncated
+
+        #auto-reset finished envs with masked updates, keep their last observation
+        final_obs = self.get_state(states)
+        self.states = th.where(done, self.sample_init_states(), states)
+        self.ep_steps.masked_fill_(done, 0)
+        obs = self.get_state(self.states)
+        info = {'final_observation': final_obs, '_final_observation': done}
+
+        return obs, reward, terminated, truncated, info
+
+    def close(self):
+        pass
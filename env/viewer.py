@@ -0,0 +1,116 @@
+import multiprocessing as mp
+import queue
+import pygame
+
+
+class PygameViewer:
+    """Live pygame view of a grid world. The static layout is pre-rendered once to a background surface.
+        Each frame only restores the regions drawn in the previous frame from the background, draws the
+        goal, agent and overlay text, and updates those dirty rectangles on the display."""
+    def __init__(self, occupancy, cell_size, fps):
+        pygame.init()
+        self.cell_size = cell_size
+        self.fps = fps
+        self.screen = pygame.display.set_mode((occupancy.shape[1] * cell_size, occupancy.shape[0] * cell_size))
+        self.clock = pygame.time.Clock()
+        pygame.font.init()
+        self.font = pygame.font.Font(None, 36)  # Default font, size 36
+        self.small_font = pygame.font.Font(None, 24)
+        self.text_cache = {}
+        self.closed = False
+
+        #draw walls and empty space once
+        self.background = pygame.Surface(self.screen.get_size())
+        self.background.fill((255, 255, 255))
+        for i in range(occupancy.shape[0]):
+            for j in range(occupancy.shape[1]):
+                color = (0, 0, 0) if occupancy[i, j] == 1 else (200, 200, 200)  # Walls or empty space
+                pygame.draw.rect(self.background, color, self.cell_rect((i, j)))
+        self.screen.blit(self.background, (0, 0))
+        pygame.display.flip()
+        self.dirty = []
+
+    def cell_rect(self, cell):
+        return pygame.Rect(cell[1] * self.cell_size, cell[0] * self.cell_size, self.cell_size, self.cell_size)
+
+    def render_text(self, font, text):
+        """text surfaces are cached, overlay strings repeat a lot between steps"""
+        key = (id(font), text)
+        if key not in self.text_cache:
+            if len(self.text_cache) > 256:
+                self.text_cache.clear()
+            self.text_cache[key] = font.render(text, True, (240, 250, 250))
+        return self.text_cache[key]
+
+    def draw(self, agent_cell, goal_cell, title, text_top=None, text_bot=None):
+        if self.closed:
+            return
+        # Handle pygame events to prevent freezing
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:  # Handle window close event
+                self.close()
+                return
+
+        #restore last frame's dirty regions from the background
+        for rect in self.dirty:
+            self.screen.blit(self.background, rect, rect)
+        rects = []
+
+        # Draw the goal (green) and agent (red)
+        rects.append(self.screen.fill((0, 255, 0), self.cell_rect(goal_cell)))
+        rects.append(self.screen.fill((255, 0, 0), self.cell_rect(agent_cell)))
+
+        #Render timestep counter and test ep number (top-left), optional text top-right and bottom-left
+        rects.append(self.screen.blit(self.render_text(self.font, title), (10, 10)))
+        if text_top:
+            surface = self.render_text(self.small_font, text_top)
+            rects.append(self.screen.blit(surface, surface.get_rect(topright=(self.screen.get_width() - 10, 10))))
+        if text_bot:
+            surface = self.render_text(self.small_font, text_bot)
+            rects.append(self.screen.blit(surface, surface.get_rect(bottomleft=(10, self.screen.get_height() - 10))))
+
+        pygame.display.update(self.dirty + rects)
+        self.dirty = rects
+        self.clock.tick(self.fps)  # Limit FPS
+
+    def close(self):
+        if not self.closed:
+            pygame.display.quit()  # Close the display
+            pygame.quit()  # Quit pygame
+            self.closed = True
+
+
+def _viewer_process(frames, occupancy, cell_size, fps):
+    viewer = PygameViewer(occupancy, cell_size, fps)
+    while not viewer.closed:
+        frame = frames.get()
+        if frame is None:
+            break
+        viewer.draw(*frame)
+    viewer.close()
+
+
+class AsyncViewer:
+    """Runs a PygameViewer in a separate process fed by a queue. draw() never blocks the caller:
+        frames are dropped while the viewer process is behind."""
+    def __init__(self, occupancy, cell_size, fps, max_pending=2):
+        ctx = mp.get_context('spawn')
+        self.frames = ctx.Queue(maxsize=max_pending)
+        self.process = ctx.Process(target=_viewer_process, args=(self.frames, occupancy, cell_size, fps), daemon=True)
+        self.process.start()
+
+    def draw(self, agent_cell, goal_cell, title, text_top=None, text_bot=None):
+        try:
+            self.frames.put_nowait((agent_cell, goal_cell, title, text_top, text_bot))
+        except queue.Full:
+            pass
+
+    def close(self):
+        if self.process.is_alive():
+            try:
+                self.frames.put(None, timeout=1.)
+            except queue.Full:
+                pass
+            self.process.join(timeout=5.)
+            if self.process.is_alive():
+                self.process.terminate()
@@ -0,0 +1,179 @@
+import numpy as np
+import torch as th
+import gymnasium as gym
+from scipy.signal import lfilter
+
+from env.fourrooms import FourRooms, FourRooms_m, FourRoomsVec, FourRooms_mVec, FourRoomsTorch, FourRooms_mTorch
+from env.multirooms import MultiRooms, MultiRoomsVec, MultiRoomsTorch
+
+
+def linear_input(layer, x):
+    """applies an input nn.Linear to a batch of observations. Float observations go through the
+        layer as usual. Integer observations are state indices: the matching weight columns are
+        gathered, which gives the same output and gradients as layer(one_hot(x))"""
+    if x.is_floating_point():
+        return layer(x)
+    return layer.weight.t()[x] + layer.bias
+
+def obs_to_tensor(obs):
+    """converts an observation (or stacked observations) to a tensor without a batch dim.
+        integer state indices stay integer, everything else becomes float32.
+        Tensors (e.g. from the torch env backend) are used as they are, without a copy"""
+    obs = obs if isinstance(obs, th.Tensor) else th.from_numpy(np.asarray(obs))
+    return obs.float() if obs.is_floating_point() else obs.long()
+
+def discounted_cumsum(x, discount, dones):
+    """y[..., t] = x[..., t] + discount * y[..., t+1], restarting after every step with dones[t] set
+        (last step of each episode, dones[-1] must be set). One lfilter pass over the reversed sequence,
+        then the carry that leaked in from the following episodes is subtracted: within an episode
+        ending at e, y[t] = Y[t] - discount^(e+1-t) * Y[e+1]"""
+    x = np.asarray(x, dtype=np.float64)
+    n = x.shape[-1]
+    steps = np.arange(n)
+    Y = lfilter([1.], [1., -discount], x[..., ::-1], axis=-1)[..., ::-1]
+
+    ends = np.flatnonzero(dones)
+    next_start = ends[np.searchsorted(ends, steps)] + 1
+    carry = np.where(next_start < n, Y[..., np.minimum(next_start, n - 1)], 0.)
+    return Y - discount ** (next_start - steps) * carry
+
+def to_numpy(x):
+    return x.cpu().numpy() if isinstance(x, th.Tensor) else np.asarray(x)
+
+def make_env(params, render_mode=None):
+    """single env named by params.env_name (a grid world or a gym id), for training trials and test pools"""
+    if params.env_name == 'FourRooms':
+        return FourRooms(render_mode=render_mode, obs_mode=params.obs_mode, async_render=params.async_render,
+                         t_max=params.t_max)
+    if params.env_name == 'FourRooms_m':
+        return FourRooms_m(render_mode=render_mode, obs_mode=params.obs_mode, async_render=params.async_render,
+                           t_max=params.t_max)
+    if params.env_name == 'MultiRooms':
+        return MultiRooms(**params.layout_kwargs, render_mode=render_mode, obs_mode=params.obs_mode,
+                          async_render=params.async_render, t_max=params.t_max)
+    return gym.make(params.env_name)  # , render_mode="human")
+
+#grid worlds with a batched version (make_vec_env)
+VEC_ENV_NAMES = ('FourRooms', 'FourRooms_m', 'MultiRooms')
+
+def make_vec_env(params, num_envs, seed):
+    """batched version of the grid world named by params.env_name, numpy (GridWorldVec) or torch
+        (GridWorldTorch, on params.device) backend per params.env_backend. Its RNG is seeded with seed"""
+    torch_backend = params.env_backend == 'torch'
+    kwargs = dict(t_max=params.t_max, obs_mode=params.obs_mode)
+    if torch_backend:
+        kwargs['device'] = params.device
+    if params.env_name == 'FourRooms':
+        vec_env = (FourRoomsTorch if torch_backend else FourRoomsVec)(num_envs, **kwargs)
+    elif params.env_name == 'FourRooms_m':
+        vec_env = (FourRooms_mTorch if torch_backend else FourRooms_mVec)(num_envs, **kwargs)
+    elif params.env_name == 'MultiRooms':
+        vec_env = (MultiRoomsTorch if torch_backend else MultiRoomsVec)(num_envs, **params.layout_kwargs, **kwargs)
+    else:
+        raise ValueError(f"no batched env for {params.env_name}")
+    vec_env.reset(seed=seed)
+    return vec_env
+
+def state_field(params):
+    """RolloutStorage spec of one network input state: an integer index or a float vector"""
+    return ((), th.long) if params.obs_mode == 'index' else ((params.state_dim,), th.float32)
+
+
+class RolloutStorage:
+    """fixed-capacity rollout tensors on device, one per field, allocated once and reused every buffer.
+        Whole episodes are written one after another into slices of the tensors, either as per-step
+        inserts closed by end_episode or in one insert_episode call. Reading a field returns a view of the
+        filled steps, so collating a buffer allocates nothing"""
+    def __init__(self, capacity, fields, device):
+        """fields: name -> (shape of one step, dtype). A field 'next_x' is filled by end_episode from 'x'"""
+        self.capacity = capacity
+        self.spec = fields
+        self.device = device
+        self.fields = {name: th.zeros((capacity,) + tuple(shape), dtype=dtype, device=device)
+                       for name, (shape, dtype) in fields.items()}
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.reset()
+
+    def reset(self):
+        self.pos = 0
+        self.num_episodes = 0
+        self.dones[:] = False
+        self.pending = {}
+
+    def insert(self, **step):
+        """adds one step of the current episode (tensors may keep a batch dim of 1). Single-row tensor writes
+            are slow on CPU, so steps are held as references and stacked straight into the episode's slice
+            by end_episode"""
+        for name, value in step.items():
+            self.pending.setdefault(name, []).append(value)
+
+    def insert_episode(self, steps, **bootstrap):
+        """steps: name -> tensor [episode length, ...], then closes the episode"""
+        length = len(next(iter(steps.values())))
+        for name, value in steps.items():
+            self.fields[name][self.pos:self.pos + length] = value
+        self.close_episode(length, bootstrap)
+
+    def end_episode(self, **bootstrap):
+        """closes the current episode. bootstrap: value of the state after the last step for each value field
+            (0 if terminal)"""
+        length = 0
+        for name, values in self.pending.items():
+            length = len(values)
+            out = self.fields[name][self.pos:self.pos + length]
+            if isinstance(values[0], th.Tensor):
+                th.stack(values, out=out.view((length,) + values[0].shape))
+            else:
+                out.copy_(th.tensor(values))
+        self.pending = {}
+        self.close_episode(length, bootstrap)
+
+    def close_episode(self, length, bootstrap):
+        """next_<field> of every step is the field's value at the following step, then the bootstrap value"""
+        start, end = self.pos, self.pos + length
+        for name, value in bootstrap.items():
+            next_value = self.fields['next_' + name]
+            next_value[start:end - 1] = self.fields[name][start + 1:end]
+            next_value[end - 1] = value
+        self.dones[end - 1] = True
+        self.pos = end
+        self.num_episodes += 1
+
+    def step_buffers(self, num_steps, num_envs):
+        """[num_steps, num_envs] tensors of the per-step fields, for collectors stepping many envs in lockstep"""
+        return {name: th.zeros((num_steps, num_envs) + tuple(shape), dtype=dtype, device=self.device)
+                for name, (shape, dtype) in self.spec.items() if not name.startswith('next_')}
+
+    def __getitem__(self, name):
+        return self.fields[name][:self.pos]
+
+    def get_dones(self):
+        return self.dones[:self.pos]
+
+
+class MinibatchSampler:
+    """shuffled minibatches over equally long tensors, a light replacement for TensorDataset + DataLoader(shuffle=True).
+        Each pass (epoch) draws one index permutation, gathers every tensor in that order once and yields
+        contiguous slices of batch_size rows. Without a seed the permutation generator is seeded from the global
+        torch RNG every epoch (as RandomSampler does), with a seed it is a fixed stream"""
+    def __init__(self, tensors, batch_size, seed=None):
+        self.tensors = tensors
+        self.batch_size = batch_size
+        self.size = len(tensors[0])
+        self.generator = None
+        if seed is not None:
+            self.generator = th.Generator()
+            self.generator.manual_seed(seed)
+
+    def __len__(self):
+        return -(-self.size // self.batch_size)
+
+    def __iter__(self):
+        generator = self.generator
+        if generator is None:
+            generator = th.Generator()
+            generator.manual_seed(int(th.empty((), dtype=th.int64).random_().item()))
+        perm = th.randperm(self.size, generator=generator).to(self.tensors[0].device)
+        shuffled = [tensor[perm] for tensor in self.tensors]
+        for start in range(0, self.size, self.batch_size):
+            yield tuple(tensor[start:start + self.batch_size] for tensor in shuffled)
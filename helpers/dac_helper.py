@@ -1,21 +1,27 @@
 import torch as th
 from torch import nn
+from torch.distributions import Categorical
 import numpy as np
 import matplotlib.pyplot as plt
 import sys
 
+from helpers.common_helper import obs_to_tensor, to_numpy, discounted_cumsum, state_field
+
+#prev_option value of envs at the start of an episode
+NO_OPTION = -1
+
 def layer_init(layer):
     nn.init.orthogonal_(layer.weight)
     nn.init.constant_(layer.bias, 0)
     return layer
 def pre_process(obs):
-    state = th.FloatTensor(obs).unsqueeze(0)
+    state = obs_to_tensor(obs).unsqueeze(0)
     return state
 
 def compute_pi_hat(prediction, prev_option):
     """computes high-policy (option selection) based on previous option, master policy & beta outputs.
         in the initial state, prev_option is set to None, function returns the master policy without
-        beta contribution."""
+        beta contribution. For batches, rows whose prev_option is NO_OPTION (-1) get the master policy."""
 
     #get high actor option probabilities
     pi_W = prediction['pi_W']
@@ -27,10 +33,13 @@ def compute_pi_hat(prediction, prev_option):
     #get option termination probabilities
     beta = prediction['betas']  # [batch_size, num_options]
 
-    #create mask for the previous option(s)
-    mask = th.zeros_like(pi_W)
+    #rows without a previous option, index them with option 0 and select pi_W below
+    first = prev_option == NO_OPTION
+    prev_option = prev_option.clamp(min=0)
+
+    #create mask for the previous option(s), a comparison rather than scatter_ so it also runs batched under vmap
     # mask[th.arange(pi_W.size(0)), prev_option] = 1
-    mask.scatter_(1, prev_option.unsqueeze(1), 1)
+    mask = (prev_option.unsqueeze(1) == th.arange(pi_W.size(1), device=pi_W.device)).to(pi_W.dtype)
 
     # Extract only the termination probability for the previously active option.
     beta_prev = beta.gather(1, prev_option.unsqueeze(1))  # Shape: [batch_size, 1]
@@ -39,126 +48,187 @@ def compute_pi_hat(prediction, prev_option):
     # pi_hat = (1 - beta) * mask + beta * pi_W
     pi_hat = (1 - beta_prev) * mask + beta_prev * pi_W
 
-    return pi_hat  #tensor.shape[batch_size, 4]
-
-def compute_GAE(rewards, v_h, v_l, gamma, gae_lambda, device):
-    adv_h, adv_l, returns = [],[],[]
-    R, gae_h, gae_l = 0,0,0 #set final next state advantages and return = 0
-
-    for t in reversed(range(len(rewards))):
-        #compute TD errors
-        delta_h = rewards[t] + gamma * v_h[t + 1] - v_h[t]
-        delta_l = rewards[t] + gamma * v_l[t + 1] - v_l[t]
-
-        #compute GAE advantages
-        gae_h = delta_h + gamma * gae_lambda * gae_h
-        gae_l = delta_l + gamma * gae_lambda * gae_l
-
-        #Compute discounted return. only immediate reward if t is terminal state
-        R = rewards[t] + gamma * R
-
-        #store advantage and return in list
-        adv_h.insert(0, gae_h)
-        adv_l.insert(0, gae_l)
-        returns.insert(0, R)
-
-    #convert lists to tensors
-    returns = [th.tensor(agent_returns) for agent_returns in returns]
-    returns = th.stack(returns).to(device)
-    adv_h = th.stack(adv_h).to(device)
-    adv_l = th.stack(adv_l).to(device)
-
-    # remove final next state values from buffer
-    del v_h[-1]; del v_l[-1]
-
+    return th.where(first.unsqueeze(1), pi_W, pi_hat)  #tensor.shape[batch_size, 4]
+
+def compute_GAE(rewards, v_h, v_l, next_v_h, next_v_l, dones, gamma, gae_lambda, device):
+    """high and low MDP GAE advantages and discounted returns for whole episodes laid end to end, as float32
+        tensors [num_steps]. v_*, next_v_*: values of s_t and s_t+1 per step (for the last step of an episode the
+        bootstrap value, 0 if terminal). dones marks the last step of each episode. Both advantages are
+        computed in one reverse scan"""
+    rewards = to_numpy(rewards).astype(np.float64)
+    values = np.stack([to_numpy(v_h), to_numpy(v_l)])
+    next_values = np.stack([to_numpy(next_v_h), to_numpy(next_v_l)]).astype(np.float64)
+
+    #compute TD errors, then GAE advantages and discounted returns
+    deltas = rewards + gamma * next_values - values
+    adv_h, adv_l = discounted_cumsum(deltas, gamma * gae_lambda, dones)
+    returns = discounted_cumsum(rewards, gamma, dones)
+
+    #convert to tensors
+    returns = th.as_tensor(returns, dtype=th.float32, device=device)
+    adv_h = th.as_tensor(adv_h, dtype=th.float32, device=device)
+    adv_l = th.as_tensor(adv_l, dtype=th.float32, device=device)
     return returns, adv_h, adv_l
 
+def rollout_fields(params):
+    """RolloutStorage fields of a DAC buffer"""
+    fields = {'states': state_field(params), 'actions': ((), th.long), 'rewards': ((), th.float32),
+              'options': ((), th.long), 'prev_options': ((), th.long),
+              'pi_hat': ((params.num_options,), th.float32), 'pi_bar': ((params.action_dim,), th.float32),
+              'betas': ((params.num_options,), th.float32)}
+    for name in ('v_h', 'v_l', 'next_v_h', 'next_v_l', 'logp_h', 'logp_l'):
+        fields[name] = ((), th.float32)
+    return fields
+
+class VecCollector:
+    """runs DAC episodes on a batched grid world (GridWorldVec or GridWorldTorch) in lockstep. prev_option is
+        a tensor per env (NO_OPTION at episode start), so pi_hat, option and action sampling run for all envs
+        in one pass"""
+    def __init__(self, vec_env, device, num_members=1):
+        """num_members > 1: the envs are split into that many equal groups, one per member of an Ensemble
+            (helpers/ensemble_helper.py) passed as the network(s), each group runs its own episodes"""
+        self.env = vec_env
+        self.device = device
+        self.torch_backend = isinstance(vec_env.states, th.Tensor)
+        self.steps = None
+        self.num_members = num_members
+        self.member = np.arange(vec_env.num_envs) // (vec_env.num_envs // num_members)
+
+    def forward(self, network, state, envs=None):
+        """network output for the states of all envs, or of the envs listed in envs (each through its member)"""
+        if envs is None or self.num_members == 1:
+            return network(state)
+        return network(state, members=th.as_tensor(self.member[envs], device=self.device))
+
+    def collect(self, network, num_episodes, storage):
+        """runs exactly num_episodes episodes with the current network. An env whose episode ends starts
+            a new one only while fewer than num_episodes have started, after that it is masked out.
+            Truncated episodes bootstrap v_hat and v_bar from the final observation, terminated ones from 0.
+            Steps are written to a [t_max, num_envs] ring, each finished episode is copied into storage
+            in completion order. Returns the total reward of each episode.
+            With num_members > 1, storage is a list of one RolloutStorage per member, each member runs
+            num_episodes episodes and the episode rewards are returned per member"""
+        env, device = self.env, self.device
+        num_envs = env.num_envs
+        storages = storage if self.num_members > 1 else [storage]
+        if self.steps is None:
+            self.steps = storages[0].step_buffers(env.t_max, num_envs)
+        steps = self.steps
+        obs, _ = env.reset()
+        prev_option = th.full((num_envs,), NO_OPTION, dtype=th.long, device=device)
+        rows = th.arange(num_envs, device=device)
+
+        member_envs = num_envs // self.num_members
+        active = np.arange(num_envs) % member_envs < num_episodes
+        started = np.full(self.num_members, min(member_envs, num_episodes))
+        start = np.zeros(num_envs, dtype=np.int64)
+        episode_rewards = [[] for _ in storages]
+
+        t = 0
+        while active.any():
+            state = obs_to_tensor(obs).to(device)
+            #forward pass through network
+            with th.no_grad():
+                prediction = network(state)
+
+            #compute high MDP policy, logp, and sample options
+            pi_hat = compute_pi_hat(prediction, prev_option)
+            dist = Categorical(probs=pi_hat)
+            option = dist.sample()
+            logp_h = dist.log_prob(option)
+
+            #compute low MDP policies for current options, logp, and sample actions
+            pi_bar = prediction['pi_w'][rows, option, :]
+            dist = Categorical(probs=pi_bar)
+            action = dist.sample()
+            logp_l = dist.log_prob(action)
+
+            #compute high and low MDP value functions
+            v_bar = prediction['q_W'].gather(1, option.unsqueeze(-1))  # q value for current option
+            v_hat = (prediction['q_W'] * pi_hat).sum(-1).unsqueeze(-1)  # weighted sum of q for each option
+
+            #take a step in every env
+            next_obs, reward, terminated, truncated, info = env.step(action if self.torch_backend else action.cpu().numpy())
+            terminated, truncated = to_numpy(terminated), to_numpy(truncated)
+
+            #the serial loop stores option 0 as prev option at episode start
+            row = t % env.t_max
+            for name, value in (('states', state), ('actions', action), ('rewards', th.as_tensor(reward, device=device)),
+                                ('options', option), ('prev_options', prev_option.clamp(min=0)),
+                                ('v_h', v_hat.view(-1)), ('v_l', v_bar.view(-1)), ('logp_h', logp_h), ('logp_l', logp_l),
+                                ('pi_hat', pi_hat), ('pi_bar', pi_bar), ('betas', prediction['betas'])):
+                steps[name][row] = value
+
+            done = terminated | truncated
+            prev_option = th.where(th.as_tensor(done, device=device), NO_OPTION, option)
+
+            #Compute next values if episode env timelimit is reached, next values = 0 if terminal state reached
+            finished = np.flatnonzero(done & active)
+            if len(finished):
+                next_v_hat = th.zeros(len(finished), device=device)
+                next_v_bar = th.zeros(len(finished), device=device)
+                trunc = truncated[finished]
+                if trunc.any():
+                    idx = finished[trunc]
+                    final_obs = info['final_observation'][th.as_tensor(idx, device=device) if self.torch_backend else idx]
+                    last_option = option[th.as_tensor(idx, device=device)]
+                    with th.no_grad():
+                        next_prediction = self.forward(network, obs_to_tensor(final_obs).to(device), idx)
+                    next_pi_hat = compute_pi_hat(next_prediction, last_option)
+                    trunc = th.as_tensor(trunc, device=device)
+                    next_v_bar[trunc] = next_prediction['q_W'].gather(1, last_option.unsqueeze(-1)).view(-1)
+                    next_v_hat[trunc] = (next_prediction['q_W'] * next_pi_hat).sum(-1)
+                for i, h, l in zip(finished, next_v_hat, next_v_bar):
+                    k = self.member[i]
+                    ring_rows = th.arange(start[i], t + 1, device=device) % env.t_max
+                    episode = {name: value[ring_rows, i] for name, value in steps.items()}
+                    storages[k].insert_episode(episode, v_h=h, v_l=l)
+                    episode_rewards[k].append(episode['rewards'].sum().item())
+                    start[i] = t + 1
+                    if started[k] < num_episodes:
+                        started[k] += 1
+                    else:
+                        active[i] = False
+
+            obs = next_obs
+            t += 1
+
+        return episode_rewards if self.num_members > 1 else episode_rewards[0]
+
 class BatchProcessing:
     def __init__(self):
         self.counter = 0
         pass
 
-    def collate_batch(self, buffer, device):
-        """process buffer into batch tensors once buffer is full"""
-        batch_states, batch_actions, batch_pi_hat = [],[],[]
-        batch_options, batch_prev_options = [],[]
-        batch_v_h, batch_v_l, batch_logp_h, batch_logp_l = [],[],[],[]
-        batch_rtrn, batch_adv_h, batch_adv_l = [],[],[]
-        batch_pi_bar, batch_betas = [],[]
-
-        for data in buffer:
-            #unpack episode data
-            (states_mb, actions_mb, pi_hat_mb,
-             options_mb, prev_options_mb,
-             v_h_mb, v_l_mb, logp_h_mb, logp_l_mb,
-             rtrn_mb, adv_h_mb, adv_l_mb,
-             pi_bar_mb, betas_mb) = data
-
-            # print(f"state: {states_mb[0].shape}\n"
-            #       f"action: {actions_mb[0].shape}\n"
-            #       f"option: {options_mb[0].shape}\n"
-            #       f"pi_hat: {pi_hat_mb[0].shape}\n"
-            #       f"prev_option: {prev_options_mb[0].shape}\n"
-            #       f"rtrn: {rtrn_mb[0].shape}\n"
-            #       f"adv_h: {adv_h_mb[0].shape}\n"
-            #       f"adv_l: {adv_l_mb[0].shape}\n"
-            #       f"logp_h: {logp_h_mb[4]}\n"
-            #       f"logp_l: {logp_l_mb[4]}\n"
-            #       f"v_h: {v_h_mb[0].shape}\n"
-            #       f"v_l: {v_l_mb[0].shape}\n")
-
-            batch_states.append(th.stack(states_mb).to(device))
-            batch_actions.append(th.stack(actions_mb).to(device))
-            batch_pi_hat.append(th.stack(pi_hat_mb).to(device))
-            batch_options.append(th.stack(options_mb).to(device))
-            batch_prev_options.append(th.stack(prev_options_mb).to(device))
-            batch_v_h.append(th.stack(v_h_mb).to(device))
-            batch_v_l.append(th.stack(v_l_mb).to(device))
-            batch_logp_h.append(th.stack(logp_h_mb).to(device))
-            batch_logp_l.append(th.stack(logp_l_mb).to(device))
-            batch_rtrn.append(rtrn_mb)
-            batch_adv_h.append(adv_h_mb)
-            batch_adv_l.append(adv_l_mb)
-
-            #extras
-            batch_pi_bar.append(th.stack(pi_bar_mb).to(device))
-            batch_betas.append(th.stack(betas_mb).to(device))
-
-        # convert to tensors
-        batch_states = th.cat(batch_states, dim=0).squeeze(1)
-        batch_actions = th.cat(batch_actions, dim=0)
-        batch_pi_hat = th.cat(batch_pi_hat, dim=0).squeeze(1)
-        batch_options = th.cat(batch_options, dim=0)
-        batch_prev_options = th.cat(batch_prev_options, dim=0)
-        batch_v_h = th.cat(batch_v_h, dim=0).squeeze(1)
-        batch_v_l = th.cat(batch_v_l, dim=0).squeeze(1)
-        batch_logp_h = th.cat(batch_logp_h, dim=0)
-        batch_logp_l = th.cat(batch_logp_l, dim=0)
-        batch_rtrn = th.cat(batch_rtrn, dim=0).unsqueeze(-1)
-        batch_adv_h = th.cat(batch_adv_h, dim=0).squeeze(1)
-        batch_adv_l = th.cat(batch_adv_l, dim=0).squeeze(1)
+    def collate_batch(self, storage, gamma, gae_lambda, device):
+        """batch tensors of a full buffer. Stored fields are returned as views of the RolloutStorage,
+            returns and advantages of all episodes are computed together (compute_GAE)"""
+        batch_states = storage['states']
+        batch_actions = storage['actions'].unsqueeze(-1)
+        batch_pi_hat = storage['pi_hat']
+        batch_options = storage['options'].unsqueeze(-1)
+        batch_prev_options = storage['prev_options'].unsqueeze(-1)
+        batch_v_h = storage['v_h'].unsqueeze(-1)
+        batch_v_l = storage['v_l'].unsqueeze(-1)
+        batch_logp_h = storage['logp_h'].unsqueeze(-1)
+        batch_logp_l = storage['logp_l'].unsqueeze(-1)
+
+        #compute returns and high/low advantages for the whole buffer
+        batch_rtrn, batch_adv_h, batch_adv_l = compute_GAE(storage['rewards'], storage['v_h'], storage['v_l'],
+                                                           storage['next_v_h'], storage['next_v_l'],
+                                                           storage.get_dones(), gamma, gae_lambda, device)
+        batch_rtrn = batch_rtrn.unsqueeze(-1)
+        batch_adv_h = batch_adv_h.unsqueeze(-1)
+        batch_adv_l = batch_adv_l.unsqueeze(-1)
 
         #extras
-        batch_pi_bar = th.cat(batch_pi_bar, dim=0).squeeze(1)
-        batch_betas = th.cat(batch_betas, dim=0).squeeze(1)
+        batch_pi_bar = storage['pi_bar']
+        batch_betas = storage['betas']
 
         # normalize advantages
         batch_adv_h = (batch_adv_h - batch_adv_h.mean()) / batch_adv_h.std()
         batch_adv_l = (batch_adv_l - batch_adv_l.mean()) / batch_adv_l.std()
 
-        # print(f"state: {batch_states.shape}\n"
-        #       f"action: {batch_actions.shape}\n"
-        #       f"option: {batch_options.shape}\n"
-        #       f"pi_hat: {batch_pi_hat.shape}\n"
-        #       f"prev_option: {batch_prev_options.shape}\n"
-        #       f"rtrn: {batch_rtrn.shape}\n"
-        #       f"adv_h: {batch_adv_h.shape}\n"
-        #       f"adv_l: {batch_adv_l.shape}\n"
-        #       f"logp_h: {batch_logp_h.shape}\n"
-        #       f"logp_l: {batch_logp_l.shape}\n"
-        #       f"v_h: {batch_v_h.shape}\n"
-        #       f"v_l: {batch_v_l.shape}\n")
-
         processed_buffer = (batch_states, batch_actions, batch_pi_hat,
                             batch_options, batch_prev_options,
                             batch_v_h, batch_v_l, batch_logp_h, batch_logp_l,
@@ -0,0 +1,132 @@
+from copy import deepcopy
+import torch as th
+from torch.func import functional_call, stack_module_state, vmap
+
+
+def pad_stack(tensors):
+    """[num_members, longest length, ...] tensor of the members' tensors, zero padded at the end"""
+    out = tensors[0].new_zeros((len(tensors), max(len(t) for t in tensors)) + tuple(tensors[0].shape[1:]))
+    for k, tensor in enumerate(tensors):
+        out[k, :len(tensor)] = tensor
+    return out
+
+
+class Ensemble:
+    """K modules of one architecture (e.g. one per trial seed) with their parameters stacked as [K, ...] tensors.
+        Forward passes of all members run as one vmapped functional_call of a weightless copy of the module,
+        so K small networks cost about as much as one network on a K times larger batch.
+        Attributes the module itself has (select_action, actor_loss, ...) are looked up on a member template"""
+    def __init__(self, modules):
+        self.size = len(modules)
+        self.template = deepcopy(modules[0])
+        self.base = deepcopy(modules[0]).to('meta')
+        self.params, self.buffers = stack_module_state(modules)
+
+    def __getattr__(self, name):
+        if 'template' not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.__dict__['template'], name)
+
+    def states(self):
+        """parameters and buffers of all members, name -> [K, ...]"""
+        return {**self.params, **self.buffers}
+
+    def member_states(self, k):
+        return {name: value[k] for name, value in self.states().items()}
+
+    def parameters(self):
+        return list(self.params.values())
+
+    def functional(self, states, *args):
+        """module forward with the weights in states (one member's). The agents have no tied weights, skipping
+            the tie check saves most of functional_call's per-call overhead"""
+        return functional_call(self.base, states, args, tie_weights=False)
+
+    def __call__(self, x, members=None):
+        """x: member-major batch [K * B, ...], rows k*B to (k+1)*B go through member k. With members, row i of x
+            goes through member members[i] instead (any number of rows). Outputs are flattened the same way"""
+        if members is None:
+            out = vmap(self.functional)(self.states(), x.view((self.size, -1) + tuple(x.shape[1:])))
+            flatten = lambda y: y.flatten(0, 1)
+        else:
+            states = {name: value[members] for name, value in self.states().items()}
+            out = vmap(self.functional)(states, x.unsqueeze(1))
+            flatten = lambda y: y.squeeze(1)
+        return {name: flatten(y) for name, y in out.items()} if isinstance(out, dict) else flatten(out)
+
+    def member(self, k):
+        """stand-alone module with member k's current weights (for testing, evaluation, saving)"""
+        module = deepcopy(self.template)
+        module.load_state_dict({name: value.detach() for name, value in self.member_states(k).items()})
+        return module
+
+
+class StackedAdam:
+    """Adam on stacked ensemble parameters. Moments are elementwise and every member has its own step count, so
+        each member's slice is updated exactly as by its own th.optim.Adam; members left out of a step keep their
+        weights and moments. param_groups as for th.optim.Adam ({'params': [...], 'lr': ...})"""
+    def __init__(self, param_groups, num_members, betas=(0.9, 0.999), eps=1e-8):
+        self.param_groups = param_groups
+        self.betas = betas
+        self.eps = eps
+        self.steps = th.zeros(num_members)
+        self.state = {p: (th.zeros_like(p), th.zeros_like(p)) for group in param_groups for p in group['params']}
+
+    def zero_grad(self):
+        for p in self.state:
+            p.grad = None
+
+    @th.no_grad()
+    def step(self, members=None):
+        """members: bool tensor [K] of the members to update (default all)"""
+        beta1, beta2 = self.betas
+        members = th.ones_like(self.steps) if members is None else members.cpu().float()
+        self.steps += members
+        steps = self.steps.clamp(min=1)
+        #per-member moment weights and step sizes, 0 for members that skip this step
+        weight1, weight2 = members * (1 - beta1), members * (1 - beta2)
+        bias_correction2_sqrt = (1 - beta2 ** steps).sqrt()
+        step_sizes = members / (1 - beta1 ** steps)
+
+        for group in self.param_groups:
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+                exp_avg, exp_avg_sq = self.state[p]
+                shape = (-1,) + (1,) * (p.dim() - 1)
+                to_param = lambda x: x.to(p.device).view(shape)
+                exp_avg.lerp_(p.grad, to_param(weight1))
+                exp_avg_sq.lerp_(p.grad * p.grad, to_param(weight2))
+                denom = exp_avg_sq.sqrt().div_(to_param(bias_correction2_sqrt)).add_(self.eps)
+                p.sub_(exp_avg / denom * to_param(step_sizes * group['lr']))
+
+
+class EnsembleSampler:
+    """MinibatchSampler for ensemble buffers: member k's data is rows [:sizes[k]] of [K, N, ...] tensors (pad_stack).
+        Each pass every member draws its own index permutation and gets the minibatches MinibatchSampler would give it.
+        Step i yields the members' i-th minibatches as [K, batch_size, ...] tensors, a bool mask [K] of the members
+        for which that minibatch is full, and (k, tensors) for each member whose i-th minibatch is its shorter last one.
+        Rows of members without a full i-th minibatch are filler and must be masked out of the loss"""
+    def __init__(self, tensors, sizes, batch_size):
+        self.tensors = tensors
+        self.sizes = list(sizes)
+        self.batch_size = batch_size
+
+    def __len__(self):
+        return max(-(-size // self.batch_size) for size in self.sizes)
+
+    def __iter__(self):
+        batch_size, device = self.batch_size, self.tensors[0].device
+        idx = th.zeros((len(self.sizes), len(self) * batch_size), dtype=th.long)
+        for k, size in enumerate(self.sizes):
+            idx[k, :size] = th.randperm(size)
+        idx = idx.to(device)
+        rows = th.arange(len(self.sizes), device=device).unsqueeze(1)
+        shuffled = [tensor[rows, idx] for tensor in self.tensors]
+        sizes = th.tensor(self.sizes)
+
+        for start in range(0, len(self) * batch_size, batch_size):
+            end = start + batch_size
+            last = [(k, tuple(tensor[k, start:size] for tensor in shuffled))
+                    for k, size in enumerate(self.sizes) if start < size < end]
+            yield tuple(tensor[:, start:end] for tensor in shuffled), sizes >= end, last
@@ -1,28 +1,119 @@
 import numpy as np
 import torch as th
-import random
-from collections import deque
+
+from helpers.common_helper import obs_to_tensor
 
 
 # def pre_process(obs):
 #     state = th.FloatTensor(obs).unsqueeze(0)
 #     return state
 def pre_process(obs):
-    obs = np.asarray(obs)
-    obs = th.from_numpy(obs).float()
-    return obs
+    return obs_to_tensor(obs)
 
 class ReplayBuffer(object):
-    def __init__(self, capacity, seed=42):
-        self.rng = random.SystemRandom(seed)
-        self.buffer = deque(maxlen=capacity)
+    """ring buffer of preallocated typed columns: observations as int64 state indices (obs_mode='index') or
+        float32 arrays, int8 options, float32 rewards and bool dones. Observation columns are allocated on
+        the first push, once their shape is known. sample() draws indices from a numpy Generator seeded with seed
+        (the trial's buffer stream, stream_seed) and returns tensors sharing memory with the gathered arrays"""
+    def __init__(self, capacity, seed=None):
+        self.capacity = capacity
+        self.rng = np.random.default_rng(seed)
+        self.obs, self.next_obs = None, None
+        self.options = np.zeros(capacity, dtype=np.int8)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.pos = 0
+        self.size = 0
 
     def push(self, obs, option, reward, next_obs, done):
-        self.buffer.append((obs, option, reward, next_obs, done))
+        if self.obs is None:
+            obs = np.asarray(obs)
+            dtype = np.int64 if np.issubdtype(obs.dtype, np.integer) else np.float32
+            self.obs = np.zeros((self.capacity,) + obs.shape, dtype=dtype)
+            self.next_obs = np.zeros_like(self.obs)
+
+        i = self.pos
+        self.obs[i] = obs
+        self.options[i] = option
+        self.rewards[i] = reward
+        self.next_obs[i] = next_obs
+        self.dones[i] = done
+        self.pos = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
 
     def sample(self, batch_size):
-        obs, option, reward, next_obs, done = zip(*self.rng.sample(self.buffer, batch_size))
-        return np.stack(obs), option, reward, np.stack(next_obs), done
+        """batch_size distinct transitions as tensors (obs, options, rewards, next_obs, dones)"""
+        idx = self.rng.choice(self.size, batch_size, replace=False)
+        return (th.from_numpy(self.obs[idx]), th.from_numpy(self.options[idx]), th.from_numpy(self.rewards[idx]),
+                th.from_numpy(self.next_obs[idx]), th.from_numpy(self.dones[idx]))
 
     def __len__(self):
-        return len(self.buffer)
\ No newline at end of file
+        return self.size
+
+class SumTree(object):
+    """array-backed binary sum tree over capacity leaves. tree[1] is the total, node i has children 2i and 2i+1,
+        leaf j is tree[size + j]. Batch updates and prefix-sum searches walk the log2(size) levels once,
+        vectorized over the batch"""
+    def __init__(self, capacity):
+        self.size = 1 << max(capacity - 1, 1).bit_length()
+        self.depth = self.size.bit_length() - 1
+        self.tree = np.zeros(2 * self.size)
+        self.children = self.tree.reshape(-1, 2)   #row i is (tree[2i], tree[2i+1])
+
+    @property
+    def total(self):
+        return self.tree[1]
+
+    def update(self, idx, values):
+        node = np.asarray(idx, dtype=np.int64) + self.size
+        self.tree[node] = values
+        for _ in range(self.depth):     #duplicate parents just recompute the same sum
+            node >>= 1
+            self.tree[node] = self.children[node].sum(axis=1)
+
+    def find(self, prefix):
+        """leaf index j of each prefix sum, i.e. sum(leaves[:j]) <= prefix < sum(leaves[:j+1])"""
+        node = np.ones(len(prefix), dtype=np.int64)
+        prefix = np.array(prefix, dtype=np.float64)
+        for _ in range(self.depth):
+            node <<= 1      #left child
+            left_sum = self.tree[node]
+            right = prefix >= left_sum
+            np.subtract(prefix, left_sum, out=prefix, where=right)
+            node += right
+        return node - self.size
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """proportional prioritized replay: transition i is sampled with probability p_i / sum(p) where
+        p_i = (|td_i| + eps)^alpha, new transitions get the current max priority. sample() also returns
+        the indices (for update_priorities) and importance-sampling weights (N * P(i))^-beta scaled to max 1"""
+    def __init__(self, capacity, alpha=0.6, eps=1e-6, seed=None):
+        super(PrioritizedReplayBuffer, self).__init__(capacity, seed)
+        self.alpha = alpha
+        self.eps = eps
+        self.tree = SumTree(capacity)
+        self.max_priority = 1.
+
+    def push(self, obs, option, reward, next_obs, done):
+        self.tree.update([self.pos], self.max_priority)
+        super(PrioritizedReplayBuffer, self).push(obs, option, reward, next_obs, done)
+
+    def sample(self, batch_size, beta=0.4):
+        """stratified sampling: one prefix sum drawn uniformly from each of batch_size equal segments"""
+        total = self.tree.total
+        prefix = (np.arange(batch_size) + self.rng.random(batch_size)) * (total / batch_size)
+        idx = np.minimum(self.tree.find(prefix), self.size - 1)     #guards float round-off at the right edge
+
+        probs = self.tree.tree[idx + self.tree.size] / total
+        weights = (self.size * probs) ** -beta
+        weights = (weights / weights.max()).astype(np.float32)
+
+        batch = (th.from_numpy(self.obs[idx]), th.from_numpy(self.options[idx]), th.from_numpy(self.rewards[idx]),
+                 th.from_numpy(self.next_obs[idx]), th.from_numpy(self.dones[idx]))
+        return batch, idx, th.from_numpy(weights)
+
+    def update_priorities(self, idx, td_errors):
+        priorities = (np.abs(td_errors) + self.eps) ** self.alpha
+        self.tree.update(idx, priorities)
+        self.max_priority = max(self.max_priority, priorities.max())
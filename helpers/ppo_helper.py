@@ -1,69 +1,141 @@
+import numpy as np
 import torch as th
 import sys
 
+from helpers.common_helper import obs_to_tensor, to_numpy, discounted_cumsum, state_field
+
 def pre_process(obs):
-    state = th.FloatTensor(obs).unsqueeze(0)
+    state = obs_to_tensor(obs).unsqueeze(0)
     return state
 
+def rollout_fields(params):
+    """RolloutStorage fields of a PPO buffer"""
+    return {'states': state_field(params), 'actions': ((), th.long), 'logp': ((), th.float32),
+            'rewards': ((), th.float32), 'values': ((), th.float32), 'next_values': ((), th.float32)}
+
+class VecCollector:
+    """runs PPO episodes on a batched grid world (GridWorldVec or GridWorldTorch) in lockstep, with one
+        actor/critic forward per step for all envs"""
+    def __init__(self, vec_env, device, num_members=1):
+        """num_members > 1: the envs are split into that many equal groups, one per member of an Ensemble
+            (helpers/ensemble_helper.py) passed as the network(s), each group runs its own episodes"""
+        self.env = vec_env
+        self.device = device
+        self.torch_backend = isinstance(vec_env.states, th.Tensor)
+        self.steps = None
+        self.num_members = num_members
+        self.member = np.arange(vec_env.num_envs) // (vec_env.num_envs // num_members)
+
+    def forward(self, network, state, envs=None):
+        """network output for the states of all envs, or of the envs listed in envs (each through its member)"""
+        if envs is None or self.num_members == 1:
+            return network(state)
+        return network(state, members=th.as_tensor(self.member[envs], device=self.device))
+
+    def collect(self, actor, critic, num_episodes, storage):
+        """runs exactly num_episodes episodes with the current actor. An env whose episode ends starts
+            a new one only while fewer than num_episodes have started, after that it is masked out.
+            Truncated episodes bootstrap from the critic value of their final observation, terminated
+            ones from 0. Steps are written to a [t_max, num_envs] ring, each finished episode is copied
+            into storage in completion order. Returns the total reward of each episode.
+            With num_members > 1, storage is a list of one RolloutStorage per member, each member runs
+            num_episodes episodes and the episode rewards are returned per member"""
+        env, device = self.env, self.device
+        num_envs = env.num_envs
+        storages = storage if self.num_members > 1 else [storage]
+        if self.steps is None:
+            self.steps = storages[0].step_buffers(env.t_max, num_envs)
+        steps = self.steps
+        obs, _ = env.reset()
+
+        member_envs = num_envs // self.num_members
+        active = np.arange(num_envs) % member_envs < num_episodes
+        started = np.full(self.num_members, min(member_envs, num_episodes))
+        start = np.zeros(num_envs, dtype=np.int64)
+        episode_rewards = [[] for _ in storages]
+
+        t = 0
+        while active.any():
+            state = obs_to_tensor(obs).to(device)
+
+            #select actions, compute value estimates for all envs at once
+            with th.no_grad():
+                logits = actor(state)
+                action, logp, _ = actor.select_action(logits)
+                value = critic(state)
+
+            #take a step in every env
+            next_obs, reward, terminated, truncated, info = env.step(action if self.torch_backend else action.cpu().numpy())
+            terminated, truncated = to_numpy(terminated), to_numpy(truncated)
+
+            row = t % env.t_max
+            steps['states'][row] = state
+            steps['actions'][row] = action
+            steps['logp'][row] = logp
+            steps['values'][row] = value.view(-1)
+            steps['rewards'][row] = th.as_tensor(reward, device=device)
+
+            #Compute next value if episode env timelimit is reached, next value = 0 if terminal state reached
+            finished = np.flatnonzero((terminated | truncated) & active)
+            if len(finished):
+                next_values = th.zeros(len(finished), device=device)
+                trunc = truncated[finished]
+                if trunc.any():
+                    idx = finished[trunc]
+                    final_obs = info['final_observation'][th.as_tensor(idx, device=device) if self.torch_backend else idx]
+                    with th.no_grad():
+                        next_values[th.as_tensor(trunc, device=device)] = self.forward(critic, obs_to_tensor(final_obs).to(device), idx).view(-1)
+                for i, next_value in zip(finished, next_values):
+                    k = self.member[i]
+                    rows = th.arange(start[i], t + 1, device=device) % env.t_max
+                    episode = {name: value[rows, i] for name, value in steps.items()}
+                    storages[k].insert_episode(episode, values=next_value)
+                    episode_rewards[k].append(episode['rewards'].sum().item())
+                    start[i] = t + 1
+                    if started[k] < num_episodes:
+                        started[k] += 1
+                    else:
+                        active[i] = False
+
+            obs = next_obs
+            t += 1
+
+        return episode_rewards if self.num_members > 1 else episode_rewards[0]
+
 class BatchProcessing:
     def __init__(self):
         pass
 
-    def collate_batch(self, buffer, device):
-        """process buffer into batch tensors once buffer is full"""
-        batch_states, batch_actions, batch_logp = [],[],[]
-        batch_values, batch_returns, batch_advantages = [],[],[]
-
-        for data in buffer:
-            state, action, logp, value, rtrn, adv = data
-            state = th.stack(state).to(device)
-            action = th.stack(action).to(device)
-            logp = th.stack(logp).to(device)
-            value = th.stack(value).to(device)
-
-            batch_states.append(state)
-            batch_actions.append(action)
-            batch_logp.append(logp)
-            batch_values.append(value)
-            batch_returns.append(rtrn)
-            batch_advantages.append(adv)
-
-        #convert to tensors
-        batch_states = th.cat(batch_states, dim=0)
-        batch_actions = th.cat(batch_actions, dim=0)
-        batch_logp = th.cat(batch_logp, dim=0)
-        batch_values = th.cat(batch_values, dim=0).squeeze(-1)
-        batch_returns = th.cat(batch_returns, dim=0)
-        batch_advantages = th.cat(batch_advantages, dim=0).squeeze(-1)
+    def collate_batch(self, storage, gamma, gae_lambda, device):
+        """batch tensors of a full buffer. Stored fields are returned as views of the RolloutStorage,
+            returns and advantages of all episodes are computed together (compute_GAE)"""
+        batch_states = storage['states'].unsqueeze(1)
+        batch_actions = storage['actions'].unsqueeze(1)
+        batch_logp = storage['logp'].unsqueeze(1)
+        batch_values = storage['values'].unsqueeze(1)
+
+        #compute returns and advantages for the whole buffer
+        batch_returns, batch_advantages = compute_GAE(storage['rewards'], storage['values'], storage['next_values'],
+                                                      storage.get_dones(), gamma, gae_lambda, device)
+        batch_advantages = batch_advantages.view(batch_values.shape)
 
         # normalize advantages
         batch_advantages = (batch_advantages - batch_advantages.mean()) / batch_advantages.std()
 
         return batch_states, batch_actions, batch_logp, batch_values, batch_returns, batch_advantages
 
-def compute_GAE(rewards, values, gamma, gae_lambda, device):
-    advantages, returns = [], []
-    R, gae = 0, 0 #set final next state advantage and return = 0
-
-    for t in reversed(range(len(rewards))):
-        #compute TD error
-        delta = rewards[t] + gamma * values[t + 1] - values[t]
-
-        #compute GAE advantage
-        gae = delta + gamma * gae_lambda * gae
-
-        #Compute discounted return. only immediate reward if t is terminal state
-        R = rewards[t] + gamma * R
-
-        #store advantage and return in list
-        advantages.insert(0, gae)
-        returns.insert(0, R)
-
-    #convert lists to tensors
-    returns = [th.tensor(agent_returns) for agent_returns in returns]
-    returns = th.stack(returns).to(device)
-    advantages = th.stack(advantages).to(device)
-
-    del values[-1]  # remove final next state value from buffer
-
-    return returns, advantages
\ No newline at end of file
+def compute_GAE(rewards, values, next_values, dones, gamma, gae_lambda, device):
+    """GAE advantages and discounted returns for whole episodes laid end to end, as float32 tensors [num_steps].
+        values, next_values: V(s_t) and V(s_t+1) per step (for the last step of an episode the bootstrap value,
+        0 if terminal). dones marks the last step of each episode. Returns are the discounted rewards-to-go"""
+    rewards = to_numpy(rewards).astype(np.float64)
+
+    #compute TD errors, then GAE advantages and discounted returns with one reverse scan each
+    deltas = rewards + gamma * to_numpy(next_values).astype(np.float64) - to_numpy(values)
+    advantages = discounted_cumsum(deltas, gamma * gae_lambda, dones)
+    returns = discounted_cumsum(rewards, gamma, dones)
+
+    #convert to tensors
+    returns = th.as_tensor(returns, dtype=th.float32, device=device)
+    advantages = th.as_tensor(advantages, dtype=th.float32, device=device)
+    return returns, advantages
@@ -1,52 +1,50 @@
 import argparse, time
-import gymnasium as gym
-
-from env.fourrooms import FourRooms, FourRooms_m
 
 # Import runner, trainers, and parameters classes here
-from runner.runner import ALGO_Runner
+from runner.runner import ALGO_Runner, setup_env
+from runner.sweep import load_spec, run_sweep
+from runner.pbt import run_pbt
 from train.ppo_trainer import PPOtrainer
 from train.oc_trainer import OCtrainer
 from train.dac_trainer import DACtrainer
+from train.ppo_ensemble_trainer import PPOEnsembletrainer
+from train.dac_ensemble_trainer import DACEnsembletrainer
 from util.parameters import ParametersPPO, ParametersOC, ParametersDAC
 
 def main():
     parser  = argparse.ArgumentParser(description = "Run different variations of algorithms and environments.")
-    parser.add_argument('--env', type=str, required=True, help='The environment to run. Choose from "cartpole" or "fourrooms" or "fourrooms_m".')
-    parser.add_argument('--algo', type=str, required=True, help='The algorithm to use. Choose from "ppo" or "oc" or "dac".')
+    parser.add_argument('--env', type=str, help='The environment to run. Choose from "cartpole" or "fourrooms" or "fourrooms_m" or "multirooms".')
+    parser.add_argument('--algo', type=str, help='The algorithm to use. Choose from "ppo" or "oc" or "dac".')
+    parser.add_argument('--sweep', type=str, help='JSON hyperparameter sweep spec (see runner/sweep.py), runs its (config, seed) jobs instead of one experiment. --env/--algo override the spec\'s.')
+    parser.add_argument('--pbt', type=str, help='JSON population based training spec (see runner/pbt.py) for dac or oc, runs a population instead of one experiment.')
     args = parser.parse_args()
 
-    #create environment
-    if args.env == 'cartpole':
-        env_name = 'CartPole-v1'
-        env = gym.make(env_name)
-    elif args.env == 'fourrooms':
-        env_name = 'FourRooms'
-        env = FourRooms()
-    elif args.env == 'fourrooms_m':
-        env_name = 'FourRooms_m'
-        env = FourRooms_m()
-    else:
-        raise ValueError("Environment name incorrect or found")
+    if args.sweep is not None:
+        run_sweep(load_spec(args.sweep), env=args.env, algo=args.algo)
+        return
+    if args.pbt is not None:
+        run_pbt(load_spec(args.pbt), env=args.env, algo=args.algo)
+        return
+    if args.env is None or args.algo is None:
+        parser.error("--env and --algo are required without --sweep or --pbt")
 
     #assign params and trainer classes based on algo input
     if args.algo == 'ppo':
         params = ParametersPPO()
-        trainer = lambda: PPOtrainer()
+        trainer = PPOEnsembletrainer if params.ensemble_trials else PPOtrainer
     elif args.algo == 'oc':
         params = ParametersOC()
-        trainer = lambda: OCtrainer()
+        trainer = OCtrainer
+        if params.ensemble_trials:
+            raise ValueError("ensemble_trials is not available for oc")
     elif args.algo == 'dac':
         params = ParametersDAC()
-        trainer = lambda: DACtrainer()
+        trainer = DACEnsembletrainer if params.ensemble_trials else DACtrainer
     else:
         raise ValueError("Algorithm name incorrect or not found")
 
-    #add environment specific parameters
-    params.env_name = env_name
-    params.state_dim = env.observation_space.shape[0]
-    params.action_dim = env.action_space.n
-    # TODO: add logic for discrete vs. continuous spaces?
+    #create environment (trials build their own copies with make_env) and add environment specific parameters
+    env = setup_env(params, args.env)
 
     #define runner and run experiment
     runner = ALGO_Runner(env, trainer)
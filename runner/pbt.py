@@ -0,0 +1,233 @@
+import os, csv, traceback
+import multiprocessing as mp
+from copy import deepcopy
+import numpy as np
+import torch as th
+
+from runner.runner import setup_trial, setup_env
+from runner.sweep import ALGOS, check_attributes, sample_configs, to_param
+
+
+#Example spec (main.py --pbt spec.json), every key but "params" is optional:
+#{
+#    "algo": "dac", "env": "fourrooms",  dac or oc
+#    "params": {"lr_ha": {"log_uniform": [1e-4, 1e-3]}, "entropy_coef_h": [0.005, 0.01, 0.02]},
+#                                        float or int hyperparameters (e.g. oc's eps_decay), initial values drawn
+#                                        like a random sweep
+#                                        (dicts distributions, lists choices), perturbed values stay in their range
+#    "overrides": {"total_train_episodes": 2000},    fixed for every member
+#    "population": 8,                    members, member k is seeded like trial k
+#    "workers": 2,                       local processes, each trains its share of the members
+#    "interval": 100,                    episodes between exploit/explore steps
+#    "fraction": 0.25,                   bottom fraction copies a member of the top fraction, in (0, 0.5]
+#    "perturb": [0.8, 1.2],              factors a copied member's hyperparameters are multiplied by
+#    "window": 3,                        member score: mean of its last window test returns, a copied member
+#                                        starts from its parent's last window returns
+#    "seed": 0,                          initial values and exploit/explore choices
+#    "results": "pbt_results.csv"        one row per member per interval: its score, the hyperparameters it trained
+#                                        the interval with and the member it continues from (if copied)
+#}
+
+
+class PopulationShard:
+    """the trainers of some members of a population, trained in turn"""
+    def __init__(self, algo, env, overrides):
+        self.algo, self.env, self.overrides = algo, env, overrides
+        self.trainers = {}
+
+    def add(self, member, config):
+        params_class, trainer = ALGOS[self.algo]
+        params = params_class()
+        for name, value in {**self.overrides, **config}.items():
+            setattr(params, name, to_param(params, name, value))
+        setup_env(params, self.env)
+        self.trainers[member] = setup_trial(trainer, params, member)
+
+    def run(self, num_episodes):
+        """trains every member until num_episodes episodes, returns their test returns so far (trainer.run collects
+            pending background tests before it returns, so with async_eval a member is ranked on all of them)"""
+        for trainer in self.trainers.values():
+            trainer.run(num_episodes)
+        return {member: trainer.test_returns for member, trainer in self.trainers.items()}
+
+    def get_state(self, member):
+        return self.trainers[member].state_dict()
+
+    def set_state(self, member, state, config):
+        """exploit: member continues from state (weights and optimizer state of another member) with the
+            hyperparameters config, applied to the Adam param groups in place"""
+        trainer = self.trainers[member]
+        for name, value in config.items():
+            setattr(trainer.params, name, value)
+        trainer.load_state_dict(deepcopy(state))
+
+    def finish(self):
+        return {member: trainer.finish() for member, trainer in self.trainers.items()}
+
+
+class LocalShard:
+    """PopulationShard in this process, with ProcessShard's send/recv interface"""
+    def __init__(self, *args):
+        self.shard = PopulationShard(*args)
+
+    def send(self, method, *args):
+        self.result = getattr(self.shard, method)(*args)
+
+    def recv(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+def _shard_process(conn, num_threads, args):
+    th.set_num_threads(num_threads)
+    shard = PopulationShard(*args)
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        method, method_args = task
+        try:
+            conn.send((getattr(shard, method)(*method_args), None))
+        except Exception:
+            conn.send((None, traceback.format_exc()))
+
+
+class ProcessShard:
+    """PopulationShard in a spawned process. send() starts a call, recv() waits for its result, so calls
+        sent to several shards run concurrently"""
+    def __init__(self, ctx, num_threads, *args):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_shard_process, args=(child_conn, num_threads, args), daemon=True)
+        self.process.start()
+
+    def send(self, method, *args):
+        self.conn.send((method, args))
+
+    def recv(self):
+        result, error = self.conn.recv()
+        if error is not None:
+            raise RuntimeError(f"population worker failed:\n{error}")
+        return result
+
+    def close(self):
+        self.conn.send(None)
+        self.process.join()
+
+
+def perturb(config, bounds, factors, rng):
+    """explore: every hyperparameter multiplied by one of factors, clipped to its range. Ints are rounded and kept >= 1"""
+    perturbed = {}
+    for name, value in config.items():
+        new_value = float(np.clip(value * rng.choice(factors), *bounds[name]))
+        perturbed[name] = max(1, int(round(new_value))) if isinstance(value, int) else new_value
+    return perturbed
+
+def run_pbt(spec, env=None, algo=None):
+    """population based training: spec['population'] DAC or OC trainers run concurrently on spec['workers'] local
+        processes. Every spec['interval'] episodes the members are ranked by their recent test returns and each
+        member of the bottom fraction continues from the weights and optimizer state of a random top member with that
+        member's hyperparameters perturbed. Returns each member's (train_rewards, test_rewards, test_episode_lengths)"""
+    algo = algo or spec.get('algo')
+    env = env or spec.get('env')
+    if algo not in ('dac', 'oc'):
+        raise ValueError("population based training is available for dac and oc")
+    overrides = spec.get('overrides', {})
+    params = ALGOS[algo][0]()
+    space = spec['params']
+    check_attributes(params, list(space) + list(overrides))
+    for name in space:
+        default = getattr(params, name)
+        if isinstance(default, bool) or not isinstance(default, (int, float)):
+            raise ValueError(f"{name} is not a float or int hyperparameter, population based training perturbs numbers only")
+    for name, value in overrides.items():
+        setattr(params, name, to_param(params, name, value))
+    setup_env(params, env)    #fail on a bad env name before any worker starts
+
+    population = spec.get('population', 8)
+    interval = spec.get('interval', 100)
+    fraction = spec.get('fraction', 0.25)
+    if not 0 < fraction <= 0.5:
+        raise ValueError(f"fraction must be in (0, 0.5] so the top and bottom members do not overlap, got {fraction}")
+    #at least one member exploited, the bottom and top sets disjoint
+    num_exploit = min(max(1, int(population * fraction)), population // 2)
+    factors = spec.get('perturb', [0.8, 1.2])
+    window = spec.get('window', 3)
+    rng = np.random.default_rng(spec.get('seed', 0))
+    bounds = {name: tuple(values.values())[0] if isinstance(values, dict) else (min(values), max(values))
+              for name, values in space.items()}
+
+    configs = sample_configs({'params': space, 'method': 'random', 'num_samples': population, 'seed': spec.get('seed', 0)})
+    #values take the type of the default whatever they are drawn from, perturb keeps ints ints
+    for config in configs:
+        for name, value in config.items():
+            config[name] = max(1, int(round(value))) if isinstance(getattr(params, name), int) else float(value)
+    workers = max(1, min(spec.get('workers', 1), population))
+    if workers == 1:
+        shards = [LocalShard(algo, env, overrides)]
+    else:
+        num_threads = max(1, (os.cpu_count() or 1) // workers)
+        ctx = mp.get_context('spawn')
+        shards = [ProcessShard(ctx, num_threads, algo, env, overrides) for _ in range(workers)]
+    shard_of = lambda member: shards[member % workers]
+    #score window of each member: the returns inherited from its parent at the last copy, then its own test
+    #returns from index window_start on
+    inherited = {member: [] for member in range(population)}
+    window_start = {member: 0 for member in range(population)}
+
+    path = spec.get('results', 'pbt_results.csv')
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['episodes', 'member', 'score', 'copied_from'] + list(space))
+        writer.writeheader()
+        try:
+            for member, config in enumerate(configs):
+                shard_of(member).send('add', member, config)
+                shard_of(member).recv()
+
+            for episodes in range(interval, params.total_train_episodes + interval, interval):
+                episodes = min(episodes, params.total_train_episodes)
+                for shard in shards:
+                    shard.send('run', episodes)
+                test_returns = {}
+                for shard in shards:
+                    test_returns.update(shard.recv())
+                recent = {member: (inherited[member] + returns[window_start[member]:])[-window:]
+                          for member, returns in test_returns.items()}
+                scores = {member: np.mean(returns) if returns else -np.inf for member, returns in recent.items()}
+
+                #exploit and explore between intervals, not after the last one
+                trained_configs = list(configs)
+                parents = {}
+                if episodes < params.total_train_episodes:
+                    ranked = sorted(scores, key=scores.get)
+                    for member in ranked[:num_exploit]:
+                        parent = int(rng.choice(ranked[-num_exploit:]))
+                        shard_of(parent).send('get_state', parent)
+                        state = shard_of(parent).recv()
+                        configs[member] = perturb(configs[parent], bounds, factors, rng)
+                        shard_of(member).send('set_state', member, state, configs[member])
+                        shard_of(member).recv()
+                        parents[member] = parent
+                        inherited[member] = list(recent[parent])
+                        window_start[member] = len(test_returns[member])
+
+                for member in range(population):
+                    writer.writerow({'episodes': episodes, 'member': member, 'score': scores[member],
+                                     'copied_from': parents.get(member, ''), **trained_configs[member]})
+                f.flush()
+                print(f"PBT episode {episodes}: scores {np.round([scores[m] for m in range(population)], 3)} | "
+                      f"copied (member <- parent): {parents}")
+
+            results = {}
+            for shard in shards:
+                shard.send('finish')
+            for shard in shards:
+                results.update(shard.recv())
+        finally:
+            for shard in shards:
+                shard.close()
+
+    best = max(scores, key=scores.get)
+    print(f"PBT complete. Best member {best} (score {scores[best]:.3f}) hyperparameters: {configs[best]}")
+    return [results[member] for member in range(population)]
@@ -1,13 +1,93 @@
 import os, time, sys
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
 import numpy as np
+import torch as th
+from gymnasium import spaces
+from helpers.common_helper import make_env
 from util.benchmarker import Utils
+from util.dp_solver import optimal_return
+from util.rng import trial_seed, seed_everything
+
+
+#main.py --env names
+ENV_NAMES = {'cartpole': 'CartPole-v1', 'fourrooms': 'FourRooms', 'fourrooms_m': 'FourRooms_m', 'multirooms': 'MultiRooms'}
+
+def setup_env(params, env):
+    """sets params.env_name and the state/action dims for the env named env (a main.py --env name), returns an
+        instance of it. Call after any params that change the env (obs_mode, layout_kwargs) are set"""
+    if env not in ENV_NAMES:
+        raise ValueError("Environment name incorrect or found")
+    params.env_name = ENV_NAMES[env]
+    env = make_env(params)
+
+    #add environment specific parameters
+    if isinstance(env.observation_space, spaces.Discrete):    #integer state index observations
+        params.state_dim = env.observation_space.n
+    else:
+        params.state_dim = env.observation_space.shape[0]
+    params.action_dim = env.action_space.n
+    # TODO: add logic for discrete vs. continuous spaces?
+    return env
+
+def setup_trial(trainer, params, trial):
+    """trainer instance set up (trainer.setup) for one trial on its own env (make_env) and params copy, seeded from
+        (params.seed, trial). Train it with trainer.run(num_episodes), possibly in stages, and trainer.finish()"""
+    print(f"Trial: {trial + 1}")
+    params = deepcopy(params)
+    env = make_env(params)
+
+    #ensure trials start with same goal.
+    if "FourRoom" in params.env_name: env.choose_goal(params.starting_goal)
+
+    #seed from the trial index so results don't depend on trial order
+    seed = params.trial_seed = trial_seed(params.seed, trial)
+    seed_everything(seed)
+    env.reset(seed=seed)
+
+    trainer = trainer()
+    trainer.setup(env, params)
+    return trainer
+
+def run_trial(trainer, params, trial):
+    """trains one trial (setup_trial) for params.total_train_episodes. Returns (train_rewards, test_rewards,
+        test_episode_lengths)"""
+    trainer = setup_trial(trainer, params, trial)
+    trainer.run(params.total_train_episodes)
+    return trainer.finish()
+
+def _init_worker(num_threads):
+    #cap intra-op threads so the workers together do not oversubscribe the cores
+    th.set_num_threads(num_threads)
 
 
 class ALGO_Runner():
     def __init__(self, env, trainer):
+        """env: instance of the experiment's env (layout for optimal returns). trainer: trainer class,
+            instantiated once per trial (picklable, so trials can run in worker processes)"""
         self.env = env
         self.trainer = trainer
 
+    def run_trials(self, params):
+        """all trials' results in trial order, run one after another, in params.num_workers spawned processes
+            or (params.ensemble_trials, self.trainer an ensemble trainer) all at once as one vmapped ensemble"""
+        trials = range(params.num_trials)
+        if params.ensemble_trials:
+            params = deepcopy(params)
+            env = make_env(params)
+            if "FourRoom" in params.env_name: env.choose_goal(params.starting_goal)
+            return self.trainer().train_trials(env, params, list(trials))
+
+        workers = min(params.num_workers, params.num_trials)
+        if workers <= 1:
+            return [run_trial(self.trainer, params, trial) for trial in trials]
+
+        num_threads = max(1, (os.cpu_count() or 1) // workers)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(num_threads,)) as pool:
+            return list(pool.map(run_trial, [self.trainer] * len(trials), [params] * len(trials), trials))
+
     def run_experiment(self, params, load_save_result=False):
         """Change load_save_result to True to plot from existing test/train rewards"""
         start = time.time()
@@ -17,15 +97,7 @@ class ALGO_Runner():
             all_test_returns = []
             all_test_lengths = []
 
-            for trial in range(params.num_trials):
-                print(f"Trial: {trial + 1}")
-                trainer = self.trainer()
-
-                #ensure trials start with same goal.
-                if "FourRoom" in params.env_name: self.env.choose_goal(params.starting_goal)
-
-                train_rewards, test_rewards, test_episode_lengths = trainer.train(self.env, params)
-
+            for train_rewards, test_rewards, test_episode_lengths in self.run_trials(params):
                 all_train_returns.append(train_rewards)
                 all_test_returns.append(test_rewards)
                 all_test_lengths.append(test_episode_lengths)
@@ -39,13 +111,25 @@ class ALGO_Runner():
             all_test_returns = np.load('all_test_returns.npy')
             all_test_lengths = np.load('all_test_lengths.npy')
 
+        #exact optimal return per goal for grid worlds (ground truth for regret)
+        optimal_returns = None
+        if hasattr(self.env, 'layout'):
+            goals = [params.starting_goal if "FourRoom" in params.env_name else self.env.default_goal]
+            if params.switch_goal and params.new_goal is not None:
+                goals.append(params.new_goal)
+            optimal_returns = [optimal_return(self.env.layout, goal, params.gamma, params.t_max) for goal in goals]
+
         utils = Utils()
         average_returns, max_return, max_return_ci, individual_returns, g1g2_ret, g1g2_ci = utils.benchmark_plot(all_train_returns,
                                                                                               all_test_returns, all_test_lengths,
-                                                                                              params.test_interval)
+                                                                                              params.test_interval,
+                                                                                              optimal_returns=optimal_returns)
         print(f"Average Return: {np.round(average_returns, 2)}")
         print(f"Overall Max Return w/ 95% CI: {max_return:.3f} +- {max_return_ci:.3f}")
         print(f"Individual Run Overall Max Returns: {np.round(individual_returns, 3)}")
         print(f"Max Return for Goal 1 w/ 95% CI: {g1g2_ret[0]:.3f} +- {g1g2_ci[0]:.3f}")
         print(f"Max Return for Goal 2 w/ 95% CI: {g1g2_ret[1]:.3f} +- {g1g2_ci[1]:.3f}")
+        if optimal_returns is not None:
+            for i, optimal in enumerate(optimal_returns):
+                print(f"Optimal Return for Goal {i + 1}: {optimal:.3f} | Regret of max return: {optimal - g1g2_ret[i]:.3f}")
         print("Completed experiment")
\ No newline at end of file
@@ -0,0 +1,228 @@
+import os, csv, json, time, hashlib, itertools
+import multiprocessing as mp
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from torch.nn import functional as F
+
+from runner.runner import run_trial, setup_trial, setup_env, _init_worker
+from train.ppo_trainer import PPOtrainer
+from train.oc_trainer import OCtrainer
+from train.dac_trainer import DACtrainer
+from util.parameters import ParametersPPO, ParametersOC, ParametersDAC
+from util.rng import trial_seed
+
+
+ALGOS = {'ppo': (ParametersPPO, PPOtrainer), 'oc': (ParametersOC, OCtrainer), 'dac': (ParametersDAC, DACtrainer)}
+
+#random search distributions, {"log_uniform": [lo, hi]} etc. in the spec
+DISTRIBUTIONS = {
+    'uniform': lambda rng, lo, hi: float(rng.uniform(lo, hi)),
+    'log_uniform': lambda rng, lo, hi: float(np.exp(rng.uniform(np.log(lo), np.log(hi)))),
+    'int_uniform': lambda rng, lo, hi: int(rng.integers(lo, hi + 1)),
+}
+
+METRICS = ['episodes', 'max_return', 'max_return_g1', 'max_return_g2', 'final_return', 'mean_train_return', 'seconds']
+
+#Example spec (main.py --sweep spec.json), every key but "params" is optional:
+#{
+#    "algo": "dac", "env": "fourrooms",
+#    "method": "grid",                   grid: every combination of the "params" lists
+#                                        random: "num_samples" configs, lists are choices, dicts distributions
+#    "params": {"lr_ha": [1e-4, 3e-4], "num_options": [2, 4], "buffer_episodes": [5, 10]},
+#    "overrides": {"total_train_episodes": 500},     fixed for every job
+#    "trials": 3,                        seeds per config, job (config, trial) seeds like run_trial's trial
+#    "workers": 2,                       local processes running jobs
+#    "num_samples": 20, "seed": 0,       random search only
+#    "results": "sweep_results.csv",     one row per finished job, jobs already in it are skipped
+#    "asha": {"min_episodes": 200, "reduction_factor": 3}    early stopping of weak jobs (ASHA below)
+#}
+
+
+class ASHA:
+    """asynchronous successive halving, stopping variant. A job trains in rungs of min_episodes * reduction_factor**k
+        episodes (below its total_train_episodes) and after each rung reports the max test return it has so far.
+        It continues only if that return is in the top 1 / reduction_factor of the returns reported at the rung so far,
+        otherwise it is stopped. Decisions never wait for other jobs, so workers stay busy; the first jobs at a rung
+        are judged against few results and mostly continue. records/lock: shared dict and lock (multiprocessing
+        Manager) when jobs run in several processes"""
+    def __init__(self, min_episodes, reduction_factor=3, records=None, lock=None):
+        self.min_episodes = min_episodes
+        self.reduction_factor = reduction_factor
+        self.records = {} if records is None else records
+        self.lock = lock
+
+    def rungs(self, total_episodes):
+        rungs = []
+        episodes = self.min_episodes
+        while episodes < total_episodes:
+            rungs.append(episodes)
+            episodes *= self.reduction_factor
+        return rungs
+
+    def report(self, rung, value):
+        """records a job's value at rung, True if the job should continue"""
+        with self.lock if self.lock is not None else nullcontext():
+            values = self.records.get(rung, []) + [value]
+            self.records[rung] = values
+        return value >= np.percentile(values, 100 * (1 - 1 / self.reduction_factor))
+
+
+def load_spec(path):
+    with open(path) as f:
+        return json.load(f)
+
+def check_attributes(params, names):
+    """every name must be a plain attribute of params (not a derived property such as train_iterations)"""
+    for name in names:
+        if isinstance(getattr(type(params), name, None), property):
+            raise ValueError(f"{name} is derived from other parameters and cannot be swept or overridden")
+        if name not in vars(params):
+            raise ValueError(f"{type(params).__name__} has no parameter {name}")
+
+def to_param(params, name, value):
+    """JSON value as the type of the default: lists to tuples for tuple params, activation names to F functions"""
+    default = getattr(params, name)
+    if isinstance(default, tuple) and isinstance(value, list):
+        return tuple(value)
+    if callable(default) and isinstance(value, str):
+        return getattr(F, value)
+    return value
+
+def sample_configs(spec):
+    """list of {param: value} configs of the spec's grid or random search"""
+    space = spec['params']
+    method = spec.get('method', 'grid')
+    if method == 'grid':
+        for name, values in space.items():
+            if not isinstance(values, list):
+                raise ValueError(f"grid values of {name} must be a list")
+        names = list(space)
+        return [dict(zip(names, values)) for values in itertools.product(*space.values())]
+    if method == 'random':
+        rng = np.random.default_rng(spec.get('seed', 0))
+        configs = []
+        for _ in range(spec.get('num_samples', 10)):
+            config = {}
+            for name, values in space.items():
+                if isinstance(values, dict):
+                    (dist, (lo, hi)), = values.items()
+                    config[name] = DISTRIBUTIONS[dist](rng, lo, hi)
+                else:
+                    config[name] = values[rng.integers(len(values))]
+            configs.append(config)
+        return configs
+    raise ValueError(f"unknown sweep method {method}, choose 'grid' or 'random'")
+
+def job_key(algo, env, config, overrides, trial, asha=None):
+    """identifies a job in the results file, same settings -> same key"""
+    job = json.dumps([algo, env, config, overrides, trial] + ([asha] if asha else []), sort_keys=True)
+    return hashlib.md5(job.encode()).hexdigest()
+
+def run_job(algo, env, config, overrides, trial, asha=None):
+    """trains trial trial of config like run_trial, returns its results row metrics. With asha (ASHA) the trainer
+        is paused after every rung and stopped there unless asha promotes it"""
+    params_class, trainer = ALGOS[algo]
+    params = params_class()
+    for name, value in {**overrides, **config}.items():
+        setattr(params, name, to_param(params, name, value))
+    setup_env(params, env)
+
+    start = time.time()
+    if asha is None:
+        train_rewards, test_rewards, _ = run_trial(trainer, params, trial)
+    else:
+        trainer = setup_trial(trainer, params, trial)
+        for rung in asha.rungs(params.total_train_episodes):
+            trainer.run(rung)
+            if not asha.report(rung, max(trainer.test_returns, default=-np.inf)):
+                break
+        else:
+            trainer.run(params.total_train_episodes)
+        train_rewards, test_rewards, _ = trainer.finish()
+
+    #goal returns only for jobs that ran to the end
+    complete = len(train_rewards) >= params.total_train_episodes
+    return {'seed': trial_seed(params.seed, trial),
+            'episodes': len(train_rewards),
+            'max_return': max(test_rewards, default=''),
+            'max_return_g1': max(test_rewards[:len(test_rewards) // 2]) if params.switch_goal and complete else '',
+            'max_return_g2': max(test_rewards[-len(test_rewards) // 2:]) if params.switch_goal and complete else '',
+            'final_return': test_rewards[-1] if test_rewards else '',
+            'mean_train_return': np.mean(train_rewards),
+            'seconds': round(time.time() - start, 2)}
+
+def completed_jobs(path, fields):
+    """keys of the jobs already in the results file"""
+    if not os.path.isfile(path):
+        return set()
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames is not None and reader.fieldnames != fields:
+            raise ValueError(f"{path} has the columns of a different sweep, choose another results file")
+        return {row['key'] for row in reader}
+
+def run_sweep(spec, env=None, algo=None):
+    """runs the spec's (config, trial) jobs that are not in its results file yet, in spec['workers'] processes,
+        and appends one row per job as it finishes (stopped ASHA jobs too). Failed jobs are reported and left out,
+        so a rerun retries them"""
+    algo = algo or spec.get('algo')
+    env = env or spec.get('env')
+    if algo not in ALGOS:
+        raise ValueError("Algorithm name incorrect or not found")
+    overrides = spec.get('overrides', {})
+    asha = spec.get('asha')
+    params = ALGOS[algo][0]()
+    check_attributes(params, list(spec['params']) + list(overrides))
+    if overrides.get('ensemble_trials', params.ensemble_trials):
+        raise ValueError("sweep jobs train one trial each, ensemble_trials is not available")
+    setup_env(params, env)    #fail on a bad env name before any job starts
+
+    configs = sample_configs(spec)
+    path = spec.get('results', 'sweep_results.csv')
+    fields = ['key', 'algo', 'env', 'trial', 'seed'] + list(spec['params']) + METRICS
+    done = completed_jobs(path, fields)
+    jobs = [(config, trial) for config in configs for trial in range(spec.get('trials', 1))]
+    todo = [(config, trial) for config, trial in jobs if job_key(algo, env, config, overrides, trial, asha) not in done]
+    print(f"Sweep: {len(configs)} configs x {spec.get('trials', 1)} trials, {len(jobs) - len(todo)} jobs done, {len(todo)} to run")
+
+    new_file = not os.path.isfile(path) or os.path.getsize(path) == 0
+    with open(path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        if new_file:
+            writer.writeheader()
+
+        def write_row(config, trial, metrics):
+            writer.writerow({'key': job_key(algo, env, config, overrides, trial, asha), 'algo': algo, 'env': env,
+                             'trial': trial, **config, **metrics})
+            f.flush()
+
+        workers = min(spec.get('workers', 1), len(todo))
+        failed = 0
+        if workers <= 1:
+            scheduler = ASHA(**asha) if asha else None
+            for config, trial in todo:
+                try:
+                    write_row(config, trial, run_job(algo, env, config, overrides, trial, scheduler))
+                except Exception as e:
+                    failed += 1
+                    print(f"Job {config} trial {trial} failed: {e!r}")
+        else:
+            num_threads = max(1, (os.cpu_count() or 1) // workers)
+            ctx = mp.get_context('spawn')
+            #rung results are shared by the workers through a manager process
+            manager = ctx.Manager() if asha else nullcontext()
+            with manager, ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                                              initializer=_init_worker, initargs=(num_threads,)) as pool:
+                scheduler = ASHA(**asha, records=manager.dict(), lock=manager.Lock()) if asha else None
+                futures = {pool.submit(run_job, algo, env, config, overrides, trial, scheduler): (config, trial)
+                           for config, trial in todo}
+                for future in as_completed(futures):
+                    config, trial = futures[future]
+                    try:
+                        write_row(config, trial, future.result())
+                    except Exception as e:
+                        failed += 1
+                        print(f"Job {config} trial {trial} failed: {e!r}")
+
+    print(f"Sweep complete: {len(todo) - failed} jobs written to {path}, {failed} failed")
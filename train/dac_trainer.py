@@ -1,224 +1,247 @@
-import sys
+import os, sys
 from copy import deepcopy
 import numpy as np
 import torch as th
-import gymnasium as gym
 from torch.distributions import Categorical
 
-from env.fourrooms import FourRooms, FourRooms_m
 from agent.dac import DAC_Network
-from helpers.dac_helper import BatchProcessing, compute_GAE, pre_process, compute_pi_hat
+from helpers.common_helper import make_vec_env, RolloutStorage, MinibatchSampler
+from helpers.dac_helper import BatchProcessing, VecCollector, pre_process, compute_pi_hat, rollout_fields
+from util.policy_eval import ExactEvaluator
+from util.async_eval import AsyncEvaluator
+from util.batch_eval import batch_evaluator
+from util.rng import stream_seed
 
 class DACtrainer():
     def __init__(self):
         pass
 
     def train(self, env, params):
+        self.setup(env, params)
+        self.run(params.total_train_episodes)
+        return self.finish()
+
+    def setup(self, env, params):
+        """builds the network, optimizer and buffers of a run. run() then trains it, possibly in several stages"""
         device = params.device
+        self.env, self.params = env, params
 
         #initialize network and optimizer
-        network = DAC_Network(params).to(device)
+        network = self.network = DAC_Network(params).to(device)
         # for name, param in network.named_parameters():
         #     print(name, param.shape)
         # sys.exit()
-        opt = th.optim.Adam([
-            {'params': [p for n, p in network.named_parameters() if 'pi_' in n], 'lr': params.lr_la},    #sub policy
-            {'params': [p for n, p in network.named_parameters() if 'actor' in n], 'lr': params.lr_ha},     #master policy
-            {'params': [p for n, p in network.named_parameters() if 'critic' in n], 'lr': params.lr_critic},
-            {'params': [p for n, p in network.named_parameters() if 'beta' in n], 'lr': params.lr_beta},
-            {'params': [p for n, p in network.named_parameters() if 'phi' in n], 'lr': params.lr_phi},
+        self.opt = th.optim.Adam([
+            {'params': [p for n, p in network.named_parameters() if 'pi_' in n], 'lr': params.lr_la, 'name': 'lr_la'},    #sub policy
+            {'params': [p for n, p in network.named_parameters() if 'actor' in n], 'lr': params.lr_ha, 'name': 'lr_ha'},     #master policy
+            {'params': [p for n, p in network.named_parameters() if 'critic' in n], 'lr': params.lr_critic, 'name': 'lr_critic'},
+            {'params': [p for n, p in network.named_parameters() if 'beta' in n], 'lr': params.lr_beta, 'name': 'lr_beta'},
+            {'params': [p for n, p in network.named_parameters() if 'phi' in n], 'lr': params.lr_phi, 'name': 'lr_phi'},
         ])
 
-        episode_rewards = []
-        test_returns = []
-        test_episode_lengths = []
+        self.episode_rewards = []
+        self.test_returns = []
+        self.test_episode_lengths = []
 
         #initialize batch processing class
-        batch_process = BatchProcessing()
+        self.batch_process = BatchProcessing()
+
+        #exact evaluation replaces sampled test episodes on grid worlds (unless rendering/recording)
+        self.exact_eval = ExactEvaluator(env, params) if params.exact_eval and hasattr(env, 'layout') else None
+
+        #sampled test episodes run in a background process with params.async_eval, training does not wait for them
+        self.evaluator = None
+        if params.async_eval and (self.exact_eval is None or params.show_testing or params.record_testing):
+            self.evaluator = AsyncEvaluator(self.test, network, params, seed=stream_seed(params, 'evaluator'))
+
+        #batched collection over params.num_envs grid worlds, serial single env otherwise
+        self.collector = None
+        if params.num_envs > 1 and hasattr(env, 'layout'):
+            self.collector = VecCollector(make_vec_env(params, params.num_envs, seed=stream_seed(params, 'collector')), device)
 
         if params.switch_goal: print(f"Current goal {env.goal}")
-        n_ep = 0
-
-        for it in range(params.train_iterations):
-            buffer = []
-            for ep in range(params.buffer_episodes):
-                #initialize episode histories
-                state_history, action_history, reward_history, done_history = [],[],[],[]
-                option_history, prev_option_history, beta_history = [],[],[]
-                v_h_history, v_l_history, logp_h_history, logp_l_history  = [],[],[],[]
-                prediction_history, pi_hat_history = [],[]
-
-                #for troubleshooting only
-                pi_bar_history, beta_history = [],[]
-
-                #reset environment and convert to tensor
-                obs, _ = env.reset()
-                prev_option = None
-                total_reward = 0
-
-                for t in range(params.t_max):
-                    state = pre_process(obs)
-                    #forward pass through network
-                    with th.no_grad():
-                        prediction = network(state)
-
-                    #compute high MDP policy, logp, and sample option
-                    pi_hat = compute_pi_hat(prediction, prev_option)
-                    dist = Categorical(probs=pi_hat)
-                    option = dist.sample()
-                    logp_h = dist.log_prob(option)
-
-                    #compute low MDP policy for current option, logp, and sample action
-                    pi_bar = prediction['pi_w'][0, option,:]
-                    dist = Categorical(probs=pi_bar)
-                    action = dist.sample()
-                    logp_l = dist.log_prob(action)
-
-                    #compute high and low MDP value functions
-                    v_bar = prediction['q_W'][:,option]  # q value for current option
-                    v_hat = (prediction['q_W'] * pi_hat).sum(-1).unsqueeze(-1)  # weighted sum of q for each option
-
-                    #take a step
-                    next_obs, reward, terminated, truncated, _ = env.step(action)
-
-                    #store transition in episode history
-                    state_history.append(state)
-                    action_history.append(action)
-                    reward_history.append(reward)
-                    option_history.append(option)
-                    prev_option_history.append(prev_option if prev_option is not None else th.LongTensor([0]))
-                    v_h_history.append(v_hat)
-                    v_l_history.append(v_bar)
-                    logp_h_history.append(logp_h)
-                    logp_l_history.append(logp_l)
-                    pi_hat_history.append(pi_hat)
-
-                    #For testing only
-                    pi_bar_history.append(pi_bar)
-                    beta_history.append(prediction['betas'])
-
-                    obs = next_obs
-                    prev_option = option
-                    total_reward += reward
-
-                    if terminated or truncated:  # Optional for printing train episode lengths
-                        # print(f"****training episode {n_ep + 1}: {t + 1} steps ****")
-                        pass
-
-                    # logic for episode termination/truncation
-                    if truncated:  # Compute next value if episode env timelimit is reached
-                        with th.no_grad():
-                            prediction = network(pre_process(obs))
-                        pi_hat = compute_pi_hat(prediction, prev_option)
-                        next_v_bar = prediction['q_W'].gather(1, option.unsqueeze(-1))
-                        next_v_hat = (prediction['q_W'] * pi_hat).sum(-1).unsqueeze(-1)
-                        v_h_history.append(next_v_hat)
-                        v_l_history.append(next_v_bar)
-                        break
-                    if terminated:  # Compute next value = 0 if terminal state reached
-                        next_value = th.zeros_like(v_hat)
-                        v_h_history.append(next_value)
-                        v_l_history.append(next_value)
-                        break
-                n_ep += 1
-                episode_rewards.append(total_reward)
-
-                # compute advantages and returns for episode
-                returns, adv_h, adv_l = compute_GAE(reward_history, v_h_history, v_l_history,
-                                                    params.gamma, params.gae_lambda, params.device)
-
-                # store episode in buffer
-                buffer.append((state_history, action_history, pi_hat_history,
-                               option_history, prev_option_history,
-                               v_h_history, v_l_history,
-                               logp_h_history, logp_l_history,
-                               returns, adv_h, adv_l, pi_bar_history, beta_history))
-
-                # test at interval and print result
-                if n_ep % params.test_interval == 0:
-                    test_return, episode_length = self.test(deepcopy(network), params, n_ep, env.goal)
-                    test_returns.append(test_return)
-                    test_episode_lengths.append(episode_length)
-                    print(f'Test return at episode {n_ep}: {test_return:.3f} | '
-                          f'Average test episode length: {episode_length}')
-
-                # Switch Goal location
-                if params.switch_goal and n_ep == params.total_train_episodes // 2:
-                    env.switch_goal(goal=params.new_goal)
-                    print(f"New goal {env.goal}. Max return so far: {max(test_returns):.3f}")
+        self.n_ep = 0
+
+        #per-step buffer tensors, allocated once and refilled every iteration
+        self.storage = RolloutStorage(params.buffer_episodes * params.t_max, rollout_fields(params), device)
+
+    def state_dict(self):
+        """network weights and optimizer state of the run (population based training copies them between runs)"""
+        return {'network': self.network.state_dict(), 'opt': self.opt.state_dict()}
+
+    def load_state_dict(self, state):
+        """loads state_dict() of another run, keeping the learning rates of this run's params"""
+        self.network.load_state_dict(state['network'])
+        self.opt.load_state_dict(state['opt'])
+        self.update_lrs()
+
+    def update_lrs(self):
+        """sets the Adam param group learning rates to their params values in place (moments are kept)"""
+        for group in self.opt.param_groups:
+            group['lr'] = getattr(self.params, group['name'])
+
+    def record_tests(self, results):
+        for test_ep, test_return, episode_length in results:
+            self.test_returns.append(test_return)
+            self.test_episode_lengths.append(episode_length)
+            print(f'Test return at episode {test_ep}: {test_return:.3f} | '
+                  f'Average test episode length: {episode_length:.1f}')
+
+    def run(self, num_episodes):
+        """trains until num_episodes episodes are done (rounded up to whole buffers). Can be called again with
+            a larger num_episodes to continue the run where it stopped"""
+        env, params, network, opt = self.env, self.params, self.network, self.opt
+        exact_eval, evaluator, collector, storage = self.exact_eval, self.evaluator, self.collector, self.storage
+        batch_process = self.batch_process
+        switch_ep = params.total_train_episodes // 2
+
+        while self.n_ep < num_episodes:
+            storage.reset()
+            ep = 0
+            while ep < params.buffer_episodes:
+                # episodes are written to storage, advantages and returns are computed for the whole buffer
+                if collector is not None:
+                    #stop at the goal switch so every episode runs on the goal the serial loop would use
+                    buffer_episodes = params.buffer_episodes - ep
+                    if params.switch_goal and self.n_ep < switch_ep:
+                        buffer_episodes = min(buffer_episodes, switch_ep - self.n_ep)
+                    collector.env.choose_goal(env.goal)
+                    rewards = collector.collect(network, buffer_episodes, storage)
+                else:
+                    rewards = [self.run_episode(env, network, params, storage)]
+
+                for total_reward in rewards:
+                    ep += 1
+                    self.n_ep += 1
+                    n_ep = self.n_ep
+                    self.episode_rewards.append(total_reward)
+
+                    # test at interval and print result
+                    results = []
+                    if n_ep % params.test_interval == 0:
+                        if exact_eval is not None and not ((params.show_testing or params.record_testing) and n_ep > params.render_delay):
+                            results.append((n_ep,) + exact_eval.evaluate_dac(network, env.goal))
+                        elif evaluator is not None:
+                            evaluator.submit(network, n_ep, env.goal)
+                        else:
+                            results.append((n_ep,) + self.test(deepcopy(network), params, n_ep, env.goal))
+                    if evaluator is not None:
+                        #background results so far, all pending ones before the goal switch
+                        results += evaluator.drain() if params.switch_goal and n_ep == switch_ep else evaluator.poll()
+                    self.record_tests(results)
+
+                    # Switch Goal location
+                    if params.switch_goal and n_ep == switch_ep:
+                        env.switch_goal(goal=params.new_goal)
+                        print(f"New goal {env.goal}. Max return so far: {max(self.test_returns):.3f}")
 
             # process buffer once full
             (states_mb, actions_mb, pi_hat_mb,
              options_mb, prev_options_mb,
              v_h_mb, v_l_mb, logp_h_mb, logp_l_mb,
-             returns_mb, adv_h_mb, adv_l_mb, pi_bar_mb, betas_mb) = batch_process.collate_batch(buffer, params.device)
-
-            # convert to dataset and initialize dataloader for mini_batch sampling
-            dataset = th.utils.data.TensorDataset(states_mb, actions_mb, pi_hat_mb,
-                                                         options_mb, prev_options_mb,
-                                                         v_h_mb, v_l_mb, logp_h_mb, logp_l_mb,
-                                                         returns_mb, adv_h_mb, adv_l_mb, pi_bar_mb)
+             returns_mb, adv_h_mb, adv_l_mb, pi_bar_mb, betas_mb) = batch_process.collate_batch(storage, params.gamma, params.gae_lambda, params.device)
 
-            dataloader = th.utils.data.DataLoader(dataset, batch_size=params.mini_batch_size, shuffle=True)
+            # shuffled mini_batch sampling, one index permutation per epoch
+            sampler = MinibatchSampler((states_mb, actions_mb, pi_hat_mb,
+                                        options_mb, prev_options_mb,
+                                        v_h_mb, v_l_mb, logp_h_mb, logp_l_mb,
+                                        returns_mb, adv_h_mb, adv_l_mb, pi_bar_mb), params.mini_batch_size)
 
             #initiate learning
             mdps = ['hat', 'bar']
             # np.random.shuffle(mdps)
-            self.learn(network, dataloader, opt, params, mdps[1])
-            self.learn(network, dataloader, opt, params, mdps[0])
+            self.learn(network, sampler, opt, params, mdps[1])
+            self.learn(network, sampler, opt, params, mdps[0])
 
-        print(f"Trial Complete. Max test returns for: "
-              f"G1 = {max(test_returns[:len(test_returns)//2]):.3f}, "
-              f"G2 = {max(test_returns[-len(test_returns)//2:]):.3f}")
-        return episode_rewards, test_returns, test_episode_lengths
+        #collect pending background tests, so a run paused here (e.g. at an ASHA rung) is judged on all of them
+        if evaluator is not None:
+            self.record_tests(evaluator.drain())
 
-    def learn(self, network, dataloader, opt, params, mdp):
-        loss_p, loss_c = [], []
-        for epoch in range(params.opt_epochs):
-            for batch in dataloader:
-                # unpack mini batch
-                (states_mb, actions_mb, pi_hat_mb,
-                 options_mb, prev_options_mb,
-                 v_h_mb, v_l_mb,
-                 old_logp_h, old_logp_l,
-                 returns_mb, adv_h_mb, adv_l_mb, pi_bar_mb)  = batch
+    def finish(self):
+        """collects pending background tests and returns (episode_rewards, test_returns, test_episode_lengths)"""
+        test_returns = self.test_returns
+        if self.evaluator is not None:
+            self.record_tests(self.evaluator.close())
 
-                #forward pass minibatch states
-                prediction = network(states_mb)
-
-                #Get new policies and values for each MDPNew calculations
-                if mdp == 'hat':
-                    #High policy
-                    new_pi_hat = compute_pi_hat(prediction, prev_options_mb.view(-1))
-                    dist = Categorical(probs=new_pi_hat)
-                    new_logp = dist.log_prob(options_mb.view(-1)).unsqueeze(-1)
-                    entropy = dist.entropy().mean()
-
-                    #High value
-                    new_v = (prediction['q_W'] * pi_hat_mb).sum(-1).unsqueeze(-1)
-
-                elif mdp == 'bar':
-                    #Low policy
-                    new_pi_bar = prediction['pi_w'][th.arange(states_mb.size(0)), options_mb.view(-1),:]
-                    dist = Categorical(probs=new_pi_bar)
-                    new_logp = dist.log_prob(actions_mb.view(-1)).unsqueeze(-1)
-                    entropy = dist.entropy().mean()
-
-                    #Low value
-                    new_v = prediction['q_W'].gather(1, options_mb)
-                else:
-                    raise NotImplementedError
+        if self.n_ep < self.params.total_train_episodes:
+            print(f"Trial stopped at episode {self.n_ep}. Max test return: {max(test_returns, default=float('nan')):.3f}")
+        else:
+            print(f"Trial Complete. Max test returns for: "
+                  f"G1 = {max(test_returns[:len(test_returns)//2]):.3f}, "
+                  f"G2 = {max(test_returns[-len(test_returns)//2:]):.3f}")
+        return self.episode_rewards, test_returns, self.test_episode_lengths
+
+    @staticmethod
+    def run_episode(env, network, params, storage):
+        """runs one training episode on a single env, writing its steps to storage in place.
+            Returns the total episode reward"""
+        total_reward = 0.
 
-                #PPO Actor loss with entropy
-                tau = params.entropy_coef_h if mdp == 'hat' else params.entropy_coef_l
-                old_logp = old_logp_h if mdp == 'hat' else old_logp_l
-                advantages = adv_h_mb if mdp == 'hat' else adv_l_mb
-                policy_loss = network.actor_loss(new_logp, old_logp, advantages, params.eps_clip)
-                policy_loss -= entropy * tau
+        #reset environment and convert to tensor
+        obs, _ = env.reset()
+        prev_option = None
 
-                #critic loss
-                old_v = v_h_mb if mdp == 'hat' else v_l_mb
-                critic_loss = network.critic_loss(new_v, old_v, returns_mb, params.eps_clip)
+        for t in range(params.t_max):
+            state = pre_process(obs)
+            #forward pass through network
+            with th.no_grad():
+                prediction = network(state)
+
+            #compute high MDP policy, logp, and sample option
+            pi_hat = compute_pi_hat(prediction, prev_option)
+            dist = Categorical(probs=pi_hat)
+            option = dist.sample()
+            logp_h = dist.log_prob(option)
+
+            #compute low MDP policy for current option, logp, and sample action
+            pi_bar = prediction['pi_w'][0, option,:]
+            dist = Categorical(probs=pi_bar)
+            action = dist.sample()
+            logp_l = dist.log_prob(action)
+
+            #compute high and low MDP value functions
+            v_bar = prediction['q_W'][:,option]  # q value for current option
+            v_hat = (prediction['q_W'] * pi_hat).sum(-1).unsqueeze(-1)  # weighted sum of q for each option
+
+            #take a step
+            next_obs, reward, terminated, truncated, _ = env.step(action)
+
+            #store transition, option 0 is stored as prev option at episode start (pi_bar and betas for testing only)
+            storage.insert(states=state, actions=action, rewards=reward, options=option,
+                           prev_options=prev_option if prev_option is not None else th.LongTensor([0]),
+                           v_h=v_hat, v_l=v_bar, logp_h=logp_h, logp_l=logp_l,
+                           pi_hat=pi_hat, pi_bar=pi_bar, betas=prediction['betas'])
+            total_reward += reward
+
+            obs = next_obs
+            prev_option = option
+
+            if terminated or truncated:  # Optional for printing train episode lengths
+                # print(f"****training episode {n_ep + 1}: {t + 1} steps ****")
+                pass
+
+            # logic for episode termination/truncation
+            if terminated:  # Compute next value = 0 if terminal state reached
+                storage.end_episode(v_h=0., v_l=0.)
+                break
+            if truncated or t == params.t_max - 1:  # Compute next value if episode env timelimit is reached
+                with th.no_grad():
+                    prediction = network(pre_process(obs))
+                pi_hat = compute_pi_hat(prediction, prev_option)
+                next_v_bar = prediction['q_W'].gather(1, option.unsqueeze(-1))
+                next_v_hat = (prediction['q_W'] * pi_hat).sum(-1).unsqueeze(-1)
+                storage.end_episode(v_h=next_v_hat[0, 0], v_l=next_v_bar[0, 0])
+                break
+
+        return total_reward
+
+    def learn(self, network, sampler, opt, params, mdp):
+        loss_p, loss_c = [], []
+        for epoch in range(params.opt_epochs):
+            for batch in sampler:
+                #forward pass minibatch states
+                prediction = network(batch[0])
+                policy_loss, critic_loss = self.mdp_loss(prediction, batch, params, mdp)
 
                 #backpropegate
                 opt.zero_grad()
@@ -233,81 +256,53 @@ class DACtrainer():
         # print(f"MDP-{mdp}, optimization complete avg losses: Policy loss: {av_loss_p:.3f} | Critic loss: {av_loss_c:.3f}")
 
     @staticmethod
-    def test(network, params, n_ep, goal):
-        """tests agent and averages result, configure whether to show (render)
-            testing and how long to delay in ParametersPPO class"""
-        network.train(mode=False)
-        render_testing = params.show_testing and n_ep > params.render_delay
-
-        if params.env_name == 'FourRooms':
-            test_env = FourRooms(render_mode="human") if render_testing else FourRooms()
-            test_env.choose_goal(goal)
-        elif params.env_name == 'FourRooms_m':
-            test_env = FourRooms_m(render_mode="human") if render_testing else FourRooms_m()
-            test_env.choose_goal(goal)
+    def mdp_loss(prediction, batch, params, mdp):
+        """PPO policy (with entropy bonus) and critic losses of the high ('hat') or low ('bar') MDP for one minibatch,
+            prediction is the network output for its states"""
+        # unpack mini batch
+        (states_mb, actions_mb, pi_hat_mb,
+         options_mb, prev_options_mb,
+         v_h_mb, v_l_mb,
+         old_logp_h, old_logp_l,
+         returns_mb, adv_h_mb, adv_l_mb, pi_bar_mb)  = batch
+
+        #Get new policies and values for each MDPNew calculations
+        if mdp == 'hat':
+            #High policy
+            new_pi_hat = compute_pi_hat(prediction, prev_options_mb.view(-1))
+            dist = Categorical(probs=new_pi_hat)
+            new_logp = dist.log_prob(options_mb.view(-1)).unsqueeze(-1)
+            entropy = dist.entropy().mean()
+
+            #High value
+            new_v = (prediction['q_W'] * pi_hat_mb).sum(-1).unsqueeze(-1)
+
+        elif mdp == 'bar':
+            #Low policy
+            new_pi_bar = prediction['pi_w'][th.arange(states_mb.size(0)), options_mb.view(-1),:]
+            dist = Categorical(probs=new_pi_bar)
+            new_logp = dist.log_prob(actions_mb.view(-1)).unsqueeze(-1)
+            entropy = dist.entropy().mean()
+
+            #Low value
+            new_v = prediction['q_W'].gather(1, options_mb)
         else:
-            test_env = gym.make(params.env_name)  # , render_mode="human")
+            raise NotImplementedError
 
-        test_rewards = np.zeros(params.test_episodes)
-        episode_lengths = np.zeros(params.test_episodes)
-        test_returns = np.zeros(params.test_episodes)
+        #PPO Actor loss with entropy
+        tau = params.entropy_coef_h if mdp == 'hat' else params.entropy_coef_l
+        old_logp = old_logp_h if mdp == 'hat' else old_logp_l
+        advantages = adv_h_mb if mdp == 'hat' else adv_l_mb
+        policy_loss = DAC_Network.actor_loss(new_logp, old_logp, advantages, params.eps_clip)
+        policy_loss -= entropy * tau
 
-        for i in range(params.test_episodes):
-            obs, _ = test_env.reset()
-            state = pre_process(obs)
-            rewards = []
-
-            prev_option = None
-
-            for t in range(params.t_max):
-                #pass through network
-                prediction = network(state)
+        #critic loss
+        old_v = v_h_mb if mdp == 'hat' else v_l_mb
+        critic_loss = DAC_Network.critic_loss(new_v, old_v, returns_mb, params.eps_clip)
+        return policy_loss, critic_loss
 
-                # compute high MDP policy and sample option
-                pi_hat = compute_pi_hat(prediction, prev_option).squeeze(0)
-                dist = Categorical(probs=pi_hat)
-                option = dist.sample()
-
-                # compute low MDP policy for current option and sample action
-                pi_w = prediction['pi_w']
-                pi_bar = pi_w[0, option, :].squeeze(0)
-                dist = Categorical(probs=pi_bar)
-                action = dist.sample()
-
-                #take a step
-                next_obs, reward, terminated, trunc, _ = test_env.step(action)
-                done = terminated or trunc
-
-                if params.show_testing:
-                    q_w = prediction['q_W'].detach().squeeze(0)
-                    betas = prediction['betas'].squeeze(0)
-                    pi_bar = pi_bar.squeeze(0)
-                    # render environment, including metrics
-                    test_env.render(i, text_top=f"Option={option.item()}, Prev={prev_option} | q=[{q_w[0]:.1f},{q_w[1]:.1f},{q_w[2]:.1f},{q_w[3]:.1f}]",
-                                    text_bot=f"pi_bar,hat,beta = [{pi_bar[0]:.1f},{pi_bar[1]:.1f},{pi_bar[2]:.1f},{pi_bar[3]:.1f}], "
-                                             f"[{pi_hat[0]:.1f},{pi_hat[1]:.1f},{pi_hat[2]:.1f},{pi_hat[3]:.1f}], "
-                                             f"[{betas[0]:.1f},{betas[1]:.1f},{betas[2]:.1f},{betas[3]:.1f}]"
-                                    )
-
-                rewards.append(reward)
-                state = pre_process(next_obs)
-                prev_option = option.unsqueeze(0)
-
-                if done or trunc:
-                    episode_lengths[i] = t + 1
-                    break
-            test_rewards[i] = sum(rewards)
-
-            # compute discounted return
-            gt = 0
-            for k in reversed(range(len(rewards))):
-                gt = rewards[k] + params.gamma * gt
-            test_returns[i] = gt
-
-        test_env.close()
-
-        # average_reward = np.mean(test_rewards)
-        average_length = np.mean(episode_lengths)
-        average_return = np.mean(test_returns)
-
-        return average_return, average_length
\ No newline at end of file
+    @staticmethod
+    def test(network, params, n_ep, goal):
+        """tests agent and averages result over params.test_episodes episodes run as one batch (util/batch_eval.py),
+            configure whether to show (render) testing and how long to delay in ParametersDAC class"""
+        return batch_evaluator(params).evaluate_dac(network, n_ep, goal)
@@ -1,13 +1,14 @@
-import sys
+import os, sys
 from copy import deepcopy
-import gymnasium as gym
-from itertools import count
 import numpy as np
 import torch as th
 
-from env.fourrooms import FourRooms, FourRooms_m
 from agent.oc import OC_Network
-from helpers.oc_helper import ReplayBuffer, pre_process
+from helpers.oc_helper import ReplayBuffer, PrioritizedReplayBuffer
+from util.policy_eval import ExactEvaluator
+from util.async_eval import AsyncEvaluator
+from util.batch_eval import batch_evaluator
+from util.rng import stream_seed
 
 
 class OCtrainer:
@@ -15,44 +16,96 @@ class OCtrainer:
         pass
 
     def train(self, env, params):
+        self.setup(env, params)
+        self.run(params.total_train_episodes)
+        return self.finish()
+
+    def setup(self, env, params):
+        """builds the networks, optimizer and replay buffer of a run. run() then trains it, possibly in several stages"""
         device = params.device
+        self.env, self.params = env, params
 
-        agent = OC_Network(params).to(device)
-        agent_prime = deepcopy(agent)
+        agent = self.agent = OC_Network(params).to(device)
+        self.agent_prime = deepcopy(agent)
         # opt = th.optim.RMSprop(agent.parameters(), lr=params.lr)
         # for name, param in agent.named_parameters():
         #     print(name, param.shape)
         # sys.exit()
-        opt = th.optim.Adam([
-            {'params': [p for n, p in agent.named_parameters() if 'Q' in n], 'lr': params.lr_q},  # critic (master policy)
-            {'params': [p for n, p in agent.named_parameters() if 'beta' in n], 'lr': params.lr_beta},  # beta
-            {'params': [p for n, p in agent.named_parameters() if 'options' in n], 'lr': params.lr_la}, #sub -policies
-            {'params': [p for n, p in agent.named_parameters() if 'features' in n], 'lr': params.lr_phi}, #features
+        self.opt = th.optim.Adam([
+            {'params': [p for n, p in agent.named_parameters() if 'Q' in n], 'lr': params.lr_q, 'name': 'lr_q'},  # critic (master policy)
+            {'params': [p for n, p in agent.named_parameters() if 'beta' in n], 'lr': params.lr_beta, 'name': 'lr_beta'},  # beta
+            {'params': [p for n, p in agent.named_parameters() if 'options' in n], 'lr': params.lr_la, 'name': 'lr_la'}, #sub -policies
+            {'params': [p for n, p in agent.named_parameters() if 'features' in n], 'lr': params.lr_phi, 'name': 'lr_phi'}, #features
         ])
 
 
-        buffer = ReplayBuffer(params.buffer_size)
+        if params.prioritized_replay:
+            self.buffer = PrioritizedReplayBuffer(params.buffer_size, alpha=params.per_alpha, eps=params.per_eps,
+                                                  seed=stream_seed(params, 'buffer'))
+        else:
+            self.buffer = ReplayBuffer(params.buffer_size, seed=stream_seed(params, 'buffer'))
+
+        #exact evaluation replaces sampled test episodes on grid worlds (unless rendering/recording)
+        self.exact_eval = ExactEvaluator(env, params) if params.exact_eval and hasattr(env, 'layout') else None
+
+        #sampled test episodes run in a background process with params.async_eval, training does not wait for them
+        self.evaluator = None
+        if params.async_eval and (self.exact_eval is None or params.show_testing or params.record_testing):
+            self.evaluator = AsyncEvaluator(self.test, agent, params, seed=stream_seed(params, 'evaluator'))
 
-        episode_rewards = []
-        test_returns = []
-        test_episode_lengths = []
-        episode_lengths = []
+        self.episode_rewards = []
+        self.test_returns = []
+        self.test_episode_lengths = []
+        self.episode_lengths = []
 
         params.t_tot = 0
-        n_ep = 0
+        self.n_ep = 0
 
         if params.switch_goal: print(f"Current goal {env.goal}")
-        running_av_length = 0
-
-        for _ in count():
+        self.running_av_length = 0
+
+    def state_dict(self):
+        """network, target network and optimizer state of the run (population based training copies them between
+            runs). The replay buffer is not included"""
+        return {'agent': self.agent.state_dict(), 'agent_prime': self.agent_prime.state_dict(), 'opt': self.opt.state_dict()}
+
+    def load_state_dict(self, state):
+        """loads state_dict() of another run, keeping the learning rates of this run's params"""
+        self.agent.load_state_dict(state['agent'])
+        self.agent_prime.load_state_dict(state['agent_prime'])
+        self.opt.load_state_dict(state['opt'])
+        self.update_lrs()
+
+    def update_lrs(self):
+        """sets the Adam param group learning rates to their params values in place (moments are kept)"""
+        for group in self.opt.param_groups:
+            group['lr'] = getattr(self.params, group['name'])
+
+    def record_tests(self, results):
+        for test_ep, test_return, episode_length in results:
+            self.test_returns.append(test_return)
+            self.test_episode_lengths.append(episode_length)
+            running_av_len = sum(self.episode_lengths[-10:]) / 10
+            print(f'Test return at episode {test_ep}: {test_return:.3f} | '
+                  f'Average test (train) episode length: {episode_length:.1f} ({running_av_len:.1f}) | '
+                  f'Total steps: {self.params.t_tot} | '
+                  f'Epsilon: {self.params.epsilon:.3f}')
+
+    def run(self, num_episodes):
+        """trains until num_episodes episodes are done. Can be called again with a larger num_episodes to continue
+            the run where it stopped"""
+        env, params, agent, agent_prime, opt = self.env, self.params, self.agent, self.agent_prime, self.opt
+        buffer, exact_eval, evaluator = self.buffer, self.exact_eval, self.evaluator
+
+        while self.n_ep < num_episodes:
 
             episode_reward = 0
             option_lengths = {op: [] for op in range(params.num_options)}
 
             obs, _ = env.reset()
 
-            state = agent.get_state(pre_process(obs))
-            greedy_option = agent.greedy_option(state)
+            cache = agent.step_cache(obs)
+            greedy_option = cache['Q'].argmax(dim=-1).item()
             current_option = 0
 
             done = False
@@ -76,7 +129,7 @@ class OCtrainer:
                     curr_op_len = 0
 
                 #get action according to current option
-                action, logp, entropy = agent.get_action(state, current_option, params.temp)
+                action, logp, entropy = agent.sample_action(cache, current_option, params.temp)
 
                 #take step and store in buffer
                 next_obs, reward, terminated, truncated, _ = env.step(action)
@@ -86,19 +139,24 @@ class OCtrainer:
 
                 if done:  # Optional for printing train episode lengths
                     # print(f"****training episode {n_ep+1}: {ep_steps+1} steps | epsilon = {epsilon:.3f} ****")
-                    episode_lengths.append(ep_steps+1)
-                    running_av_length += ep_steps+1
+                    self.episode_lengths.append(ep_steps+1)
+                    self.running_av_length += ep_steps+1
 
                 actor_loss, critic_loss = None, None
                 if len(buffer) > params.batch_size:
                     #compute actor loss every timestep
-                    actor_loss = agent.actor_loss(agent_prime, obs, current_option, logp, entropy, reward, done, next_obs, params)
+                    actor_loss = agent.actor_loss(agent_prime, cache, current_option, logp, entropy, reward, done, next_obs, params)
                     loss = actor_loss
 
                     #compute critic loss at interval
                     if params.t_tot % params.critic_optim_freq == 0:
-                        batch = buffer.sample(params.batch_size)
-                        critic_loss = agent.critic_loss(agent_prime, batch, params)
+                        if params.prioritized_replay:
+                            batch, idx, weights = buffer.sample(params.batch_size, params.per_beta)
+                            critic_loss, td_errors = agent.critic_loss(agent_prime, batch, params, weights)
+                            buffer.update_priorities(idx, td_errors.cpu().numpy())
+                        else:
+                            batch = buffer.sample(params.batch_size)
+                            critic_loss, _ = agent.critic_loss(agent_prime, batch, params)
                         loss += critic_loss
 
                     opt.zero_grad()
@@ -110,11 +168,11 @@ class OCtrainer:
                     if params.t_tot % params.target_update_freq == 0:
                         agent_prime.load_state_dict(agent.state_dict())
 
-                #get next state
-                state = agent.get_state(pre_process(next_obs))
+                #get next state features, Q and betas once with the updated parameters
+                cache = agent.step_cache(next_obs)
 
-                #get next state beta and greedy option TODO: rename this method?
-                beta, greedy_option = agent.get_beta(state, current_option)
+                #get next state beta and greedy option
+                beta, greedy_option = agent.sample_beta(cache, current_option)
 
                 #update counters
                 params.t_tot += 1
@@ -124,99 +182,50 @@ class OCtrainer:
 
                 #TODO: log data here?
 
-            episode_rewards.append(episode_reward)
-            n_ep += 1
+            self.episode_rewards.append(episode_reward)
+            self.n_ep += 1
+            n_ep = self.n_ep
 
             # test at interval and print result
+            results = []
             if n_ep % params.test_interval == 0:
-                test_return, episode_length = self.test(deepcopy(agent), params, n_ep, env.goal)
-                test_returns.append(test_return)
-                test_episode_lengths.append(episode_length)
-                running_av_len = sum(episode_lengths[-10:]) / 10
-                print(f'Test return at episode {n_ep}: {test_return:.3f} | '
-                      f'Average test (train) episode length: {episode_length} ({running_av_len:.1f}) | '
-                      f'Total steps: {params.t_tot} | '
-                      f'Epsilon: {params.epsilon:.3f}')
-
-
-            # Switch Goal location and experiment termination
+                if exact_eval is not None and not ((params.show_testing or params.record_testing) and n_ep > params.render_delay):
+                    results.append((n_ep,) + exact_eval.evaluate_oc(agent, env.goal))
+                elif evaluator is not None:
+                    evaluator.submit(agent, n_ep, env.goal)
+                else:
+                    results.append((n_ep,) + self.test(deepcopy(agent), params, n_ep, env.goal))
+            if evaluator is not None:
+                #background results so far, all pending ones before the goal switch
+                results += evaluator.drain() if params.switch_goal and n_ep == params.total_train_episodes // 2 else evaluator.poll()
+            self.record_tests(results)
+
+
+            # Switch Goal location
             if params.switch_goal and n_ep == params.total_train_episodes // 2:
                 env.switch_goal(goal=params.new_goal)
-                print(f"New goal {env.goal}. Max return so far: {max(test_returns):.3f}")
-            if n_ep >= params.total_train_episodes:
-                break
+                print(f"New goal {env.goal}. Max return so far: {max(self.test_returns):.3f}")
 
-        print(f"Trial Complete. Max test returns for: "
-              f"G1 = {max(test_returns[:len(test_returns) // 2]):.3f}, "
-              f"G2 = {max(test_returns[-len(test_returns) // 2:]):.3f}")
-        return episode_rewards, test_returns, test_episode_lengths
+        #collect pending background tests, so a run paused here (e.g. at an ASHA rung) is judged on all of them
+        if evaluator is not None:
+            self.record_tests(evaluator.drain())
 
-    @staticmethod
-    def test(agent, params, n_ep, goal):
-        """tests agent and averages result, configure whether to show (render)
-                    testing and how long to delay in ParametersPPO class"""
-        render_testing = params.show_testing and n_ep > params.render_delay
-        agent.train(mode=False)
-
-        if params.env_name == 'FourRooms':
-            test_env = FourRooms(render_mode="human") if render_testing else FourRooms()
-            test_env.choose_goal(goal)
-        elif params.env_name == 'FourRooms_m':
-            test_env = FourRooms_m(render_mode="human") if render_testing else FourRooms_m()
-            test_env.choose_goal(goal)
-        else:
-            test_env = gym.make(params.env_name)  # , render_mode="human")
-
-        test_rewards = np.zeros(params.test_episodes)
-        episode_lengths = np.zeros(params.test_episodes)
-        test_returns = np.zeros(params.test_episodes)
-
-        for i in range(params.test_episodes):
-            rewards = []
+    def finish(self):
+        """collects pending background tests and returns (episode_rewards, test_returns, test_episode_lengths)"""
+        test_returns = self.test_returns
+        if self.evaluator is not None:
+            self.record_tests(self.evaluator.close())
 
-            obs, _ = test_env.reset()
-            state = agent.get_state(pre_process(obs))
-            greedy_option = agent.greedy_option(state)
-
-            current_option = 0
-            beta = True
-
-            for t in range(params.t_max):
-
-                if beta: # epsilon-greedy option selection with eps_test
-                   if np.random.rand() < params.eps_test:
-                       current_option = np.random.choice(params.num_options)
-                   else:
-                       current_option = greedy_option
-
-                action, _, _ = agent.get_action(state, current_option, params.temp)
-
-                next_obs, reward, done, trunc, _ = test_env.step(action)
-
-                # render environment, including metrics
-                test_env.render(i, text_top=f"Current option = {current_option}",
-                                text_bot=f"beta = {beta:.1f}")
-
-                next_state = agent.get_state(pre_process(next_obs))
-                beta, greedy_option = agent.get_beta(next_state, current_option)
-
-                state = next_state
-                rewards.append(reward)
-
-                if done or trunc:
-                    episode_lengths[i] = t + 1
-                    break
-            test_rewards[i] = sum(rewards) #Check if this works?
-
-            # compute discounted return
-            gt = 0
-            for k in reversed(range(len(rewards))):
-                gt = rewards[k] + params.gamma * gt
-            test_returns[i] = gt
-
-        test_env.close()
-
-        average_length = np.mean(episode_lengths)
-        average_return = np.mean(test_returns)
+        if self.n_ep < self.params.total_train_episodes:
+            print(f"Trial stopped at episode {self.n_ep}. Max test return: {max(test_returns, default=float('nan')):.3f}")
+        else:
+            print(f"Trial Complete. Max test returns for: "
+                  f"G1 = {max(test_returns[:len(test_returns) // 2]):.3f}, "
+                  f"G2 = {max(test_returns[-len(test_returns) // 2:]):.3f}")
+        return self.episode_rewards, test_returns, self.test_episode_lengths
 
-        return average_return, average_length
+    @staticmethod
+    def test(agent, params, n_ep, goal):
+        """tests agent and averages result over params.test_episodes episodes run as one batch (util/batch_eval.py),
+            configure whether to show (render) testing and how long to delay in ParametersOC class"""
+        return batch_evaluator(params).evaluate_oc(agent, n_ep, goal)
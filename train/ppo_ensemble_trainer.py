@@ -0,0 +1,142 @@
+import numpy as np
+import torch as th
+from torch.distributions import Categorical
+from torch.func import vmap
+
+from agent.ppo import PPO_Actor, PPO_Critic
+from helpers.common_helper import make_vec_env, RolloutStorage
+from helpers.ensemble_helper import Ensemble, StackedAdam, EnsembleSampler, pad_stack
+from helpers.ppo_helper import BatchProcessing, VecCollector, rollout_fields
+from train.ppo_trainer import PPOtrainer
+from util.policy_eval import ExactEvaluator
+from util.rng import trial_seed, seed_everything, stream_seed
+
+
+class PPOEnsembletrainer:
+    """trains the PPO agents of several trials at once as one Ensemble. Member k starts from the weights trial k
+        would start from, runs its own episodes on its own params.num_envs grid worlds and has its own Adam state;
+        the forward and backward passes of all members run vmapped together"""
+    def __init__(self):
+        pass
+
+    def train_trials(self, env, params, trials):
+        """env: grid world used for the goal (switch) and testing. Returns (episode_rewards, test_returns,
+            test_episode_lengths) per trial, like PPOtrainer.train"""
+        if not hasattr(env, 'layout'):
+            raise ValueError(f"ensemble training needs a grid world, not {params.env_name}")
+        device = params.device
+        num_members = len(trials)
+
+        #member k is initialized like trial k
+        actors, critics = [], []
+        for trial in trials:
+            seed_everything(trial_seed(params.seed, trial))
+            actors.append(PPO_Actor(params.state_dim, params.actor_hidden_dim, params.action_dim).to(device))
+            critics.append(PPO_Critic(params.state_dim, params.critic_hidden_dim).to(device))
+        actor, critic = Ensemble(actors), Ensemble(critics)
+        opt = StackedAdam([{'params': actor.parameters(), 'lr': params.actor_lr},
+                           {'params': critic.parameters(), 'lr': params.critic_lr}], num_members)
+
+        episode_rewards = [[] for _ in trials]
+        test_returns = [[] for _ in trials]
+        test_episode_lengths = [[] for _ in trials]
+
+        #exact evaluation replaces sampled test episodes (unless rendering/recording)
+        exact_eval = ExactEvaluator(env, params) if params.exact_eval else None
+
+        def test_members(n_ep):
+            for k in range(num_members):
+                member = actor.member(k)
+                if exact_eval is not None and not ((params.show_testing or params.record_testing) and n_ep > params.render_delay):
+                    test_return, episode_length = exact_eval.evaluate_ppo(member, env.goal)
+                else:
+                    test_return, episode_length = PPOtrainer.test(member, params, n_ep, env.goal)
+                test_returns[k].append(test_return)
+                test_episode_lengths[k].append(episode_length)
+            print(f'Test returns at episode {n_ep}: {np.round([r[-1] for r in test_returns], 3)} | '
+                  f'Average test episode lengths: {np.round([l[-1] for l in test_episode_lengths], 1)}')
+
+        if params.switch_goal: print(f"Current goal {env.goal}")
+
+        #every member collects from its own group of params.num_envs grid worlds
+        collector = VecCollector(make_vec_env(params, num_members * params.num_envs, seed=stream_seed(params, 'collector')),
+                                 device, num_members=num_members)
+        switch_ep = params.total_train_episodes // 2
+
+        n_ep = 0
+
+        #per-member buffer tensors, allocated once and refilled every iteration
+        storages = [RolloutStorage(params.buffer_episodes * params.t_max, rollout_fields(params), device) for _ in trials]
+        batch_process = BatchProcessing()
+
+        for it in range(params.train_iterations):
+            for storage in storages:
+                storage.reset()
+
+            ep = 0
+            while ep < params.buffer_episodes:
+                #stop at the goal switch so every episode runs on the goal the serial loop would use
+                num_episodes = params.buffer_episodes - ep
+                if params.switch_goal and n_ep < switch_ep:
+                    num_episodes = min(num_episodes, switch_ep - n_ep)
+                collector.env.choose_goal(env.goal)
+                rewards = collector.collect(actor, critic, num_episodes, storages)
+
+                for total_rewards in zip(*rewards):
+                    ep += 1
+                    n_ep += 1
+                    for k, total_reward in enumerate(total_rewards):
+                        episode_rewards[k].append(total_reward)
+
+                    #test at interval and print result
+                    if n_ep % params.test_interval == 0:
+                        test_members(n_ep)
+
+                    #Switch Goal location
+                    if params.switch_goal and n_ep == switch_ep:
+                        env.switch_goal(goal=params.new_goal)
+                        print(f"New goal {env.goal}. Max returns so far: {np.round([max(r) for r in test_returns], 3)}")
+
+            #process buffers once full, padded to the longest one
+            batches = [batch_process.collate_batch(storage, params.gamma, params.gae_lambda, params.device)
+                       for storage in storages]
+            sampler = EnsembleSampler([pad_stack(tensors) for tensors in zip(*batches)],
+                                      [storage.pos for storage in storages], params.mini_batch_size)
+            self.learn(actor, critic, sampler, opt, params)
+
+        print(f"Trials Complete. Max test returns for: "
+              f"G1 = {np.round([max(r[:len(r) // 2]) for r in test_returns], 3)}, "
+              f"G2 = {np.round([max(r[-len(r) // 2:]) for r in test_returns], 3)}")
+        return list(zip(episode_rewards, test_returns, test_episode_lengths))
+
+    def learn(self, actor, critic, sampler, opt, params):
+        """params.opt_epochs passes over the members' minibatches. Members with a full minibatch are optimized
+            together in one vmapped loss, each shorter last minibatch with its member's own weights"""
+        member_loss = lambda actor_states, critic_states, batch: self.loss(actor, critic, actor_states, critic_states, batch, params)
+        for _ in range(params.opt_epochs):
+            for batch, full, last in sampler:
+                losses = vmap(member_loss)(actor.states(), critic.states(), batch)
+                loss = th.where(full.to(losses.device), losses, 0.).sum()
+                members = full.clone()
+                for k, member_batch in last:
+                    loss = loss + member_loss(actor.member_states(k), critic.member_states(k), member_batch)
+                    members[k] = True
+
+                opt.zero_grad()
+                loss.backward()
+                opt.step(members)
+
+    @staticmethod
+    def loss(actor, critic, actor_states, critic_states, batch, params):
+        """PPOtrainer's critic and actor (with entropy) losses of one member's minibatch. The networks are separate,
+            so one backward of their sum gives each the gradient of its own loss"""
+        states_mb, actions_mb, logp_mb, values_mb, returns_mb, advantages_mb = batch
+
+        values_new = critic.functional(critic_states, states_mb)
+        critic_loss = critic.critic_loss(values_new, values_mb, returns_mb, params.eps_clip)
+
+        dist = Categorical(logits=actor.functional(actor_states, states_mb))
+        logp_new = dist.log_prob(actions_mb)
+        entropy = dist.entropy().mean()
+        actor_loss = actor.actor_loss(logp_new, logp_mb, advantages_mb, params.eps_clip)
+        return actor_loss - params.entropy_coef * entropy + critic_loss
@@ -1,119 +1,130 @@
-import sys
+import os, sys
 from copy import deepcopy
-import gymnasium as gym
 import numpy as np
 import torch as th
 from torch.distributions import Categorical
 
-from env.fourrooms import FourRooms, FourRooms_m
 from agent.ppo import PPO_Actor, PPO_Critic
-from helpers.ppo_helper import BatchProcessing, compute_GAE, pre_process
+from helpers.common_helper import make_vec_env, RolloutStorage, MinibatchSampler
+from helpers.ppo_helper import BatchProcessing, VecCollector, pre_process, rollout_fields
+from util.policy_eval import ExactEvaluator
+from util.async_eval import AsyncEvaluator
+from util.batch_eval import batch_evaluator
+from util.rng import stream_seed
 
 class PPOtrainer:
     def __init__(self):
         pass
 
     def train(self, env, params):
+        self.setup(env, params)
+        self.run(params.total_train_episodes)
+        return self.finish()
+
+    def setup(self, env, params):
+        """builds the networks, optimizers and buffers of a run. run() then trains it, possibly in several stages"""
         device = params.device
-        actor = PPO_Actor(params.state_dim, params.actor_hidden_dim, params.action_dim).to(device)
-        critic = PPO_Critic(params.state_dim, params.critic_hidden_dim).to(device)
-        actor_opt = th.optim.Adam(actor.parameters(), lr=params.actor_lr)
-        critic_opt = th.optim.Adam(critic.parameters(), lr=params.critic_lr)
+        self.env, self.params = env, params
+        self.actor = PPO_Actor(params.state_dim, params.actor_hidden_dim, params.action_dim).to(device)
+        self.critic = PPO_Critic(params.state_dim, params.critic_hidden_dim).to(device)
+        self.actor_opt = th.optim.Adam(self.actor.parameters(), lr=params.actor_lr)
+        self.critic_opt = th.optim.Adam(self.critic.parameters(), lr=params.critic_lr)
+
+        self.episode_rewards = []
+        self.test_returns = []
+        self.test_episode_lengths = []
+
+        #exact evaluation replaces sampled test episodes on grid worlds (unless rendering/recording)
+        self.exact_eval = ExactEvaluator(env, params) if params.exact_eval and hasattr(env, 'layout') else None
 
-        episode_rewards = []
-        test_returns = []
-        test_episode_lengths = []
+        #sampled test episodes run in a background process with params.async_eval, training does not wait for them
+        self.evaluator = None
+        if params.async_eval and (self.exact_eval is None or params.show_testing or params.record_testing):
+            self.evaluator = AsyncEvaluator(self.test, self.actor, params, seed=stream_seed(params, 'evaluator'))
 
         if params.switch_goal: print(f"Current goal {env.goal}")
 
-        n_ep = 0
-
-        for it in range(params.train_iterations):
-            buffer = []
-
-            for ep in range(params.buffer_episodes):
-                state_history = []
-                action_history = []
-                logp_history = []
-                reward_history = []
-                value_history = []
-
-                obs, _ = env.reset()
-                total_reward = 0
-
-                for t in range(params.t_max):
-                    state = pre_process(obs).to(device)
-
-                    #select action, compute value estimate
-                    with th.no_grad():
-                        logits = actor(state)
-                        action, logp, _ = actor.select_action(logits)
-                        value = critic(state)
-
-                    #take a step
-                    next_obs, reward, terminated, truncated, _ = env.step(action.item())
-
-                    #store transition
-                    state_history.append(state)
-                    action_history.append(action)
-                    logp_history.append(logp)
-                    reward_history.append(reward)
-                    value_history.append(value)
-
-                    total_reward += reward
-                    obs = next_obs
-
-                    if terminated or truncated:     #Optional for printing train episode lengths
-                        # print(f"****training episode {n_ep+1}: {t+1} steps ****")
-                        pass
-
-                    #logic for episode termination/truncation
-                    if truncated:   #Compute next value if episode env timelimit is reached
-                        next_state = pre_process(obs).to(device)
-                        with th.no_grad():
-                            next_value = critic(next_state)
-                        value_history.append(next_value)
-                        break
-                    if terminated: #Compute next value = 0 if terminal state reached
-                        next_value = th.zeros_like(value)
-                        value_history.append(next_value)
-                        break
-
-                episode_rewards.append(total_reward)
-                n_ep += 1
-
-                #compute returns and advantages for episode, add episode to buffer
-                returns, advantages = compute_GAE(reward_history, value_history, params.gamma, params.gae_lambda, device)
-                buffer.append((state_history, action_history, logp_history, value_history, returns, advantages))
-
-                #test at interval and print result
-                if n_ep % params.test_interval == 0:
-                    # show_testing = False if n_ep < params.render_delay and params.show_testing else True
-                    test_return, episode_length = self.test(deepcopy(actor), params, n_ep, env.goal)
-                    test_returns.append(test_return)
-                    test_episode_lengths.append(episode_length)
-                    print(f'Test return at episode {n_ep}: {test_return:.3f} | '
-                          f'Average test episode length: {episode_length}')
-
-                #Switch Goal location
-                if params.switch_goal and n_ep == params.total_train_episodes // 2:
-                    env.switch_goal(goal=params.new_goal)
-                    print(f"New goal {env.goal}. Max return so far: {max(test_returns):.3f}")
+        #batched collection over params.num_envs grid worlds, serial single env otherwise
+        self.collector = None
+        if params.num_envs > 1 and hasattr(env, 'layout'):
+            self.collector = VecCollector(make_vec_env(params, params.num_envs, seed=stream_seed(params, 'collector')), device)
+
+        self.n_ep = 0
+
+        #per-step buffer tensors, allocated once and refilled every iteration
+        self.storage = RolloutStorage(params.buffer_episodes * params.t_max, rollout_fields(params), device)
+        self.batch_process = BatchProcessing()
+
+    def record_tests(self, results):
+        for test_ep, test_return, episode_length in results:
+            self.test_returns.append(test_return)
+            self.test_episode_lengths.append(episode_length)
+            print(f'Test return at episode {test_ep}: {test_return:.3f} | '
+                  f'Average test episode length: {episode_length:.1f}')
+
+    def run(self, num_episodes):
+        """trains until num_episodes episodes are done (rounded up to whole buffers). Can be called again with
+            a larger num_episodes to continue the run where it stopped"""
+        env, params = self.env, self.params
+        actor, critic, actor_opt, critic_opt = self.actor, self.critic, self.actor_opt, self.critic_opt
+        exact_eval, evaluator, collector, storage = self.exact_eval, self.evaluator, self.collector, self.storage
+        batch_process = self.batch_process
+        switch_ep = params.total_train_episodes // 2
+
+        while self.n_ep < num_episodes:
+            storage.reset()
+
+            ep = 0
+            while ep < params.buffer_episodes:
+                #episodes are written to storage, returns and advantages are computed for the whole buffer
+                if collector is not None:
+                    #stop at the goal switch so every episode runs on the goal the serial loop would use
+                    buffer_episodes = params.buffer_episodes - ep
+                    if params.switch_goal and self.n_ep < switch_ep:
+                        buffer_episodes = min(buffer_episodes, switch_ep - self.n_ep)
+                    collector.env.choose_goal(env.goal)
+                    rewards = collector.collect(actor, critic, buffer_episodes, storage)
+                else:
+                    rewards = [self.run_episode(env, actor, critic, params, storage)]
+
+                for total_reward in rewards:
+                    ep += 1
+                    self.episode_rewards.append(total_reward)
+                    self.n_ep += 1
+                    n_ep = self.n_ep
+
+                    #test at interval and print result
+                    results = []
+                    if n_ep % params.test_interval == 0:
+                        # show_testing = False if n_ep < params.render_delay and params.show_testing else True
+                        if exact_eval is not None and not ((params.show_testing or params.record_testing) and n_ep > params.render_delay):
+                            results.append((n_ep,) + exact_eval.evaluate_ppo(actor, env.goal))
+                        elif evaluator is not None:
+                            evaluator.submit(actor, n_ep, env.goal)
+                        else:
+                            results.append((n_ep,) + self.test(deepcopy(actor), params, n_ep, env.goal))
+                    if evaluator is not None:
+                        #background results so far, all pending ones before the goal switch
+                        results += evaluator.drain() if params.switch_goal and n_ep == switch_ep else evaluator.poll()
+                    self.record_tests(results)
+
+                    #Switch Goal location
+                    if params.switch_goal and n_ep == switch_ep:
+                        env.switch_goal(goal=params.new_goal)
+                        print(f"New goal {env.goal}. Max return so far: {max(self.test_returns):.3f}")
 
             #process buffer once full
-            batch_process = BatchProcessing()
             batch_states, batch_actions, batch_logp, batch_values, batch_returns, batch_advantages \
-                = batch_process.collate_batch(buffer, params.device)
+                = batch_process.collate_batch(storage, params.gamma, params.gae_lambda, params.device)
 
-            #convert to dataset and initialize dataloader for mini_batch sampling
-            dataset = th.utils.data.TensorDataset(batch_states, batch_actions, batch_logp, batch_values, batch_returns,
-                                                  batch_advantages)
-            dataloader = th.utils.data.DataLoader(dataset, batch_size=params.mini_batch_size, shuffle=True)
+            #shuffled mini_batch sampling, one index permutation per epoch
+            sampler = MinibatchSampler((batch_states, batch_actions, batch_logp, batch_values, batch_returns,
+                                        batch_advantages), params.mini_batch_size)
 
             #optimization loop
             loss_p, loss_c = [], []
             for _ in range(params.opt_epochs):
-                for batch in dataloader:
+                for batch in sampler:
                     states_mb, actions_mb, logp_mb, values_mb, returns_mb, advantages_mb = batch
 
                     states_mb = states_mb.to(params.device)
@@ -147,60 +158,70 @@ class PPOtrainer:
             # av_loss_p, av_loss_c = sum(loss_p)/len(loss_p), sum(loss_c)/len(loss_c)
             # print(f"Optimization avg losses: Policy loss: {av_loss_p:.3f} | Critic loss: {av_loss_c:.3f}")
 
-        print(f"Trial Complete. Max test returns for: "
-              f"G1 = {max(test_returns[:len(test_returns) // 2]):.3f}, "
-              f"G2 = {max(test_returns[-len(test_returns) // 2:]):.3f}")
-        return episode_rewards, test_returns, test_episode_lengths
+        #collect pending background tests, so a run paused here (e.g. at an ASHA rung) is judged on all of them
+        if evaluator is not None:
+            self.record_tests(evaluator.drain())
 
-    @staticmethod
-    def test(actor, params, n_ep, goal):
-        """tests agent and averages result, configure whether to show (render)
-            testing and how long to delay in ParametersPPO class"""
-        render_testing = params.show_testing and n_ep > params.render_delay
-
-        if params.env_name == 'FourRooms':
-            test_env = FourRooms(render_mode="human") if render_testing else FourRooms()
-            test_env.choose_goal(goal)
-        elif params.env_name == 'FourRooms_m':
-            test_env = FourRooms_m(render_mode="human") if render_testing else FourRooms_m()
-            test_env.choose_goal(goal)
+    def finish(self):
+        """collects pending background tests and returns (episode_rewards, test_returns, test_episode_lengths)"""
+        test_returns = self.test_returns
+        if self.evaluator is not None:
+            self.record_tests(self.evaluator.close())
+
+        if self.n_ep < self.params.total_train_episodes:
+            print(f"Trial stopped at episode {self.n_ep}. Max test return: {max(test_returns, default=float('nan')):.3f}")
         else:
-            test_env = gym.make(params.env_name)  # , render_mode="human")
+            print(f"Trial Complete. Max test returns for: "
+                  f"G1 = {max(test_returns[:len(test_returns) // 2]):.3f}, "
+                  f"G2 = {max(test_returns[-len(test_returns) // 2:]):.3f}")
+        return self.episode_rewards, test_returns, self.test_episode_lengths
 
-        test_rewards = np.zeros(params.test_episodes)
-        episode_lengths = np.zeros(params.test_episodes)
-        test_returns = np.zeros(params.test_episodes)
+    @staticmethod
+    def run_episode(env, actor, critic, params, storage):
+        """runs one training episode on a single env, writing its steps to storage in place.
+            Returns the total episode reward"""
+        device = params.device
+        total_reward = 0.
+
+        obs, _ = env.reset()
 
-        for i in range(params.test_episodes):
-            obs, _ = test_env.reset()
-            rewards = []
+        for t in range(params.t_max):
+            state = pre_process(obs).to(device)
 
-            for t in range(params.t_max):
-                state = pre_process(obs)
+            #select action, compute value estimate
+            with th.no_grad():
                 logits = actor(state)
-                action, _, _ = actor.select_action(logits)
-                next_obs, reward, done, trunc, _ = test_env.step(action.item())
+                action, logp, _ = actor.select_action(logits)
+                value = critic(state)
 
-                test_env.render(i)
+            #take a step
+            next_obs, reward, terminated, truncated, _ = env.step(action.item())
 
-                rewards.append(reward)
-                # total_reward += reward
-                obs = next_obs
-                if done or trunc:
-                    episode_lengths[i] = t + 1
-                    break
-            test_rewards[i] = sum(rewards) #Check if this works?
+            #store transition
+            storage.insert(states=state, actions=action, logp=logp, rewards=reward, values=value)
+            total_reward += reward
 
-            #compute discounted return
-            gt = 0
-            for k in reversed(range(len(rewards))):
-                gt = rewards[k] + params.gamma * gt
-            test_returns[i] = gt
+            obs = next_obs
 
-        test_env.close()
+            if terminated or truncated:     #Optional for printing train episode lengths
+                # print(f"****training episode {n_ep+1}: {t+1} steps ****")
+                pass
 
-        # average_reward = np.mean(test_rewards)
-        average_length = np.mean(episode_lengths)
-        average_return = np.mean(test_returns)
+            #logic for episode termination/truncation
+            if terminated: #Compute next value = 0 if terminal state reached
+                storage.end_episode(values=0.)
+                break
+            if truncated or t == params.t_max - 1:   #Compute next value if episode env timelimit is reached
+                next_state = pre_process(obs).to(device)
+                with th.no_grad():
+                    next_value = critic(next_state)
+                storage.end_episode(values=next_value[0, 0])
+                break
 
-        return average_return, average_length
\ No newline at end of file
+        return total_reward
+
+    @staticmethod
+    def test(actor, params, n_ep, goal):
+        """tests agent and averages result over params.test_episodes episodes run as one batch (util/batch_eval.py),
+            configure whether to show (render) testing and how long to delay in ParametersPPO class"""
+        return batch_evaluator(params).evaluate_ppo(actor, n_ep, goal)
@@ -0,0 +1,89 @@
+import multiprocessing as mp
+import queue
+import traceback
+from copy import deepcopy
+import torch as th
+
+from util.rng import seed_everything
+
+
+def _evaluator_process(tasks, results, test, network, params, seed):
+    #one thread, so evaluation does not compete with the training process for cores
+    th.set_num_threads(1)
+    seed_everything(seed)
+    #this process is already off the training loop, render in it directly
+    params.async_render = False
+    #the network copy is on the CPU, keep evaluation inputs there too (OC_Network moves obs to its own device)
+    params.device = th.device('cpu')
+    if hasattr(network, 'device'):
+        network.device = params.device
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        n_ep, goal, state_dict = task
+        try:
+            network.load_state_dict({name: th.as_tensor(value) for name, value in state_dict.items()})
+            test_return, episode_length = test(network, params, n_ep, goal)
+            results.put((n_ep, float(test_return), float(episode_length), None))
+        except Exception:
+            results.put((n_ep, None, None, traceback.format_exc()))
+
+
+class AsyncEvaluator:
+    """runs a trainer's test() in a separate (spawned) process so training never waits for sampled test
+        episodes. submit() sends a CPU snapshot of the network weights with the episode number and goal;
+        results come back tagged with the episode number, in submission order"""
+    def __init__(self, test, network, params, seed):
+        """test: the trainer's test(network, params, n_ep, goal). network: module of the same architecture,
+            a CPU copy is sent to the process once. params must be picklable"""
+        ctx = mp.get_context('spawn')
+        self.tasks = ctx.Queue()
+        self.results = ctx.Queue()
+        self.pending = 0
+        self.process = ctx.Process(target=_evaluator_process, daemon=True,
+                                   args=(self.tasks, self.results, test, deepcopy(network).cpu(), params, seed))
+        self.process.start()
+
+    def submit(self, network, n_ep, goal):
+        #numpy copies are pickled by value: the snapshot cannot change while it waits in the queue
+        state_dict = {name: value.detach().cpu().numpy().copy() for name, value in network.state_dict().items()}
+        self.tasks.put((n_ep, goal, state_dict))
+        self.pending += 1
+
+    def get(self, block):
+        n_ep, test_return, episode_length, error = self.results.get(block=block, timeout=1. if block else None)
+        self.pending -= 1
+        if error is not None:
+            raise RuntimeError(f"evaluation at episode {n_ep} failed:\n{error}")
+        return n_ep, test_return, episode_length
+
+    def poll(self):
+        """(n_ep, test return, episode length) of the evaluations finished since the last call, without waiting"""
+        finished = []
+        while self.pending:
+            try:
+                finished.append(self.get(block=False))
+            except queue.Empty:
+                break
+        return finished
+
+    def drain(self):
+        """waits for every submitted evaluation, returns those not collected yet"""
+        finished = []
+        while self.pending:
+            try:
+                finished.append(self.get(block=True))
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError("evaluator process exited with evaluations pending")
+        return finished
+
+    def close(self):
+        """waits for pending evaluations, stops the process and returns the remaining results"""
+        finished = self.drain()
+        self.tasks.put(None)
+        self.process.join(timeout=5.)
+        if self.process.is_alive():
+            self.process.terminate()
+        return finished
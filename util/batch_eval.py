@@ -0,0 +1,219 @@
+import os
+import numpy as np
+import torch as th
+from torch.distributions import Categorical, Bernoulli
+
+from env.recorder import EpisodeRecorder
+from helpers.common_helper import obs_to_tensor, to_numpy, make_env, make_vec_env, VEC_ENV_NAMES
+from helpers.dac_helper import compute_pi_hat, NO_OPTION
+from util.rng import stream_seed
+
+
+class PPOPolicy:
+    """actions sampled from the actor for a batch of observations"""
+    def __init__(self, actor):
+        self.actor = actor
+        self.device = next(actor.parameters()).device
+
+    def reset(self, num_envs):
+        pass
+
+    def act(self, obs):
+        return Categorical(logits=self.actor(obs.to(self.device))).sample()
+
+    def overlay(self, i):
+        return None, None
+
+
+class OCPolicy:
+    """options chosen eps_test-greedily w.r.t. Q when they terminate, actions from the option sub-policies.
+        Termination of the running option is sampled at the state the next action is taken in"""
+    def __init__(self, agent, params):
+        self.agent = agent
+        self.params = params
+        self.device = next(agent.parameters()).device
+
+    def reset(self, num_envs):
+        self.options = th.zeros(num_envs, dtype=th.long, device=self.device)
+        self.betas = None
+        self.rows = th.arange(num_envs, device=self.device)
+
+    def act(self, obs):
+        agent, params = self.agent, self.params
+        state = agent.get_state(obs.to(self.device)).squeeze(0)
+        greedy = agent.get_Q(state).argmax(dim=-1)
+
+        #all options start on the first step, afterwards the running option terminates with beta_w(s)
+        if self.betas is None:
+            self.betas = th.ones(len(self.options), dtype=th.bool, device=self.device)
+        else:
+            self.betas = Bernoulli(agent.get_betas(state)[self.rows, self.options]).sample().bool()
+        explore = th.rand(len(self.options), device=self.device) < params.eps_test
+        random_options = th.randint(params.num_options, (len(self.options),), device=self.device)
+        self.options = th.where(self.betas, th.where(explore, random_options, greedy), self.options)
+
+        logits = th.stack([agent.options[w](state) for w in range(params.num_options)], dim=1)
+        logits = logits[self.rows, self.options]
+        return Categorical((logits / params.temp).softmax(dim=-1)).sample()
+
+    def overlay(self, i):
+        return f"Current option = {self.options[i].item()}", f"beta = {float(self.betas[i]):.1f}"
+
+
+class DACPolicy:
+    """option drawn from pi_hat given the previous option (master policy at the episode start), action from
+        the option's sub-policy"""
+    def __init__(self, network):
+        self.network = network
+        self.device = next(network.parameters()).device
+
+    def reset(self, num_envs):
+        self.prev_options = th.full((num_envs,), NO_OPTION, dtype=th.long, device=self.device)
+        self.rows = th.arange(num_envs, device=self.device)
+
+    def act(self, obs):
+        prediction = self.network(obs.to(self.device))
+        pi_hat = compute_pi_hat(prediction, self.prev_options)
+        options = Categorical(probs=pi_hat).sample()
+        pi_bar = prediction['pi_w'][self.rows, options]
+        actions = Categorical(probs=pi_bar).sample()
+
+        self.last_step = (prediction, pi_hat, pi_bar, options, self.prev_options)
+        self.prev_options = options
+        return actions
+
+    def overlay(self, i):
+        prediction, pi_hat, pi_bar, options, prev_options = self.last_step
+        q_w, betas = prediction['q_W'][i], prediction['betas'][i]
+        pi_hat, pi_bar = pi_hat[i], pi_bar[i]
+        prev = prev_options[i].item()
+        return (f"Option={options[i].item()}, Prev={prev if prev != NO_OPTION else None} | q=[{q_w[0]:.1f},{q_w[1]:.1f},{q_w[2]:.1f},{q_w[3]:.1f}]",
+                f"pi_bar,hat,beta = [{pi_bar[0]:.1f},{pi_bar[1]:.1f},{pi_bar[2]:.1f},{pi_bar[3]:.1f}], "
+                f"[{pi_hat[0]:.1f},{pi_hat[1]:.1f},{pi_hat[2]:.1f},{pi_hat[3]:.1f}], "
+                f"[{betas[0]:.1f},{betas[1]:.1f},{betas[2]:.1f},{betas[3]:.1f}]")
+
+
+class BatchEvaluator:
+    """Monte Carlo test of PPO, OC and DAC policies with all params.test_episodes episodes run in lockstep:
+        one batched network forward per step, finished episodes are masked out, discounted returns and
+        lengths are computed from the reward matrix at the end. Test envs are kept in a pool per render
+        mode and reused by every call. Without rendering/recording, grid worlds run as one batched env
+        (make_vec_env, one step per timestep for all episodes); otherwise, and for other envs, the pool is a
+        list of single envs, each with its own random stream, stepped one by one. Pools are seeded from the trial's
+        evaluator stream (util/rng.py), not from the global numpy generator. With 'human' rendering the
+        episodes run one at a time so the live view shows each of them. Returns (average_return,
+        average_length) like ExactEvaluator"""
+    def __init__(self, params):
+        self.params = params
+        self.pools = {}
+
+    def env_pool(self, render_mode):
+        seed = stream_seed(self.params, 'evaluator')
+        if render_mode not in self.pools and render_mode is None and self.params.env_name in VEC_ENV_NAMES:
+            self.pools[render_mode] = make_vec_env(self.params, self.params.test_episodes, seed=seed)
+        if render_mode not in self.pools:
+            size = 1 if render_mode == 'human' else self.params.test_episodes
+            seeds = np.random.SeedSequence(seed).generate_state(size)
+            envs = [make_env(self.params, render_mode) for _ in range(size)]
+            for env, seed in zip(envs, seeds):
+                env.reset(seed=int(seed))
+            self.pools[render_mode] = envs
+        return self.pools[render_mode]
+
+    def evaluate_ppo(self, actor, n_ep, goal):
+        return self.evaluate(PPOPolicy(actor), n_ep, goal)
+
+    def evaluate_oc(self, agent, n_ep, goal):
+        agent.train(mode=False)
+        return self.evaluate(OCPolicy(agent, self.params), n_ep, goal)
+
+    def evaluate_dac(self, network, n_ep, goal):
+        network.train(mode=False)
+        return self.evaluate(DACPolicy(network), n_ep, goal)
+
+    def evaluate(self, policy, n_ep, goal):
+        """render (human) or record (rgb frames) the test episodes after params.render_delay episodes"""
+        params = self.params
+        render_testing = params.show_testing and n_ep > params.render_delay
+        record_testing = params.record_testing and n_ep > params.render_delay and not render_testing
+        render_mode = "human" if render_testing else "rgb_array" if record_testing else None
+        recorder = EpisodeRecorder(os.path.join(params.record_dir, f"{params.env_name}_ep{n_ep}.npz")) if record_testing else None
+
+        envs = self.env_pool(render_mode)
+        rewards = np.zeros((params.test_episodes, params.t_max))
+        episode_lengths = np.full(params.test_episodes, params.t_max)
+        with th.no_grad():
+            if not isinstance(envs, list):
+                envs.choose_goal(goal)
+                self.run_vec(policy, envs, rewards, episode_lengths)
+            else:
+                for env in envs:
+                    if hasattr(env, 'choose_goal'):
+                        env.choose_goal(goal)
+                for first in range(0, params.test_episodes, len(envs)):
+                    episodes = np.arange(first, min(first + len(envs), params.test_episodes))
+                    self.run_batch(policy, envs[:len(episodes)], episodes, rewards, episode_lengths, render_testing, recorder)
+
+        if recorder is not None:
+            recorder.save()
+
+        #discounted returns of all episodes at once
+        test_returns = rewards @ params.gamma ** np.arange(params.t_max)
+        return np.mean(test_returns), np.mean(episode_lengths)
+
+    def run_vec(self, policy, vec_env, rewards, episode_lengths):
+        """runs all test episodes on one batched grid world, one vec_env.step per timestep. The env auto-resets
+            finished episodes, the active mask freezes their rewards and lengths"""
+        obs, _ = vec_env.reset()
+        policy.reset(vec_env.num_envs)
+        active = np.ones(vec_env.num_envs, dtype=bool)
+
+        for t in range(self.params.t_max):
+            actions = policy.act(obs_to_tensor(obs))
+            obs, reward, terminated, truncated, _ = vec_env.step(actions if isinstance(obs, th.Tensor) else to_numpy(actions))
+            rewards[active, t] = to_numpy(reward)[active]
+            done = active & to_numpy(terminated | truncated)
+            episode_lengths[done] = t + 1
+            active &= ~done
+            if not active.any():
+                break
+
+    def run_batch(self, policy, envs, episodes, rewards, episode_lengths, render, recorder):
+        """runs one episode per env in lockstep, rewards/episode_lengths rows are filled for episodes"""
+        obs = [env.reset()[0] for env in envs]
+        policy.reset(len(envs))
+        active = np.ones(len(envs), dtype=bool)
+
+        for t in range(self.params.t_max):
+            actions = policy.act(obs_to_tensor(np.stack(obs))).tolist()
+            for k in np.flatnonzero(active):
+                env, i = envs[k], episodes[k]
+                obs[k], reward, terminated, truncated, _ = env.step(actions[k])
+                rewards[i, t] = reward
+
+                if render:
+                    text_top, text_bot = policy.overlay(k)
+                    env.render(i, text_top=text_top, text_bot=text_bot)
+                if recorder is not None:
+                    recorder.add_frame(i, env.render(i))
+
+                if terminated or truncated:
+                    episode_lengths[i] = t + 1
+                    active[k] = False
+            if not active.any():
+                break
+
+
+_evaluators = {}
+
+def batch_evaluator(params):
+    """BatchEvaluator for params' test env and trial, kept for the lifetime of the process so its env pools are reused
+        by the trial's tests. Keyed by the trial seed too, so a trial's test episodes do not depend on which trials
+        ran before it in the process"""
+    key = (params.env_name, params.obs_mode, repr(params.layout_kwargs), params.async_render, params.test_episodes,
+           params.t_max, params.env_backend, str(params.device), params.seed, params.trial_seed)
+    if key not in _evaluators:
+        _evaluators[key] = BatchEvaluator(params)
+    evaluator = _evaluators[key]
+    evaluator.params = params
+    return evaluator
@@ -14,8 +14,10 @@ class Utils:
                        all_test_returns,
                        all_test_lengths,
                        test_interval,
-                       store_avg_test=True):
-        """Data processing and calculations"""
+                       store_avg_test=True,
+                       optimal_returns=None):
+        """Data processing and calculations. optimal_returns: optional exact optimal return per goal
+            (see util.dp_solver), drawn as reference lines on the test return plot"""
         num_trials = len(all_train_returns)
         num_points = len(all_test_returns[0])
 
@@ -93,6 +95,10 @@ class Utils:
             plt.plot(episodes, all_test_returns[i], linestyle='dotted', alpha=0.5, label=f'Trial {i+1}')  # Individual test trials
         plt.plot(episodes, mean_test_returns, '-o', label='Mean Test Returns', color='black')  # Mean test returns without error bars
         plt.fill_between(episodes, mean_test_returns - test_ci, mean_test_returns + test_ci, color='lightblue', alpha=0.3, label='CI')  # Fill between upper and lower bounds
+        if optimal_returns is not None:     # optimal return for each goal over its half of training
+            halves = np.array_split(episodes, len(optimal_returns))
+            for i, (optimal, half) in enumerate(zip(optimal_returns, halves)):
+                plt.hlines(optimal, half[0], half[-1], colors='green', linestyles='dashed', label='Optimal Return' if i == 0 else None)
         plt.xlabel('Episodes')
         plt.ylabel('Test Return')
         plt.title('Test Returns with 95% Confidence Interval')
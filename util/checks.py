@@ -0,0 +1,145 @@
+import sys
+import numpy as np
+import torch as th
+from scipy.stats import chi2_contingency
+
+from env.fourrooms import FourRooms, FourRooms_m, FourRoomsVec, FourRooms_mVec
+from helpers import ppo_helper, dac_helper
+
+#Regression checks of the optimized code paths that must reproduce the original behaviour exactly (or in
+#distribution), run from the repo root with: python -m util.checks
+#Every check returns a list of failure messages, empty if it passed.
+
+
+def wall_states(env):
+    """one state next to walls per set of blocked directions in the layout (edges, corners, doorways)"""
+    states = {}
+    for state, cell in sorted(env.tocell.items()):
+        walls = tuple(int(env.occupancy[tuple(np.add(cell, direction))]) for direction in env.directions)
+        if any(walls):
+            states.setdefault(walls, state)
+    return sorted(states.values())
+
+def far_goal(env, states):
+    """a goal state more than one step away from every state in states, so no test transition ends an episode"""
+    cells = np.array([env.tocell[state] for state in states])
+    for state in sorted(env.tocell, reverse=True):
+        if np.abs(cells - np.array(env.tocell[state])).sum(axis=1).min() > 1:
+            return state
+
+def check_vec_transitions(num_samples=10000, min_p_value=1e-3):
+    """next-state frequencies of the batched FourRooms envs (FourRoomsVec, FourRooms_mVec) against the single
+        env, for every action from states next to walls, slip included. Two-sample chi-square test per (state,
+        action), moves without a random outcome (into a wall) must give the same next state"""
+    failures = []
+    for env_cls, vec_cls in ((FourRooms, FourRoomsVec), (FourRooms_m, FourRooms_mVec)):
+        env, vec = env_cls(), vec_cls(num_samples)
+        num_states = len(env.tocell)
+        states = wall_states(env)
+        goal = far_goal(env, states)
+        env.choose_goal(goal)
+        vec.choose_goal(goal)
+
+        for state in states:
+            for action in range(env.action_space.n):
+                single = np.zeros(num_states, dtype=np.int64)
+                for _ in range(num_samples):
+                    env.currentcell = env.tocell[state]
+                    env.ep_steps = 0
+                    env.step(action)
+                    single[env.tostate[tuple(env.currentcell)]] += 1
+
+                vec.states = np.full(num_samples, state)
+                vec.ep_steps[:] = 0
+                vec.step(np.full(num_samples, action))
+                batched = np.bincount(vec.states, minlength=num_states)
+
+                observed = (single + batched) > 0
+                if observed.sum() == 1:
+                    passed, detail = np.array_equal(single, batched), "deterministic move"
+                else:
+                    p_value = chi2_contingency(np.stack([single, batched])[:, observed])[1]
+                    passed, detail = p_value >= min_p_value, f"chi-square p = {p_value:.2e}"
+                if not passed:
+                    failures.append(f"{vec_cls.__name__} state {state} action {action}: next states differ from "
+                                    f"{env_cls.__name__} ({detail})")
+    return failures
+
+def loop_GAE(rewards, values, gamma, gae_lambda):
+    """the per-episode loop compute_GAE replaced: float32 tensor values (with the bootstrap value of the last next
+        state appended), advantages accumulated in float32, returns in python floats"""
+    advantages, returns = [], []
+    R, gae = 0, 0
+    for t in reversed(range(len(rewards))):
+        delta = rewards[t] + gamma * values[t + 1] - values[t]
+        gae = delta + gamma * gae_lambda * gae
+        R = rewards[t] + gamma * R
+        advantages.insert(0, gae)
+        returns.insert(0, R)
+    return th.tensor(returns), th.stack(advantages)
+
+def random_buffer(rng, num_episodes, max_length=60, num_values=1):
+    """episodes laid end to end like a full buffer: rewards, num_values value functions per step, their bootstrap
+        values (0 after a terminal step, as for episodes that reached the goal) and the done mask"""
+    lengths = rng.integers(1, max_length + 1, size=num_episodes)
+    episodes = []
+    for length in lengths:
+        terminal = rng.random() < 0.5
+        rewards = (rng.random(length) < 0.05).astype(float) + rng.normal(0, 0.1, length) * rng.integers(2)
+        values = th.tensor(rng.normal(0.3, 0.3, (num_values, length + 1)), dtype=th.float32)
+        if terminal:
+            values[:, -1] = 0.
+        episodes.append((rewards.tolist(), values))
+    dones = np.concatenate([np.arange(length) == length - 1 for length in lengths])
+    return episodes, dones
+
+def check_gae(num_buffers=20, gamma=0.99, gae_lambda=0.95, tolerance=1e-5):
+    """PPO and DAC (high and low MDP) compute_GAE over multi-episode buffers with done masks against the
+        per-episode loops they replaced, returns and advantages to within tolerance"""
+    failures = []
+    rng = np.random.default_rng(0)
+    device = th.device('cpu')
+    max_errors = {'ppo returns': 0., 'ppo advantages': 0., 'dac returns': 0., 'dac high advantages': 0.,
+                  'dac low advantages': 0.}
+    for _ in range(num_buffers):
+        #PPO: one value function
+        episodes, dones = random_buffer(rng, rng.integers(1, 20))
+        expected = [loop_GAE(rewards, values[0], gamma, gae_lambda) for rewards, values in episodes]
+        rewards = [r for rewards, _ in episodes for r in rewards]
+        values = th.cat([episode_values[0, :-1] for _, episode_values in episodes])
+        next_values = th.cat([episode_values[0, 1:] for _, episode_values in episodes])
+        returns, advantages = ppo_helper.compute_GAE(rewards, values, next_values, dones, gamma, gae_lambda, device)
+        for name, new, old in (('ppo returns', returns, th.cat([e[0] for e in expected])),
+                               ('ppo advantages', advantages, th.cat([e[1] for e in expected]))):
+            max_errors[name] = max(max_errors[name], (new - old).abs().max().item())
+
+        #DAC: high and low MDP values share rewards and done mask
+        episodes, dones = random_buffer(rng, rng.integers(1, 20), num_values=2)
+        expected = [[loop_GAE(rewards, values[k], gamma, gae_lambda) for k in range(2)] for rewards, values in episodes]
+        rewards = [r for rewards, _ in episodes for r in rewards]
+        values = th.cat([episode_values[:, :-1] for _, episode_values in episodes], dim=1)
+        next_values = th.cat([episode_values[:, 1:] for _, episode_values in episodes], dim=1)
+        returns, adv_h, adv_l = dac_helper.compute_GAE(rewards, values[0], values[1], next_values[0], next_values[1],
+                                                       dones, gamma, gae_lambda, device)
+        for name, new, old in (('dac returns', returns, th.cat([e[0][0] for e in expected])),
+                               ('dac high advantages', adv_h, th.cat([e[0][1] for e in expected])),
+                               ('dac low advantages', adv_l, th.cat([e[1][1] for e in expected]))):
+            max_errors[name] = max(max_errors[name], (new - old).abs().max().item())
+
+    for name, error in max_errors.items():
+        if error > tolerance:
+            failures.append(f"{name} differ from the per-episode loop by up to {error:.2e}")
+    return failures
+
+
+CHECKS = [check_vec_transitions, check_gae]
+
+if __name__ == '__main__':
+    failed = False
+    for check in CHECKS:
+        failures = check()
+        print(f"{check.__name__}: {'ok' if not failures else 'FAILED'}")
+        for failure in failures:
+            print(f"    {failure}")
+        failed = failed or bool(failures)
+    sys.exit(1 if failed else 0)
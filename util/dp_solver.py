@@ -0,0 +1,73 @@
+import os
+import hashlib
+import numpy as np
+import scipy.sparse as sp
+
+from env.gridworld import compile_layout
+
+#on-disk cache of solved values, keyed by layout, goal, gamma and horizon
+CACHE_DIR = 'dp_cache'
+
+
+def transition_matrix(tables):
+    """exact transition probabilities of GridWorld.step as a sparse matrix of shape [num_actions * S, S],
+        row a * S + s holds P(. | s, a). Moving into a wall keeps the agent in place. Otherwise the
+        intended cell gets 2/3 and the remaining 1/3 is spread uniformly over the empty neighbours
+        (intended cell included), exactly as the env samples it."""
+    num_states, num_actions = tables.next_state.shape
+    states = np.arange(num_states)
+
+    rows, cols, probs = [], [], []
+    for a in range(num_actions):
+        intended = tables.next_state[:, a]
+        blocked = intended == states
+        row = a * num_states + states
+
+        #blocked moves: stay with probability 1. free moves: 2/3 intended + 1/3 uniform slip
+        rows.append(row); cols.append(intended); probs.append(np.where(blocked, 1., 2/3.))
+        for k in range(num_actions):
+            slip = ~blocked & (k < tables.num_slip)
+            rows.append(row[slip])
+            cols.append(tables.slip_neighbours[slip, k])
+            probs.append(1/3. / tables.num_slip[slip])
+
+    rows, cols, probs = np.concatenate(rows), np.concatenate(cols), np.concatenate(probs)
+    return sp.csr_matrix((probs, (rows, cols)), shape=(num_actions * num_states, num_states))
+
+def value_iteration(tables, goal, gamma, t_max=1000, tol=1e-12):
+    """finite horizon value iteration with reward 1 for entering the goal (episode ends there).
+        Returns V*[s] with t_max steps remaining (env truncation) and the greedy first action.
+        Stops early once the values stop changing by more than tol."""
+    num_states, num_actions = tables.next_state.shape
+    P = transition_matrix(tables)
+
+    reward = np.zeros(num_states); reward[goal] = 1.
+    not_goal = 1. - reward
+    V = np.zeros(num_states)
+    for _ in range(t_max):
+        Q = (P @ (reward + gamma * not_goal * V)).reshape(num_actions, num_states)
+        V_new = Q.max(axis=0)
+        V_new[goal] = 0.
+        converged = np.abs(V_new - V).max() < tol
+        V = V_new
+        if converged:
+            break
+    return V, Q.argmax(axis=0)
+
+def optimal_return(layout, goal, gamma, t_max=1000, cache_dir=CACHE_DIR):
+    """optimal expected discounted return of an episode whose start state is drawn uniformly from
+        all non-goal states (as GridWorld.reset does). Cached on disk per (layout, goal, gamma, t_max)."""
+    key = hashlib.sha1(f"{layout}|{goal}|{gamma}|{t_max}".encode()).hexdigest()
+    path = os.path.join(cache_dir, f"{key}.npz") if cache_dir else None
+    if path and os.path.isfile(path):
+        return float(np.load(path)['optimal_return'])
+
+    tables = compile_layout(layout)
+    V, policy = value_iteration(tables, goal, gamma, t_max)
+    init_states = np.delete(np.arange(tables.num_states), goal)
+    result = float(V[init_states].mean())
+
+    if path:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez_compressed(path, V=V, policy=policy, optimal_return=result)
+    return result
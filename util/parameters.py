@@ -7,15 +7,29 @@ class SharedParams:
         self.device = th.device('cuda' if th.cuda.is_available() else 'cpu')
         self.show_testing = False  # set to True to render test episodes
         self.render_delay = 289  # set an episode delay for rendering test episodes
+        self.async_render = False  # set to True to draw the live pygame view in a separate process (never blocks training)
+        self.record_testing = False  # set to True to save rgb frames of test episodes (no pygame needed)
+        self.record_dir = 'recordings'  # one compressed .npz of frames per test run
         self.switch_goal = True  # switches goal halfway between total_train_episodes
         self.starting_goal = 62  # East doorway in FourRooms
         self.new_goal = 25  # North Doorway (change to None for random selection)
+        self.obs_mode = 'onehot'  # grid world observations: 'onehot' vector, integer state 'index' or 'coord'
+        self.layout_kwargs = dict(rooms_per_side=4, room_size=5, doorways=None, seed=0)  # MultiRooms generator
+
+        self.num_envs = 1  # >1 collects training episodes from that many grid worlds in lockstep (PPO, DAC)
+        self.env_backend = 'numpy'  # batched grid world backend: 'numpy' (GridWorldVec) or 'torch' (GridWorldTorch)
 
         self.num_trials = 5
+        self.num_workers = 1  # >1 runs trials in that many processes, each with its own env, params copy and seed
+        self.ensemble_trials = False  # PPO, DAC on grid worlds: train all trials at once as one vmapped ensemble (one process)
+        self.seed = 1234  # base seed, each trial seeds its env, python, numpy and torch from (seed, trial)
+        self.trial_seed = None  # set per trial by the runner, the trial's collector/evaluator/buffer streams derive from it
         self.total_train_episodes = 2000
         self.t_max = 1000
         self.test_interval = 10  # test every 10 episodes
         self.test_episodes = 10  # test 10 episodes and get average results
+        self.exact_eval = True  # grid worlds: exact expected test return/length instead of sampled test episodes
+        self.async_eval = False  # run sampled test episodes in a background process, training does not wait for them
 
 
 class ParametersPPO(SharedParams):
@@ -26,7 +40,6 @@ class ParametersPPO(SharedParams):
         self.buffer_episodes = 10  # num episodes in batch buffer
         self.opt_epochs = 10    #num optimization epochs per batch buffer
         self.mini_batch_size = 64
-        self.train_iterations = math.ceil(self.total_train_episodes / self.buffer_episodes) #top-lvl loop index
 
         # training value hyperparameters
         self.actor_hidden_dim = 128
@@ -38,6 +51,11 @@ class ParametersPPO(SharedParams):
         self.entropy_coef = 0.01
         self.eps_clip = 0.2
 
+    @property
+    def train_iterations(self):
+        """top-lvl loop index, derived so it follows total_train_episodes and buffer_episodes when they are changed"""
+        return math.ceil(self.total_train_episodes / self.buffer_episodes)
+
 class ParametersDAC(SharedParams):
     def __init__(self):
         super(ParametersDAC, self).__init__()
@@ -49,18 +67,17 @@ class ParametersDAC(SharedParams):
         self.actor_hidden_units = (dim, dim) #hidden neurons for master policy network
         self.critic_hidden_units = (dim, dim) #hidden neurons for critic network
 
-        #hidden neuron activation functions lambda x: F.relu(x) or F.tanh(x)
-        self.pi_l_activation = lambda x: F.tanh(x)     #option policies
-        self.beta_activation = lambda x: F.tanh(x)     #option termination
-        self.pi_h_activation = lambda x: F.tanh(x)     #master policy
-        self.critic_activation = lambda x: F.tanh(x)     #critic
+        #hidden neuron activation functions F.relu or F.tanh (module functions, not lambdas: params are pickled)
+        self.pi_l_activation = F.tanh     #option policies
+        self.beta_activation = F.tanh     #option termination
+        self.pi_h_activation = F.tanh     #master policy
+        self.critic_activation = F.tanh     #critic
 
         # training loop hyperparameters
         self.num_options = 4
         self.buffer_episodes = 5  # num episodes in batch buffer
         self.opt_epochs = 5  # num optimization epochs per batch buffer per mdp
         self.mini_batch_size = 64
-        self.train_iterations = math.ceil(self.total_train_episodes / self.buffer_episodes)  # top-lvl loop index
 
         # training value hyperparameters
         self.lr_ha = 3e-4       #high actor (pi_W) learning rate
@@ -74,6 +91,11 @@ class ParametersDAC(SharedParams):
         self.entropy_coef_h = 0.01  #high MDP exploration entropy coefficient
         self.entropy_coef_l = 0.01  #low MDP exploration entropy coefficient
 
+    @property
+    def train_iterations(self):
+        """top-lvl loop index, derived so it follows total_train_episodes and buffer_episodes when they are changed"""
+        return math.ceil(self.total_train_episodes / self.buffer_episodes)
+
 
 class ParametersOC(SharedParams):
     def __init__(self):
@@ -84,6 +106,11 @@ class ParametersOC(SharedParams):
         self.batch_size = 32        #minibatch size for critic optimization
         self.target_update_freq = 1000    #number of timesteps between hard critic updates
         self.critic_optim_freq = 4       #number of timesteps between critic SGD optimizations
+        self.prioritized_replay = False  #sample critic minibatches proportional to TD error (sum-tree buffer)
+        self.per_alpha = 0.6     #priority exponent, 0 = uniform
+        self.per_beta_start = 0.4    #importance-sampling exponent, annealed to 1 over per_beta_steps
+        self.per_beta_steps = 100000
+        self.per_eps = 1e-6     #added to |TD error| so no transition gets priority 0
 
         # training value and network hyperparameters
         self.hidden_dim = (64,64)   #hidden neurons for q, beta, subpolicy networks
@@ -113,4 +140,9 @@ class ParametersOC(SharedParams):
         """dynamically compute epsilon based on current step as params attribute"""
         epsilon = self.eps_end + (self.eps_start - self.eps_end) * \
                   math.exp(-1. * self.t_tot / self.eps_decay)
-        return epsilon
\ No newline at end of file
+        return epsilon
+
+    @property
+    def per_beta(self):
+        """importance-sampling exponent for prioritized replay, linearly annealed with t_tot"""
+        return min(1., self.per_beta_start + (1. - self.per_beta_start) * self.t_tot / self.per_beta_steps)
\ No newline at end of file
@@ -0,0 +1,100 @@
+import numpy as np
+import scipy.sparse as sp
+import torch as th
+
+from env.gridworld import compile_layout
+from helpers.common_helper import obs_to_tensor
+from util.dp_solver import transition_matrix
+
+
+class ExactEvaluator:
+    """Exact test-time evaluation of PPO, OC and DAC policies on a GridWorld. The network is queried once
+        for all states, the policy-induced Markov chain is built over states (PPO) or state x option
+        (OC: option in execution, DAC: previous option) and the start distribution is propagated
+        through it until every episode has ended or t_max steps have passed. This gives the expected
+        discounted test return and expected episode length the Monte Carlo test() estimates, without
+        sampling noise. Returns (average_return, average_length) like the trainers' test()."""
+    def __init__(self, env, params, tol=1e-10):
+        tables = compile_layout(env.layout)
+        self.num_states, self.num_actions = tables.next_state.shape
+        P = transition_matrix(tables)
+        self.P = [P[a * self.num_states:(a + 1) * self.num_states] for a in range(self.num_actions)]
+        self.obs = obs_to_tensor(env.get_all_states()).to(params.device)
+        self.params = params
+        self.tol = tol
+
+    def policy_kernel(self, pi):
+        """state transition matrix under action probabilities pi [S, A]"""
+        return sum(sp.diags(pi[:, a]) @ self.P[a] for a in range(self.num_actions)).tocsr()
+
+    def start_distribution(self, goal):
+        init = np.full(self.num_states, 1. / (self.num_states - 1))
+        init[goal] = 0.
+        return init
+
+    def evaluate_chain(self, M, goal_prob, init):
+        """M: transitions between non-terminal (augmented) states, goal_prob: probability of entering the goal
+            from each of them, init: start distribution"""
+        MT = M.T.tocsr()
+        d = init
+        average_return, average_length, discount = 0., 0., 1.
+        for _ in range(self.params.t_max):
+            alive = d.sum()
+            if alive < self.tol:
+                break
+            average_length += alive
+            average_return += discount * (d @ goal_prob)
+            d = MT @ d
+            discount *= self.params.gamma
+        return average_return, average_length
+
+    def evaluate_ppo(self, actor, goal):
+        with th.no_grad():
+            pi = actor(self.obs).softmax(dim=-1).cpu().double().numpy()
+        K = self.policy_kernel(pi)
+        not_goal = sp.diags((np.arange(self.num_states) != goal).astype(float))
+        return self.evaluate_chain(K @ not_goal, K[:, [goal]].toarray().ravel(), self.start_distribution(goal))
+
+    def evaluate_oc(self, agent, goal):
+        """augmented state (s, w) = option w executing in s. After each step the option terminates with
+            beta_w(s') and is replaced eps_test-greedily w.r.t. Q(s', .)"""
+        n = self.params.num_options
+        with th.no_grad():
+            state = agent.get_state(self.obs).squeeze(0)
+            Q = agent.get_Q(state).cpu().numpy()
+            betas = agent.get_betas(state).cpu().double().numpy()
+            pi = [(agent.options[w](state) / self.params.temp).softmax(dim=-1).cpu().double().numpy() for w in range(n)]
+
+        eps = self.params.eps_test
+        mu = np.full((self.num_states, n), eps / n)    #option choice on termination
+        mu[np.arange(self.num_states), Q.argmax(axis=-1)] += 1 - eps
+
+        not_goal = (np.arange(self.num_states) != goal).astype(float)
+        kernels = [self.policy_kernel(pi[w]) for w in range(n)]
+        blocks = [[kernels[w] @ sp.diags(not_goal * ((1 - betas[:, w]) * (w == w_next) + betas[:, w] * mu[:, w_next]))
+                   for w_next in range(n)] for w in range(n)]
+        goal_prob = np.concatenate([kernels[w][:, [goal]].toarray().ravel() for w in range(n)])
+        init = (self.start_distribution(goal)[:, None] * mu).T.ravel()
+        return self.evaluate_chain(sp.bmat(blocks, format='csr'), goal_prob, init)
+
+    def evaluate_dac(self, network, goal):
+        """augmented state (s, prev) = previous option prev (or none at the episode start) in s. The option is
+            drawn from pi_hat(.|s, prev), the action from its sub-policy, and the option becomes the next prev"""
+        n = self.params.num_options
+        with th.no_grad():
+            prediction = network(self.obs)
+        pi_w = prediction['pi_w'].cpu().double().numpy()
+        betas = prediction['betas'].cpu().double().numpy()
+        pi_W = prediction['pi_W'].cpu().double().numpy()
+
+        #pi_hat for each previous option, plus the initial 'none' row (master policy only)
+        pi_hat = [(1 - betas[:, [p]]) * np.eye(n)[p] + betas[:, [p]] * pi_W for p in range(n)] + [pi_W]
+
+        not_goal = sp.diags((np.arange(self.num_states) != goal).astype(float))
+        kernels = [self.policy_kernel(pi_w[:, w, :]) for w in range(n)]
+        zero = sp.csr_matrix((self.num_states, self.num_states))
+        blocks = [[sp.diags(pi_hat[p][:, w]) @ kernels[w] @ not_goal for w in range(n)] + [zero] for p in range(n + 1)]
+        goal_prob = np.concatenate([sum(pi_hat[p][:, w] * kernels[w][:, [goal]].toarray().ravel() for w in range(n))
+                                    for p in range(n + 1)])
+        init = np.concatenate([np.zeros(n * self.num_states), self.start_distribution(goal)])
+        return self.evaluate_chain(sp.bmat(blocks, format='csr'), goal_prob, init)
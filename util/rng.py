@@ -0,0 +1,55 @@
+import random
+import numpy as np
+import torch as th
+
+
+def stream_generator(seed, stream=0):
+    """numpy Generator on a counter-based Philox stream. Different (seed, stream) pairs give independent
+        sequences, so each env/worker can own a stream without coordinating with the others"""
+    return np.random.Generator(np.random.Philox(np.random.SeedSequence([seed, stream])))
+
+#stream ids of a trial's random components, all derived from its one trial seed (env: GridWorld.reset(seed=...))
+STREAMS = {'env': 0, 'collector': 1, 'evaluator': 2, 'buffer': 3}
+
+def stream_seed(params, stream):
+    """int seed of one of a trial's random streams (STREAMS) for the components seeded with an int (batched envs,
+        evaluator processes, replay buffer). Derived from params.trial_seed, params.seed outside runner trials"""
+    seed = params.seed if params.trial_seed is None else params.trial_seed
+    return int(stream_generator(seed, STREAMS[stream]).integers(2**31 - 1))
+
+def trial_seed(seed, trial):
+    """seed of one trial, derived from the base seed and the trial index only (not from which worker runs it)"""
+    return int(np.random.SeedSequence([seed, trial]).generate_state(1)[0])
+
+def seed_everything(seed):
+    """seeds the global python, numpy and torch generators used by the trainers"""
+    random.seed(seed)
+    np.random.seed(seed)
+    th.manual_seed(seed)
+
+
+class BlockRNG:
+    """scalar random numbers for per-step env code. Uniforms are drawn from a Philox stream in blocks of
+        block_size and handed out from a python list, which is much cheaper than one Generator call per draw"""
+    def __init__(self, seed=1234, block_size=4096):
+        self.block_size = block_size
+        self.seed(seed)
+
+    def seed(self, seed):
+        self.generator = stream_generator(seed, STREAMS['env'])
+        self.block = []
+        self.pos = 0
+
+    def uniform(self):
+        if self.pos == len(self.block):
+            self.block = self.generator.random(self.block_size).tolist()
+            self.pos = 0
+        u = self.block[self.pos]
+        self.pos += 1
+        return u
+
+    def randint(self, n):
+        return int(self.uniform() * n)
+
+    def choice(self, seq):
+        return seq[self.randint(len(seq))]